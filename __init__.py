@@ -1 +1,4 @@
 from ._learner  import AttentionLearner
+from ._actors   import ActorPool, Trajectory, collect_trajectory, replay_trajectory
+from ._serve    import MicroBatchServer, DispatchRequest, collate_requests, dispatch
+from ._live     import LiveARP
@@ -0,0 +1,201 @@
+import torch
+import torch.multiprocessing as mp
+from torch.utils.data import DataLoader
+from collections import namedtuple
+import queue
+
+from marpdan.utils import BucketBatchSampler
+
+
+Step = namedtuple("Step", "vehicles cur_veh_idx mask cur_veh_mask cand_idx cust_idx")
+
+
+class Trajectory:
+    r"""
+    Decoder inputs and actions recorded along one rollout of a minibatch, stacked over its :math:`T` steps
+    (e.g. ``mask`` is a :math:`T \times N \times L_v \times L_c` tensor) so that it is cheap to ship between processes
+    and log-probabilities of the same actions can be recomputed later without stepping the environment again.
+    """
+    def __init__(self, nodes, encodings, steps, logps, rewards, version, bl_vals = None):
+        self.nodes = nodes
+        self.encodings = encodings
+        self.steps = steps
+        self.logps = logps
+        self.rewards = rewards
+        self.version = version
+        self.bl_vals = bl_vals
+
+    def __len__(self):
+        return self.steps.cust_idx.size(0)
+
+    def to(self, device):
+        return Trajectory(self.nodes.to(device),
+                [(t, None if mask is None else mask.to(device)) for t, mask in self.encodings],
+                Step(*(None if f is None else f.to(device) for f in self.steps)),
+                self.logps.to(device), self.rewards.to(device), self.version,
+                None if self.bl_vals is None else self.bl_vals.to(device))
+
+
+def collect_trajectory(learner, dyna, version = 0, bl_vals = None):
+    r"""
+    Sample a rollout of ``learner`` on ``dyna`` without gradients, recording what :func:`replay_trajectory` needs.
+
+    :param version: Version of the weights of ``learner``, to measure the policy lag when replaying
+    :param bl_vals: Precomputed baseline values to ship along with the trajectory
+    """
+    dyna.reset()
+    encodings, steps, logps, rewards = [], [], [], []
+    with torch.no_grad():
+        while not dyna.done:
+            if dyna.new_customers:
+                learner._encode_customers(dyna.nodes, dyna.cust_mask)
+                encodings.append( (len(steps), None if dyna.cust_mask is None else dyna.cust_mask.clone()) )
+            state = [dyna.vehicles.clone(), dyna.cur_veh_idx.clone(), dyna.mask.clone(), dyna.cur_veh_mask.clone(),
+                    learner._get_candidates(dyna)]
+            cust_idx, logp = learner._select( learner._decode(*state) )
+            steps.append( Step(*state, cust_idx) )
+            logps.append( logp )
+            rewards.append( dyna.step(cust_idx) )
+    steps = Step(*(None if f[0] is None else torch.stack(f) for f in zip(*steps)))
+    return Trajectory(dyna.nodes, encodings, steps, torch.stack(logps), torch.stack(rewards), version, bl_vals)
+
+
+def replay_trajectory(learner, traj, baseline = None):
+    r"""
+    Recompute log-probabilities of the actions of ``traj`` under the current weights of ``learner``, with gradients.
+
+    :param baseline: Baseline evaluated at every step from the learner's scores (e.g. :class:`CriticBaseline`),
+            or None
+    :return:         Tuple of the list of :math:`T` log-probabilities and the list of baseline values
+            (a single tensor if ``baseline`` uses cumulated rewards, empty if no ``baseline`` is given)
+    """
+    encodings = dict(traj.encodings)
+    logps, bl_vals = [], []
+    for t in range(len(traj)):
+        if t in encodings:
+            learner._encode_customers(traj.nodes, encodings[t])
+        step = Step(*(None if f is None else f[t] for f in traj.steps))
+        veh_repr = learner._repr_vehicle(step.vehicles, step.cur_veh_idx, step.mask)
+        compat = learner._score_customers(veh_repr, step.cand_idx, step.cur_veh_mask)
+        logp = learner._get_logp(compat, step.cur_veh_mask)
+        if baseline is not None and not (baseline.use_cumul and bl_vals):
+            bl_vals.append( baseline.eval_step(step, compat, step.cust_idx) )
+        logps.append( logp.gather(1, step.cust_idx) )
+    if baseline is not None and baseline.use_cumul:
+        bl_vals = bl_vals[0]
+    return logps, bl_vals
+
+
+def _run_actor(rank, make_learner, params, version, lock, stop, traj_queue,
+        data, ep_data, Environment, env_params, batch_size, bucket_batches, seed):
+    torch.set_num_threads(1)
+    if seed is not None:
+        torch.manual_seed(seed + rank)
+    learner = make_learner()
+    learner.train() # Same batch norm behaviour as the learner replaying trajectories
+    cur_version = -1
+    if bucket_batches:
+        loader = DataLoader(ep_data, batch_sampler = BucketBatchSampler(ep_data.nodes_counts(), batch_size, True),
+                collate_fn = ep_data.collate)
+    else:
+        loader = DataLoader(ep_data, batch_size, True)
+
+    while not stop.is_set():
+        for minibatch in loader:
+            if stop.is_set():
+                break
+            if version.value != cur_version:
+                with lock:
+                    learner.load_state_dict(params)
+                    cur_version = version.value
+
+            bl_vals = None
+            if ep_data is not data:
+                minibatch, bl_vals = minibatch
+            if data.cust_mask is None:
+                custs, mask = minibatch, None
+            else:
+                custs, mask = minibatch
+            traj = collect_trajectory(learner, Environment(data, custs, mask, *env_params), cur_version, bl_vals)
+
+            while not stop.is_set():
+                try:
+                    traj_queue.put(traj, timeout = 0.1)
+                    break
+                except queue.Full:
+                    pass
+    traj_queue.cancel_join_thread()
+
+
+class ActorPool:
+    r"""
+    Worker processes sampling trajectories with periodically synced copies of the learner,
+    and shipping them through a bounded queue (tensors are moved to shared memory).
+    """
+    def __init__(self, make_learner, learner, data, ep_data, Environment, env_params, batch_size,
+            actor_count = 2, max_lag = 4, queue_size = None, bucket_batches = False, seed = None):
+        r"""
+        :param make_learner: Picklable callable building a learner with the same architecture as ``learner``
+        :param ep_data:      Dataset actors sample minibatches from, either ``data`` or ``data`` with
+                precomputed baseline values
+        :param max_lag:      Trajectories sampled with weights more than ``max_lag`` versions older
+                than the last published ones are dropped
+        :param queue_size:   Maximum number of trajectories waiting for the learner, defaults to twice ``actor_count``
+        """
+        ctx = mp.get_context("spawn")
+        self.params = {k: v.detach().cpu().clone().share_memory_() for k,v in learner.state_dict().items()}
+        self.version = ctx.Value('i', 0)
+        self.lock = ctx.Lock()
+        self.stop = ctx.Event()
+        self.queue = ctx.Queue(2 * actor_count if queue_size is None else queue_size)
+        self.max_lag = max_lag
+        self.dropped = 0
+        self.actors = [ctx.Process(target = _run_actor, args = (rank, make_learner, self.params,
+                self.version, self.lock, self.stop, self.queue,
+                data, ep_data, Environment, env_params, batch_size, bucket_batches, seed), daemon = True)
+                for rank in range(actor_count)]
+        for actor in self.actors:
+            actor.start()
+
+    def publish(self, learner):
+        r"""
+        Copy the current weights of ``learner`` to the actors, which load them before their next rollout.
+        """
+        with self.lock:
+            for k,v in learner.state_dict().items():
+                self.params[k].copy_(v)
+            self.version.value += 1
+
+    def _check_actors(self):
+        for rank, actor in enumerate(self.actors):
+            if not actor.is_alive():
+                raise RuntimeError("Actor #{} exited unexpectedly with code {}".format(rank, actor.exitcode))
+
+    def get(self, poll_interval = 1.0):
+        r"""
+        :param poll_interval: Seconds to wait for a trajectory before checking that all actors are still alive
+
+        :return: Next trajectory whose policy lag is within bounds, and its lag
+        """
+        while True:
+            try:
+                traj = self.queue.get(timeout = poll_interval)
+            except queue.Empty:
+                self._check_actors()
+                continue
+            lag = self.version.value - traj.version
+            if lag <= self.max_lag:
+                return traj, lag
+            self.dropped += 1
+
+    def close(self):
+        # Actors do not wait for the learner to consume trajectories they already queued before exiting
+        self.stop.set()
+        for actor in self.actors:
+            actor.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -1,18 +1,30 @@
-from marpdan.layers import TransformerEncoder, MultiHeadAttention
+from marpdan.layers import TransformerEncoder, SparseTransformerEncoder, MultiHeadAttention, nearest_nodes
 
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
+from torch.utils.checkpoint import checkpoint
+from contextlib import contextmanager, nullcontext
 
 class AttentionLearner(nn.Module):
     def __init__(self, cust_feat_size, veh_state_size, model_size = 128,
-            layer_count = 3, head_count = 8, ff_size = 512, tanh_xplor = 10, greedy = False):
+            layer_count = 3, head_count = 8, ff_size = 512, tanh_xplor = 10, greedy = False, cand_count = None,
+            enc_nbr_count = None, ckpt_encoder = False, ckpt_segment = None, autocast_dtype = None):
         r"""
         :param model_size:  Dimension :math:`D` shared by all intermediate layers
         :param layer_count: Number of layers in customers' (graph) Transformer Encoder
         :param head_count:  Number of heads in all Multi-Head Attention layers
         :param ff_size:     Dimension of the feed-forward sublayers in Transformer Encoder
         :param tanh_xplor:  Enable tanh exploration and set its amplitude
+        :param cand_count:  Enable candidate lists and set the number :math:`K` of nearest customers
+                scored at every step besides the depot
+        :param enc_nbr_count: Use a sparse encoder where every customer only attends over the depot
+                and its ``enc_nbr_count`` nearest neighbours
+        :param ckpt_encoder:  Recompute encoder layers during backward instead of storing their activations
+        :param ckpt_segment:  Recompute decoding steps during backward, by segments of ``ckpt_segment`` steps
+        :param autocast_dtype: Run the matmuls of the encoder and decoder under autocast to this lower precision
+                (e.g. ``torch.bfloat16``), while customer and vehicle representations, scores, log-probabilities
+                and environment states stay in float32
         """
         super().__init__()
 
@@ -23,14 +35,27 @@ class AttentionLearner(nn.Module):
 
         self.depot_embedding = nn.Linear(cust_feat_size, model_size)
         self.cust_embedding  = nn.Linear(cust_feat_size, model_size)
-        self.cust_encoder    = TransformerEncoder(layer_count, head_count, model_size, ff_size)
+        if enc_nbr_count is None:
+            self.cust_encoder = TransformerEncoder(layer_count, head_count, model_size, ff_size)
+        else:
+            self.cust_encoder = SparseTransformerEncoder(layer_count, head_count, model_size, ff_size, enc_nbr_count)
+        self.enc_nbr_count = enc_nbr_count
+        self.cust_encoder.checkpoint = ckpt_encoder
 
         self.fleet_attention = MultiHeadAttention(head_count, veh_state_size, model_size)
         self.veh_attention   = MultiHeadAttention(head_count, model_size)
         self.cust_project    = nn.Linear(model_size, model_size)
 
         self.greedy = greedy
+        self.cand_count = cand_count
+        self.ckpt_segment = ckpt_segment
+        self.autocast_dtype = autocast_dtype
+
 
+    def _autocast(self):
+        if self.autocast_dtype is None:
+            return nullcontext()
+        return torch.autocast(self.cust_project.weight.device.type, dtype = self.autocast_dtype)
 
     def _encode_customers(self, customers, mask = None):
         r"""
@@ -38,17 +63,49 @@ class AttentionLearner(nn.Module):
         :param mask:      :math:`N \times L_c` tensor containing minibatch of masks
                 where :math:`m_{nj} = 1` if customer :math:`j` in sample :math:`n` is hidden (pad or dyn), 0 otherwise
         """
-        cust_emb = torch.cat((
-            self.depot_embedding(customers[:,0:1,:]),
-            self.cust_embedding(customers[:,1:,:])
-            ), dim = 1) #.size() = N x L_c x D
-        if mask is not None:
-            cust_emb[mask] = 0
-        self.cust_enc = self.cust_encoder(cust_emb, mask) #.size() = N x L_c x D
-        self.fleet_attention.precompute(self.cust_enc)
-        self.cust_repr = self.cust_project(self.cust_enc) #.size() = N x L_c x D
-        if mask is not None:
-            self.cust_repr[mask] = 0
+        with self._autocast():
+            cust_emb = torch.cat((
+                self.depot_embedding(customers[:,0:1,:]),
+                self.cust_embedding(customers[:,1:,:])
+                ), dim = 1) #.size() = N x L_c x D
+            if mask is not None:
+                cust_emb[mask] = 0
+            if self.enc_nbr_count is None:
+                self.cust_enc = self.cust_encoder(cust_emb, mask) #.size() = N x L_c x D
+            else:
+                self.cust_enc = self.cust_encoder(cust_emb, mask, customers[:,:,:2])
+            self.fleet_attention.precompute(self.cust_enc)
+            # Scores are computed from float32 representations, their precision matters more than their cost
+            self.cust_repr = self.cust_project(self.cust_enc).float() #.size() = N x L_c x D
+            if mask is not None:
+                self.cust_repr[mask] = 0
+        if self.cand_count is not None:
+            self._index_candidates(customers)
+
+
+    def _index_candidates(self, customers):
+        r"""
+        :param customers: :math:`N \times L_c \times D_c` tensor containing minibatch of customers' features
+        """
+        self.cand_index = nearest_nodes(customers[:,:,:2], 4 * self.cand_count) #.size() = N x L_c x M
+
+
+    def _get_candidates(self, dyna):
+        r"""
+        :param dyna: Environment in its current state, for which to select candidates
+                among the neighbours of the node where the acting vehicle stands (``dyna.cur_veh_node``)
+
+        :return:     :math:`N \times (K+1)` tensor containing minibatch of candidates indices (depot first),
+                or None if candidate lists are disabled
+        """
+        if self.cand_count is None:
+            return None
+        nbrs = self.cand_index.gather(1, dyna.cur_veh_node[:,:,None].expand(-1,-1,self.cand_index.size(2))
+                ).squeeze(1) #.size() = N x M
+        free = dyna.cur_veh_mask.squeeze(1).gather(1, nbrs) ^ True
+        pos = torch.arange(nbrs.size(1), device = nbrs.device)
+        first = (pos + (free ^ True).long() * nbrs.size(1)).argsort(dim = 1)[:, :self.cand_count]
+        return torch.cat((nbrs.new_zeros((nbrs.size(0), 1)), nbrs.gather(1, first)), dim = 1)
 
 
     def _repr_vehicle(self, vehicles, veh_idx, mask):
@@ -60,18 +117,37 @@ class AttentionLearner(nn.Module):
 
         :return:         :math:`N \times 1 \times D` tensor containing minibatch of representations for currently acting vehicle
         """
-        fleet_repr = self.fleet_attention(vehicles, mask = mask) #.size() = N x L_v x D
-        veh_query = fleet_repr.gather(1, veh_idx.unsqueeze(2).expand(-1, -1, self.model_size)) #.size() = N x 1 x D
-        return self.veh_attention(veh_query, fleet_repr, fleet_repr) #.size() = N x 1 x D
+        with self._autocast():
+            fleet_repr = self.fleet_attention(vehicles, mask = mask) #.size() = N x L_v x D
+            veh_query = fleet_repr.gather(1, veh_idx.unsqueeze(2).expand(-1, -1, self.model_size)) #.size() = N x 1 x D
+            veh_repr = self.veh_attention(veh_query, fleet_repr, fleet_repr) #.size() = N x 1 x D
+        return veh_repr.float()
 
 
-    def _score_customers(self, veh_repr):
+    def _score_customers(self, veh_repr, cand_idx = None, veh_mask = None):
         r"""
         :param veh_repr: :math:`N \times 1 \times D` tensor containing minibatch of representations for currently acting vehicle
+        :param cand_idx: :math:`N \times (K+1)` tensor containing minibatch of candidates indices from :meth:`_get_candidates`,
+                or None to score all customers
+        :param veh_mask: :math:`N \times 1 \times L_c` tensor containing minibatch of masks for currently acting vehicle,
+                required with ``cand_idx`` to fall back to all customers when no candidate except the depot can be served
 
         :return:         :math:`N \times 1 \times L_c` tensor containing minibatch of compatibility scores between currently acting vehicle and each customer
+                (:math:`-\infty` for customers outside candidates)
         """
-        compat = veh_repr.matmul( self.cust_repr.transpose(1, 2) ) #.size() = N x 1 x L_c
+        if cand_idx is None:
+            return self._compat(veh_repr, self.cust_repr)
+        cand_repr = self.cust_repr.gather(1, cand_idx[:,:,None].expand(-1,-1,self.model_size)) #.size() = N x (K+1) x D
+        compat = veh_repr.new_full((veh_repr.size(0), 1, self.cust_repr.size(1)), -float('inf')).scatter(
+                2, cand_idx.unsqueeze(1), self._compat(veh_repr, cand_repr)) #.size() = N x 1 x L_c
+        fallback = veh_mask.squeeze(1).gather(1, cand_idx[:,1:]).all(dim = 1)
+        if fallback.any():
+            compat[fallback] = self._compat(veh_repr[fallback], self.cust_repr[fallback])
+        return compat
+
+
+    def _compat(self, veh_repr, cust_repr):
+        compat = veh_repr.matmul( cust_repr.transpose(1, 2) )
         compat *= self.inv_sqrt_d
         if self.tanh_xplor is not None:
             compat = self.tanh_xplor * compat.tanh()
@@ -90,10 +166,13 @@ class AttentionLearner(nn.Module):
         return compat.log_softmax(dim = 2).squeeze(1)
 
 
-    def step(self, dyna):
-        veh_repr = self._repr_vehicle(dyna.vehicles, dyna.cur_veh_idx, dyna.mask)
-        compat = self._score_customers(veh_repr)
-        logp = self._get_logp(compat, dyna.cur_veh_mask)
+    def _decode(self, vehicles, veh_idx, mask, veh_mask, cand_idx):
+        veh_repr = self._repr_vehicle(vehicles, veh_idx, mask)
+        compat = self._score_customers(veh_repr, cand_idx, veh_mask)
+        return self._get_logp(compat, veh_mask)
+
+
+    def _select(self, logp):
         if self.greedy:
             cust_idx = logp.argmax(dim = 1, keepdim = True)
         else:
@@ -101,12 +180,65 @@ class AttentionLearner(nn.Module):
         return cust_idx, logp.gather(1, cust_idx)
 
 
+    def step(self, dyna):
+        return self._select( self._decode(dyna.vehicles, dyna.cur_veh_idx, dyna.mask, dyna.cur_veh_mask,
+            self._get_candidates(dyna)) )
+
+
+    @contextmanager
+    def _bind_encoding(self, cust_repr, k_proj, v_proj):
+        r"""Temporarily decode from the given customers' representations and projected keys and values
+        instead of the latest ones."""
+        saved = self.cust_repr, self.fleet_attention._k_proj, self.fleet_attention._v_proj
+        self.cust_repr, self.fleet_attention._k_proj, self.fleet_attention._v_proj = cust_repr, k_proj, v_proj
+        try:
+            yield
+        finally:
+            self.cust_repr, self.fleet_attention._k_proj, self.fleet_attention._v_proj = saved
+
+
+    def _checkpoint_segment(self, dyna, actions, logps, rewards):
+        r"""
+        Decode up to ``ckpt_segment`` steps without storing intermediate activations.
+        The first run steps the environment and records its states and the sampled actions,
+        which the recomputation during backward replays instead of stepping and sampling again.
+        Stops early when new customers must be encoded.
+        The encoding of customers is an explicit input of the checkpoint, so that a segment is
+        recomputed against its own encoding even if customers have been re-encoded since (dynamic problems).
+        """
+        states = []
+        def run_segment(*encoding):
+            with self._bind_encoding(*encoding):
+                if states:
+                    return torch.stack([self._decode(*state).gather(1, cust_idx) for *state, cust_idx in states])
+                return decode_segment()
+        def decode_segment():
+            seg_logps = []
+            while len(states) < self.ckpt_segment and not dyna.done:
+                state = [dyna.vehicles.clone(), dyna.cur_veh_idx, dyna.mask.clone(), dyna.cur_veh_mask.clone(),
+                        self._get_candidates(dyna)]
+                logp = self._decode(*state)
+                cust_idx, _ = self._select(logp.detach())
+                states.append( state + [cust_idx] )
+                seg_logps.append( logp.gather(1, cust_idx) )
+                actions.append( (dyna.cur_veh_idx, cust_idx) )
+                rewards.append( dyna.step(cust_idx) )
+                if dyna.new_customers:
+                    break
+            return torch.stack(seg_logps)
+        encoding = (self.cust_repr, self.fleet_attention._k_proj, self.fleet_attention._v_proj)
+        logps.extend( checkpoint(run_segment, *encoding, use_reentrant = False).unbind(0) )
+
+
     def forward(self, dyna):
         dyna.reset()
         actions, logps, rewards = [], [], []
         while not dyna.done:
             if dyna.new_customers:
                 self._encode_customers(dyna.nodes, dyna.cust_mask)
+            if self.ckpt_segment is not None and torch.is_grad_enabled():
+                self._checkpoint_segment(dyna, actions, logps, rewards)
+                continue
             cust_idx, logp = self.step(dyna)
             actions.append( (dyna.cur_veh_idx, cust_idx) )
             logps.append( logp )
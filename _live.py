@@ -0,0 +1,178 @@
+from marpdan._serve import decode_step
+
+import torch
+
+
+class LiveARP:
+    r"""
+    Persistent state of an ambulance fleet in operation, updated in place by events as they happen
+    (:meth:`add_call` when a new emergency call comes in, :meth:`complete` when an ambulance reaches its destination)
+    and queried for the next destination of an idle ambulance with :meth:`decide`.
+
+    Nodes use the features of :class:`ARP_Dataset` (``x, y, demand, survival_time, time_window_ub``) with absolute
+    times, except for the hospital whose deadlines are zero rather than infinite so that the encoder can embed them.
+    Customer encodings are cached and reused by all decisions until the set of patients changes:
+    when new calls are pending, the next decision drops served and expired patients and encodes the new set.
+    Between two new calls, a decision only runs the decoder on the current fleet state and masks.
+    """
+    def __init__(self, learner, hospital, veh_count, veh_capa = 2, veh_speed = 1, now = 0.0, device = None):
+        r"""
+        :param learner:  :class:`AttentionLearner` trained on ARP, in eval mode
+        :param hospital: :math:`(x, y)` coordinates of the hospital, where all ambulances start
+        """
+        self.learner = learner
+        self.veh_count = veh_count
+        self.veh_capa = veh_capa
+        self.veh_speed = veh_speed
+        self.device = device
+        self.now = now
+
+        self.nodes = torch.zeros((1, 5), device = device)
+        self.nodes[0, :2] = torch.tensor(hospital, dtype = torch.float)
+        self.node_ids = [None]
+        self.served = torch.zeros(1, dtype = torch.bool, device = device)
+        self.new_calls = []
+        self.next_id = 0
+
+        self.vehicles = self.nodes.new_zeros((veh_count, 5)) # x, y, remaining capacity, time, patients onboard
+        self.vehicles[:, :2] = self.nodes[0, :2]
+        self.vehicles[:, 2] = veh_capa
+        self.vehicles[:, 3] = now
+        self.onboard = self.nodes.new_full((veh_count, veh_capa), float('inf'))
+        self.dest = [None] * veh_count # Node index each ambulance is heading to, None if idle
+
+        self.encode_count = 0
+        self.decision_count = 0
+        self._encoded = False
+
+    def _advance(self, time):
+        if time is not None:
+            self.now = max(self.now, time)
+
+    def add_call(self, x, y, survival_time, call_id = None, time = None):
+        r"""
+        :param survival_time: Time left from now until the patient must reach the hospital
+        :return:              Identifier of the call
+        """
+        self._advance(time)
+        if call_id is None:
+            call_id = self.next_id
+            self.next_id += 1
+        deadline = self.now + survival_time
+        to_hospital = ((x - self.nodes[0,0].item())**2 + (y - self.nodes[0,1].item())**2) ** 0.5 / self.veh_speed
+        self.new_calls.append( (call_id, [x, y, 1.0, deadline, deadline - to_hospital]) )
+        return call_id
+
+    def cancel_call(self, call_id):
+        r"""
+        Remove a call which does not need an ambulance anymore, without invalidating cached encodings.
+        """
+        self.new_calls = [(cid, feat) for cid, feat in self.new_calls if cid != call_id]
+        if call_id in self.node_ids:
+            j = self.node_ids.index(call_id)
+            if j in self.dest:
+                raise ValueError("Call {} is already assigned to ambulance {}".format(call_id, self.dest.index(j)))
+            self.served[j] = True
+
+    def complete(self, veh_idx, time = None):
+        r"""
+        Ambulance ``veh_idx`` reached its destination: pick up the patient, or drop off all patients at the hospital.
+        """
+        self._advance(time)
+        j = self.dest[veh_idx]
+        if j is None:
+            raise ValueError("Ambulance {} is not heading anywhere".format(veh_idx))
+        veh = self.vehicles[veh_idx]
+        veh[:2] = self.nodes[j, :2]
+        veh[3] = self.now
+        if j == 0:
+            self.onboard[veh_idx] = float('inf')
+            veh[2] = self.veh_capa
+            veh[4] = 0
+        else:
+            self.onboard[veh_idx, int(veh[4].item())] = self.nodes[j, 3]
+            veh[2] -= 1
+            veh[4] += 1
+            self.served[j] = True
+        self.dest[veh_idx] = None
+
+    def _compact(self):
+        # Patients assigned to an ambulance on its way are kept even if their deadline passed
+        keep = [0] + [j for j in range(1, len(self.node_ids))
+                if j in self.dest or (not self.served[j] and self.nodes[j, 3] > self.now)]
+        remap = {j: k for k, j in enumerate(keep)}
+        self.dest = [None if j is None else remap[j] for j in self.dest]
+        new_feats = self.nodes.new_tensor([feat for _, feat in self.new_calls]).view(-1, 5)
+        self.nodes = torch.cat((self.nodes[keep], new_feats), dim = 0)
+        self.node_ids = [self.node_ids[j] for j in keep] + [cid for cid, _ in self.new_calls]
+        self.served = torch.cat((self.served[keep], self.served.new_zeros(len(self.new_calls))))
+        self.new_calls = []
+
+    def _encode(self):
+        with torch.no_grad():
+            self.learner._encode_customers(self.nodes.unsqueeze(0))
+        self.encode_count += 1
+        self._encoded = True
+
+    def _times(self):
+        return self.vehicles[:, 3].clamp(min = self.now)
+
+    def _mask(self):
+        r"""
+        :return: :math:`L_v \times L_c` tensor where :math:`m_{ij} = 1` if ambulance :math:`i` cannot go to node :math:`j`
+                now, with the same rules as :class:`ARP_Environment` and all patients masked for busy ambulances
+        """
+        pos = self.nodes[:, :2]
+        hosp = self.nodes[0, :2]
+        travel = (self.vehicles[:, None, :2] - pos[None, :, :]).norm(dim = 2) / self.veh_speed #.size() = L_v x L_c
+        arrival = self._times()[:, None] + travel
+        to_hospital = (pos - hosp).norm(dim = 1) / self.veh_speed #.size() = L_c
+        mask = (arrival > self.nodes[None, :, 3]) | (arrival > self.nodes[None, :, 4]) \
+                | self.served[None, :] | (self.vehicles[:, 2:3] < self.nodes[None, :, 2]) \
+                | (arrival + to_hospital[None, :] > self.onboard.min(dim = 1)[0][:, None])
+        for i, j in enumerate(self.dest):
+            if j is not None:
+                mask[i] = True
+                mask[:, j] = True
+        mask[:, 0] = False # Hospital is always available
+        return mask
+
+    def idle(self):
+        r"""
+        :return: Indices of ambulances waiting for a decision, by earliest availability
+        """
+        times = self._times()
+        return sorted((i for i in range(self.veh_count) if self.dest[i] is None), key = lambda i: times[i].item())
+
+    def decide(self, veh_idx = None, time = None):
+        r"""
+        :param veh_idx: Idle ambulance to dispatch, defaults to the one available the earliest
+        :return:        Tuple of the ambulance index, the call it should pick up (None to go to the hospital,
+                or wait there if it is already empty at the hospital) and its estimated time of arrival
+        """
+        self._advance(time)
+        if veh_idx is None:
+            idle = self.idle()
+            if not idle:
+                raise ValueError("No idle ambulance to dispatch")
+            veh_idx = idle[0]
+        elif self.dest[veh_idx] is not None:
+            raise ValueError("Ambulance {} is already heading to a node".format(veh_idx))
+        if self.new_calls:
+            self._compact()
+            self._encoded = False
+        if not self._encoded:
+            self._encode()
+
+        veh_idx_t = torch.tensor([[veh_idx]], device = self.nodes.device)
+        cust_idx, _ = decode_step(self.learner, self.nodes.unsqueeze(0), self.vehicles.unsqueeze(0), veh_idx_t,
+                self._mask().unsqueeze(0))
+        j = cust_idx.item()
+        self.decision_count += 1
+        eta = self._times()[veh_idx].item() + (self.vehicles[veh_idx, :2] - self.nodes[j, :2]).norm().item() \
+                / self.veh_speed
+        waiting = j == 0 and self.vehicles[veh_idx, 4] == 0 \
+                and bool((self.vehicles[veh_idx, :2] == self.nodes[0, :2]).all())
+        if not waiting:
+            self.dest[veh_idx] = j
+        return veh_idx, self.node_ids[j], eta
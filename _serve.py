@@ -0,0 +1,257 @@
+import torch
+import asyncio
+import json
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+
+class DispatchRequest:
+    r"""
+    State of a single instance at a decision point, parsed from a JSON message with fields
+    ``nodes`` (:math:`L_c \times D_c` features of the depot then customers, normalized as during training),
+    ``vehicles`` (:math:`L_v \times D_v` vehicle states), ``veh_idx`` (index of the vehicle to dispatch),
+    ``mask`` (:math:`L_v \times L_c`, non-zero where a vehicle cannot serve a customer)
+    and optionally ``cust_mask`` (:math:`L_c`, non-zero for customers not revealed yet).
+    """
+    def __init__(self, msg, cust_feat_size, veh_state_size):
+        self.id = msg.get("id")
+        self.nodes = torch.tensor(msg["nodes"], dtype = torch.float)
+        self.vehicles = torch.tensor(msg["vehicles"], dtype = torch.float)
+        self.veh_idx = int(msg["veh_idx"])
+        self.mask = torch.tensor(msg["mask"], dtype = torch.bool)
+        self.cust_mask = None if msg.get("cust_mask") is None else torch.tensor(msg["cust_mask"], dtype = torch.bool)
+
+        cust_count, veh_count = self.nodes.size(0), self.vehicles.size(0)
+        if self.nodes.dim() != 2 or self.nodes.size(1) != cust_feat_size:
+            raise ValueError("Expected nodes of size L_c x {}, got {}".format(cust_feat_size, list(self.nodes.size())))
+        if self.vehicles.dim() != 2 or self.vehicles.size(1) != veh_state_size:
+            raise ValueError("Expected vehicles of size L_v x {}, got {}".format(
+                veh_state_size, list(self.vehicles.size())))
+        if self.mask.size() != (veh_count, cust_count):
+            raise ValueError("Expected mask of size {} x {}, got {}".format(
+                veh_count, cust_count, list(self.mask.size())))
+        if self.cust_mask is not None and self.cust_mask.size() != (cust_count,):
+            raise ValueError("Expected cust_mask of size {}, got {}".format(cust_count, list(self.cust_mask.size())))
+        if not 0 <= self.veh_idx < veh_count:
+            raise ValueError("Vehicle index {} out of range for {} vehicles".format(self.veh_idx, veh_count))
+        if self.mask[self.veh_idx].all():
+            raise ValueError("Vehicle {} cannot serve any node".format(self.veh_idx))
+
+
+def collate_requests(requests, device = None):
+    r"""
+    Stack requests with the same number of vehicles into a minibatch, padding customers to the largest count.
+    Padded customers are hidden from the encoder and masked for all vehicles.
+
+    :return: Tuple of minibatch tensors (``nodes``, ``cust_mask``, ``vehicles``, ``veh_idx``, ``mask``)
+            with sizes :math:`N \times L_c \times D_c`, :math:`N \times L_c` (or None when no customer is hidden),
+            :math:`N \times L_v \times D_v`, :math:`N \times 1` and :math:`N \times L_v \times L_c`
+    """
+    cust_count = max(req.nodes.size(0) for req in requests)
+    veh_count = requests[0].vehicles.size(0)
+    nodes = requests[0].nodes.new_zeros((len(requests), cust_count, requests[0].nodes.size(1)))
+    cust_mask = torch.zeros((len(requests), cust_count), dtype = torch.bool)
+    mask = torch.ones((len(requests), veh_count, cust_count), dtype = torch.bool)
+    for n, req in enumerate(requests):
+        l_c = req.nodes.size(0)
+        nodes[n, :l_c] = req.nodes
+        cust_mask[n, l_c:] = True
+        if req.cust_mask is not None:
+            cust_mask[n, :l_c] = req.cust_mask
+        mask[n, :, :l_c] = req.mask
+    vehicles = torch.stack([req.vehicles for req in requests])
+    veh_idx = torch.tensor([[req.veh_idx] for req in requests])
+    return (nodes.to(device), cust_mask.to(device) if cust_mask.any() else None, vehicles.to(device),
+            veh_idx.to(device), mask.to(device))
+
+
+def decode_step(learner, nodes, vehicles, veh_idx, mask):
+    r"""
+    Decode a single step for the vehicle to dispatch in each instance of a minibatch,
+    whose customers must already be encoded by the learner.
+
+    :return: :math:`N \times 1` tensors of chosen node indices and their log-probabilities
+    """
+    with torch.no_grad():
+        veh_mask = mask.gather(1, veh_idx[:,:,None].expand(-1, -1, mask.size(2))) #.size() = N x 1 x L_c
+        cand_idx = None
+        if learner.cand_count is not None:
+            cur_veh = vehicles.gather(1, veh_idx[:,:,None].expand(-1, -1, vehicles.size(2)))
+            # Requests only give positions, vehicles stand on the node at the same location
+            cur_veh_node = (nodes[:,:,:2] == cur_veh[:,:,:2]).all(dim = 2).long().argmax(dim = 1, keepdim = True)
+            cand_idx = learner._get_candidates(SimpleNamespace(cur_veh_node = cur_veh_node,
+                cur_veh_mask = veh_mask))
+        logp = learner._decode(vehicles, veh_idx, mask, veh_mask, cand_idx)
+        return learner._select(logp)
+
+
+def dispatch(learner, nodes, cust_mask, vehicles, veh_idx, mask):
+    r"""
+    Encode a minibatch of instances and decode a single step for the vehicle to dispatch in each of them.
+
+    :return: :math:`N \times 1` tensors of chosen node indices and their log-probabilities
+    """
+    with torch.no_grad():
+        learner._encode_customers(nodes, cust_mask)
+    return decode_step(learner, nodes, vehicles, veh_idx, mask)
+
+
+class MicroBatchServer:
+    r"""
+    Asyncio server answering dispatch requests of single instances. Pending requests are coalesced into a
+    minibatch until ``max_batch`` of them are waiting or ``max_wait`` seconds have passed since the first one,
+    then the minibatch runs on a worker thread while the event loop keeps accepting requests.
+    Messages are newline-delimited JSON objects: dispatch requests (see :class:`DispatchRequest`) are answered
+    with ``{"id", "node", "prob"}`` or ``{"id", "error"}``, ``{"type": "stats"}`` with :meth:`stats`
+    and ``{"type": "info"}`` with ``info``.
+    """
+    def __init__(self, learner, cust_feat_size, veh_state_size, device = None, max_batch = 256, max_wait = 0.005,
+            history = 10000, info = None):
+        self.learner = learner
+        self.cust_feat_size = cust_feat_size
+        self.veh_state_size = veh_state_size
+        self.device = device
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.info = dict(info or {}, cust_feat_size = cust_feat_size, veh_state_size = veh_state_size)
+
+        self.executor = ThreadPoolExecutor(1)
+        self.pending = []
+        self.wakeup = None
+        self.full = None
+
+        self.latencies = deque(maxlen = history)
+        self.done_times = deque(maxlen = history)
+        self.batch_sizes = deque(maxlen = history)
+        self.served = 0
+        self.start = time.perf_counter()
+
+    def _run_batch(self, batch):
+        results = [None] * len(batch)
+        groups = {}
+        for k, (req, _, _) in enumerate(batch):
+            groups.setdefault(req.vehicles.size(0), []).append(k)
+        for idx in groups.values():
+            cust_idx, logp = dispatch(self.learner, *collate_requests([batch[k][0] for k in idx], self.device))
+            for k, node, lp in zip(idx, cust_idx.squeeze(1).tolist(), logp.squeeze(1).exp().tolist()):
+                results[k] = {"id": batch[k][0].id, "node": node, "prob": lp}
+        return results
+
+    async def _batch_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await self.wakeup.wait()
+            try:
+                await asyncio.wait_for(self.full.wait(), self.max_wait)
+            except asyncio.TimeoutError:
+                pass
+            batch, self.pending = self.pending[:self.max_batch], self.pending[self.max_batch:]
+            if len(self.pending) < self.max_batch:
+                self.full.clear()
+            if not self.pending:
+                self.wakeup.clear()
+            try:
+                results = await loop.run_in_executor(self.executor, self._run_batch, batch)
+            except Exception as e:
+                results = [{"id": req.id, "error": "{}: {}".format(type(e).__name__, e)} for req, _, _ in batch]
+            now = time.perf_counter()
+            for (_, fut, t0), res in zip(batch, results):
+                self.latencies.append(now - t0)
+                self.done_times.append(now)
+                fut.set_result(res)
+            self.batch_sizes.append(len(batch))
+            self.served += len(batch)
+
+    async def submit(self, msg):
+        r"""
+        :param msg: Decoded JSON message of a dispatch request
+        :return:    Response to the request, once its minibatch has run
+        """
+        t0 = time.perf_counter()
+        try:
+            req = DispatchRequest(msg, self.cust_feat_size, self.veh_state_size)
+        except (KeyError, TypeError, ValueError, RuntimeError) as e:
+            return {"id": msg.get("id"), "error": "{}: {}".format(type(e).__name__, e)}
+        fut = asyncio.get_running_loop().create_future()
+        self.pending.append( (req, fut, t0) )
+        self.wakeup.set()
+        if len(self.pending) >= self.max_batch:
+            self.full.set()
+        return await fut
+
+    def stats(self):
+        r"""
+        :return: Dict of latency percentiles in ms and throughput in requests per second over recent requests,
+                and mean minibatch size
+        """
+        lat = sorted(self.latencies)
+        if not lat:
+            return {"served": self.served}
+        span = self.done_times[-1] - self.done_times[0]
+        return {
+                "served": self.served,
+                "p50_ms": 1e3 * lat[len(lat) // 2],
+                "p99_ms": 1e3 * lat[min(len(lat) - 1, int(0.99 * len(lat)))],
+                "req_s": (len(self.done_times) - 1) / span if span > 0 else None,
+                "mean_batch": sum(self.batch_sizes) / len(self.batch_sizes)
+                }
+
+    async def _handle(self, msg, writer, lock):
+        if msg.get("type") == "stats":
+            res = self.stats()
+        elif msg.get("type") == "info":
+            res = self.info
+        else:
+            res = await self.submit(msg)
+        async with lock:
+            writer.write(json.dumps(res).encode() + b'\n')
+            await writer.drain()
+
+    async def handle_client(self, reader, writer):
+        lock = asyncio.Lock()
+        tasks = set()
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    msg = json.loads(line)
+                except ValueError:
+                    msg = None
+                if not isinstance(msg, dict):
+                    async with lock:
+                        writer.write(json.dumps({"error": "Malformed request"}).encode() + b'\n')
+                    continue
+                # Requests of the same connection may be pipelined, answers carry their id
+                task = asyncio.ensure_future(self._handle(msg, writer, lock))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            if tasks:
+                await asyncio.gather(*tasks)
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host = "127.0.0.1", port = 8765, report_period = None):
+        self.wakeup = asyncio.Event()
+        self.full = asyncio.Event()
+        batcher = asyncio.ensure_future(self._batch_loop())
+        server = await asyncio.start_server(self.handle_client, host, port, limit = 2**24)
+        try:
+            async with server:
+                if report_period is None:
+                    await server.serve_forever()
+                while True:
+                    await asyncio.sleep(report_period)
+                    stats = self.stats()
+                    if "p50_ms" in stats:
+                        print("served {served} | p50 {p50_ms:.2f}ms | p99 {p99_ms:.2f}ms | {0} req/s | "
+                                "batch {mean_batch:.1f}".format("-" if stats["req_s"] is None
+                                    else "{:.0f}".format(stats["req_s"]), **stats), flush = True)
+        finally:
+            batcher.cancel()
+            self.executor.shutdown()
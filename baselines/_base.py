@@ -5,21 +5,23 @@ class Baseline:
         self.learner = learner
         self.use_cumul = use_cumul_reward
 
-    def __call__(self, vrp_dynamics):
+    def __call__(self, vrp_dynamics, bl_vals = None):
         if self.use_cumul:
             actions, logps, rewards = self.learner(vrp_dynamics)
             rewards = torch.stack(rewards).sum(dim = 0)
-            bl_vals = self.eval(vrp_dynamics)
+            if bl_vals is None:
+                bl_vals = self.eval(vrp_dynamics)
         else:
-            self.learner._encode_customers(vrp_dynamics.nodes, vrp_dynamics.cust_mask)
             vrp_dynamics.reset()
+            self.learner._encode_customers(vrp_dynamics.nodes, vrp_dynamics.cust_mask)
             actions, logps, rewards, bl_vals = [], [], [], []
             while not vrp_dynamics.done:
                 veh_repr = self.learner._repr_vehicle(
                         vrp_dynamics.vehicles,
                         vrp_dynamics.cur_veh_idx,
                         vrp_dynamics.mask)
-                compat = self.learner._score_customers(veh_repr)
+                compat = self.learner._score_customers(veh_repr,
+                        self.learner._get_candidates(vrp_dynamics), vrp_dynamics.cur_veh_mask)
                 logp = self.learner._get_logp(compat, vrp_dynamics.cur_veh_mask)
                 cust_idx = logp.exp().multinomial(1)
                 bl_vals.append( self.eval_step(vrp_dynamics, compat, cust_idx) )
@@ -27,6 +29,7 @@ class Baseline:
                 logps.append( logp.gather(1, cust_idx) )
                 r = vrp_dynamics.step(cust_idx)
                 rewards.append(r)
+            bl_vals = self.eval_trajectory(vrp_dynamics, bl_vals)
         self.update(rewards, bl_vals)
         return actions, logps, rewards, bl_vals
 
@@ -36,9 +39,18 @@ class Baseline:
     def eval_step(self, vrp_dynamics, learner_compat, cust_idx):
         raise NotImplementedError()
 
+    def eval_trajectory(self, vrp_dynamics, step_vals):
+        return step_vals
+
     def update(self, rewards, bl_vals):
         pass
 
+    def epoch_data(self, data, Environment, env_params, device):
+        return data
+
+    def epoch_end(self, Environment, env_params, device):
+        pass
+
     def parameters(self):
         return []
 
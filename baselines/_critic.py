@@ -2,6 +2,7 @@ from marpdan.baselines._base import Baseline
 
 import torch
 import torch.nn as nn
+import torch.nn.functional as F
 
 
 class CriticBaseline(Baseline):
@@ -12,13 +13,15 @@ class CriticBaseline(Baseline):
 
     def eval_step(self, vrp_dynamics, learner_compat, cust_idx):
         compat = learner_compat.clone()
-        compat[vrp_dynamics.cur_veh_mask] = 0
+        compat[vrp_dynamics.cur_veh_mask | compat.isinf()] = 0
+        # Minibatches trimmed of padding nodes have fewer scores, padding ones were masked anyway
+        compat = F.pad(compat, (0, self.project.in_features - compat.size(2)))
         val = self.project(compat)
         if self.use_qval:
             val = val.gather(2, cust_idx.unsqueeze(1).expand(-1,1,-1))
         return val.squeeze(1)
 
-    def __call__(self, vrp_dynamics):
+    def __call__(self, vrp_dynamics, bl_vals = None):
         self.learner._encode_customers(vrp_dynamics.nodes)
         vrp_dynamics.reset()
         actions, logps, rewards, bl_vals = [], [], [], []
@@ -27,7 +30,8 @@ class CriticBaseline(Baseline):
                     vrp_dynamics.vehicles,
                     vrp_dynamics.cur_veh_idx,
                     vrp_dynamics.mask)
-            compat = self.learner._score_customers(veh_repr)
+            compat = self.learner._score_customers(veh_repr,
+                    self.learner._get_candidates(vrp_dynamics), vrp_dynamics.cur_veh_mask)
             logp = self.learner._get_logp(compat, vrp_dynamics.cur_veh_mask)
             cust_idx = logp.exp().multinomial(1)
             if not(self.use_cumul and bl_vals):
@@ -1,29 +1,96 @@
 from marpdan.baselines._base import Baseline
 
 import torch
+import copy
 
 class NearestNeighbourBaseline(Baseline):
     _BIG_FLOAT = 1e9
 
-    def __init__(self, learner, use_cumul_reward = False):
+    def __init__(self, learner, use_cumul_reward = False, max_forks = None):
+        r"""
+        :param max_forks: Maximum number of step states rolled out together (default: all steps of the trajectory)
+        """
         super().__init__(learner, use_cumul_reward)
-        self.buf = None
+        self.max_forks = max_forks
 
     def eval(self, dyna):
         dyna.reset()
-        return self.eval_step(dyna, None, None)
+        return self.eval_trajectory(dyna, [self.eval_step(dyna, None, None)])[0]
 
     def eval_step(self, dyna, learner_compat, learner_cust_idx):
-        self.buf = dyna.state_dict(self.buf)
-        rewards = []
-        done = False
-        while not dyna.done:
-            veh_pos = dyna.cur_veh[:,:,:2].unsqueeze(2).expand(-1,-1,dyna.nodes_count,-1)
-            cust_pos = dyna.nodes[:,:,:2].unsqueeze(1)
-            sqd = (veh_pos - cust_pos).pow(2).sum(dim = 3)
-            sqd[:,0,0] += 0.5*self._BIG_FLOAT # Discourage depot unless nothing else possible..
-            cust_idx = (sqd + dyna.cur_veh_mask.float() * self._BIG_FLOAT).argmin(dim = 2)
-            reward = dyna.step(cust_idx)
-            rewards.append(reward)
-        dyna.load_state_dict(self.buf)
-        return torch.stack(rewards).sum(dim = 0)
+        return {key: None if val is None else val.clone() for key, val in self._state(dyna).items()}
+
+    def _state(self, dyna):
+        state = dict(dyna.state_dict())
+        state["cust_mask"] = dyna.cust_mask
+        return state
+
+    def eval_trajectory(self, dyna, step_vals):
+        fork_size = len(step_vals) if self.max_forks is None else self.max_forks
+        bl_vals = []
+        for k in range(0, len(step_vals), fork_size):
+            bl_vals.extend( self._rollout_forks(dyna, step_vals[k:k+fork_size]) )
+        return bl_vals
+
+    def _fork(self, dyna, states):
+        count = len(states)
+        forks = copy.copy(dyna)
+        forks.nodes = dyna.nodes.repeat(count, 1, 1)
+        if dyna.init_cust_mask is not None:
+            forks.init_cust_mask = dyna.init_cust_mask.repeat(count, 1)
+        forks.minibatch_size = dyna.minibatch_size * count
+        forks.reset()
+        forks.load_state_dict({key: torch.cat([s[key] for s in states]) for key in states[0] if key != "cust_mask"})
+        if states[0]["cust_mask"] is not None:
+            forks.cust_mask = torch.cat([s["cust_mask"] for s in states])
+        forks.done = False
+        return forks
+
+    def _split(self, state, count):
+        chunks = {key: [None] * count if val is None else val.chunk(count) for key, val in state.items()}
+        return [{key: chunks[key][k] for key in state} for k in range(count)]
+
+    def _nearest(self, dyna):
+        if dyna.travel is None:
+            sqd = (dyna.cur_veh[:,:,None,:2] - dyna.nodes[:,None,:,:2]).pow(2).sum(dim = 3)
+        else: # Any increasing function of the distance gives the same nearest neighbour
+            sqd = dyna._travel_from_cur_veh()
+        sqd[:,0,0] += 0.5*self._BIG_FLOAT # Discourage depot unless nothing else possible..
+        return (sqd + dyna.cur_veh_mask.float() * self._BIG_FLOAT).argmin(dim = 2)
+
+    def _rollout_forks(self, dyna, states):
+        r"""
+        Roll out the nearest neighbour policy from every state at once, in one environment holding a copy
+        of the minibatch per state. A copy stops contributing rewards at the step where all its instances
+        are done, and this last step is replayed on its own so that its reward includes the final penalties,
+        exactly like a separate rollout of the minibatch from this state would.
+        Copies that are done keep idling at the depot until they are half of the environment, then get dropped.
+        """
+        n = dyna.minibatch_size
+        forks = self._fork(dyna, states)
+        slots = list(range(len(states)))
+        running = [True for _ in states]
+        rewards = [[] for _ in states]
+        while any(running[k] for k in slots):
+            cust_idx = self._nearest(forks)
+            will_done = forks.veh_done.scatter(1, forks.cur_veh_idx, cust_idx == 0).all(1)
+            fork_done = will_done.view(len(slots), n).all(1).tolist()
+            replay = {}
+            finishing = [s for s, k in enumerate(slots) if fork_done[s] and running[k]]
+            if finishing and not all(fork_done):
+                states = self._split(self._state(forks), len(slots))
+                replay = {slots[s]: self._fork(dyna, [states[s]]) for s in finishing}
+
+            reward = forks.step(cust_idx).chunk(len(slots))
+            for s, k in enumerate(slots):
+                if running[k]:
+                    rewards[k].append(replay[k].step(cust_idx[s*n:(s+1)*n]) if k in replay else reward[s])
+                    running[k] = not fork_done[s]
+
+            done_count = sum(not running[k] for k in slots)
+            if 2 * done_count >= len(slots) and done_count < len(slots):
+                states = self._split(self._state(forks), len(slots))
+                states = [st for st, k in zip(states, slots) if running[k]]
+                slots = [k for k in slots if running[k]]
+                forks = self._fork(dyna, states)
+        return [torch.stack(r).sum(dim = 0) for r in rewards]
@@ -1,11 +1,39 @@
 from marpdan.baselines._base import Baseline
 from marpdan.dep import SCIPY_ENABLED, ttest_rel
+from marpdan.utils import get_rank, get_world_size, broadcast_object, all_gather_strided
 
 import copy
 import torch
+from torch.utils.data import Dataset, DataLoader
+
+
+class _PrecomputedDataset(Dataset):
+    def __init__(self, data, bl_vals):
+        self.data = data
+        self.bl_vals = bl_vals
+
+    def __len__(self):
+        return len(self.data)
+
+    def __getitem__(self, i):
+        return self.data[i], self.bl_vals[i]
+
+    def nodes_counts(self):
+        return self.data.nodes_counts()
+
+    def collate(self, batch):
+        items, bl_vals = zip(*batch)
+        return self.data.collate(items), torch.stack(bl_vals)
+
 
 class RolloutBaseline(Baseline):
-    def __init__(self, learner, rollout_count = 1, update_threshold = 0.05):
+    def __init__(self, learner, rollout_count = 1, update_threshold = 0.05, eval_data = None, batch_size = 1024):
+        r"""
+        :param eval_data:  If given, baseline values of the whole training set are precomputed at the start of
+                every epoch, and the policy update test runs on this held-out dataset at the end of every epoch
+                instead of on every minibatch
+        :param batch_size: Minibatch size used to precompute baseline values
+        """
         super().__init__(learner, True)
 
         if not SCIPY_ENABLED:
@@ -17,19 +45,79 @@ class RolloutBaseline(Baseline):
         self.count = rollout_count
         self.thresh = update_threshold
 
-    def eval(self, dyna):
+        self.eval_data = eval_data
+        self.batch_size = batch_size
+        self.eval_vals = None
+        self.eval_params = None
+
+    def _eval_model(self, model, dyna):
         val = []
         with torch.no_grad():
             for it in range(self.count):
-                _,_,rewards = self.policy(dyna)
+                _,_,rewards = model(dyna)
                 val.append( torch.stack(rewards).sum(dim = 0) )
         return torch.stack(val).mean(dim = 0)
 
-    def update(self, rewards, bl_vals):
+    def _eval_dataset(self, model, data, Environment, env_params, device):
+        r"""
+        Under data parallelism, every rank only evaluates its own shard of ``data``,
+        and the values of all shards are gathered back on every rank.
+        """
+        vals = []
+        shard = range(get_rank(), len(data), get_world_size())
+        for minibatch in DataLoader(data, self.batch_size, sampler = shard):
+            if data.cust_mask is None:
+                custs, mask = minibatch.to(device), None
+            else:
+                custs, mask = minibatch[0].to(device), minibatch[1].to(device)
+            vals.append( self._eval_model(model, Environment(data, custs, mask, *env_params)) )
+        return all_gather_strided(torch.cat(vals, dim = 0), len(data))
+
+    def _is_better(self, rewards, bl_vals):
         if (rewards - bl_vals).mean() > 0:
-            t, p = ttest_rel(rewards.numpy(), bl_vals.numpy())
-            if p > 1-self.thresh:
-                self.policy.load_state_dict(self.learner.state_dict())
+            t, p = ttest_rel(rewards.cpu().numpy(), bl_vals.cpu().numpy())
+            return p > 1-self.thresh
+        return False
+
+    def eval(self, dyna):
+        return self._eval_model(self.policy, dyna)
+
+    def update(self, rewards, bl_vals):
+        if self.eval_data is None and self._is_better(rewards, bl_vals):
+            self.policy.load_state_dict(self.learner.state_dict())
+
+    def epoch_data(self, data, Environment, env_params, device):
+        if self.eval_data is None:
+            return data
+        bl_vals = self._eval_dataset(self.policy, data, Environment, env_params, device)
+        return _PrecomputedDataset(data, bl_vals.cpu())
+
+    def epoch_end(self, Environment, env_params, device):
+        if self.eval_data is None:
+            return
+        if self.eval_vals is None or self.eval_params != list(env_params):
+            self.eval_vals = self._eval_dataset(self.policy, self.eval_data, Environment, env_params, device)
+            self.eval_params = list(env_params)
+
+        was_training = self.learner.training
+        self.learner.eval()
+        vals = self._eval_dataset(self.learner, self.eval_data, Environment, env_params, device)
+        self.learner.train(was_training)
+
+        # Every rank samples its own rollouts, all ranks follow the decision of the first one to keep identical policies
+        if broadcast_object(self._is_better(vals, self.eval_vals)):
+            self.policy.load_state_dict(self.learner.state_dict())
+            self.eval_vals = vals
+
+    def state_dict(self):
+        return {"policy": self.policy.state_dict(), "eval_vals": self.eval_vals, "eval_params": self.eval_params}
+
+    def load_state_dict(self, state_dict):
+        self.policy.load_state_dict(state_dict["policy"])
+        self.eval_vals = state_dict["eval_vals"]
+        self.eval_params = state_dict["eval_params"]
 
     def to(self, device):
         self.policy.to(device = device)
+        if self.eval_vals is not None:
+            self.eval_vals = self.eval_vals.to(device)
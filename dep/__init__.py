@@ -55,3 +55,12 @@ try:
 except ImportError:
     ttest_rel = None
     SCIPY_ENABLED = False
+
+try:
+    from scipy.sparse import csr_matrix
+    from scipy.sparse.csgraph import dijkstra
+    CSGRAPH_ENABLED = True
+except ImportError:
+    csr_matrix = None
+    dijkstra = None
+    CSGRAPH_ENABLED = False
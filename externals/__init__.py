@@ -1,2 +1,4 @@
 from ._lkh import lkh_solve
 from ._ort import ort_solve
+from ._insert import best_insert, best_insert_batched
+from ._ls import local_search
@@ -0,0 +1,158 @@
+import torch
+
+def _route_stats(inst_nodes, veh, route):
+    route_nodes = inst_nodes[route]
+    dist = torch.cat((veh[:2].unsqueeze(0), route_nodes[:, :2]), 0)
+    dist = (dist[:-1] - dist[1:]).pow(2).sum(1).sqrt().tolist()
+    time = [veh[3].item()]
+    late = 0
+    for k,j in enumerate(route):
+        t = max(time[k] + dist[k], route_nodes[k, 3].item())
+        late += max(t - route_nodes[k, 4].item(), 0)
+        time.append((t + route_nodes[k, 5].item()))
+    return dist, time, sum(dist) + late
+
+
+def best_insert(nodes, states, routes, insert_mask, threshold = 2):
+    r"""
+    Reference (one instance, one vehicle and one position at a time) cheapest insertion
+    of newly revealed customers into the remaining planned routes.
+
+    :param nodes:       :math:`N \times L_c \times D_c` tensor containing minibatch of customers' features
+    :param states:      :math:`N \times L_v \times D_v` tensor containing minibatch of vehicles' states
+    :param routes:      Remaining planned routes of every vehicle in every instance, updated in place
+    :param insert_mask: :math:`N \times L_c` tensor where :math:`m_{nj} = 1` if customer :math:`j` must be inserted
+    :param threshold:   Customers whose cheapest insertion costs more than this are left pending
+    """
+    for inst_nodes, inst_states, inst_routes, inst_mask in zip(nodes, states, routes, insert_mask):
+        inst_dist = []
+        inst_time = []
+        inst_costs = []
+        for i, (veh, route) in enumerate(zip(inst_states, inst_routes)):
+            dist, time, c = _route_stats(inst_nodes, veh, route if route else [0])
+            inst_dist.append(dist)
+            inst_time.append(time)
+            inst_costs.append(c)
+
+        for ins_j in inst_mask.nonzero():
+            ins_node = inst_nodes[ins_j]
+            best = float('inf')
+            for i, (veh, route, dist, time, c) in enumerate(
+                    zip(inst_states, inst_routes, inst_dist, inst_time, inst_costs)):
+                if not route:
+                    route = [0]
+                route_nodes = inst_nodes[route]
+                pos = torch.cat((veh[:2].unsqueeze(0), route_nodes[:, :2]), 0)
+
+                for ins_at, _ in enumerate(route):
+                    detour = (pos[ins_at:ins_at+2] - ins_node[:, :2]).pow(2).sum(1).sqrt()
+                    t = max(time[ins_at] + detour[0], ins_node[0, 3])
+                    late = max(t - ins_node[0, 4], 0)
+                    t = t + ins_node[0, 5]
+                    t = max(t + detour[1], route_nodes[ins_at, 3])
+                    late += max(t - route_nodes[ins_at, 4], 0)
+                    t = t + route_nodes[ins_at, 5]
+                    for k,j in enumerate(route[ins_at+1:], start=ins_at+1):
+                        t = max(t + dist[k], route_nodes[k, 3])
+                        late += max(t - route_nodes[k, 4], 0)
+                        t = t + route_nodes[k, 5]
+                    delta_cost = sum(dist) + detour.sum() - dist[ins_at] + late - c
+                    if delta_cost < best:
+                        best = delta_cost
+                        best_i = i
+                        best_at = ins_at
+
+            if best < threshold:
+                if inst_routes[best_i]:
+                    inst_routes[best_i].insert(best_at, ins_j.item())
+                else:
+                    inst_routes[best_i] = [ins_j.item(), 0]
+                inst_dist[best_i], inst_time[best_i], inst_costs[best_i] = _route_stats(
+                        inst_nodes, inst_states[best_i], inst_routes[best_i])
+
+
+def best_insert_batched(nodes, states, routes, insert_mask, threshold = 2):
+    r"""
+    Same decisions as :func:`best_insert`, but the insertion costs of the :math:`k`-th new customer
+    of every instance at every (vehicle, position) pair are computed together on padded
+    :math:`N \times L_v \times R` route tensors, on the device of ``nodes`` (CPU included).
+
+    :param nodes:       :math:`N \times L_c \times D_c` tensor containing minibatch of customers' features
+    :param states:      :math:`N \times L_v \times D_v` tensor containing minibatch of vehicles' states
+    :param routes:      Remaining planned routes of every vehicle in every instance, updated in place
+    :param insert_mask: :math:`N \times L_c` tensor where :math:`m_{nj} = 1` if customer :math:`j` must be inserted
+    :param threshold:   Customers whose cheapest insertion costs more than this are left pending
+    """
+    batch_size, veh_count, _ = states.size()
+    feat_size = nodes.size(2)
+
+    lens = [[max(len(route), 1) for route in inst_routes] for inst_routes in routes]
+    max_len = max(max(inst_lens) for inst_lens in lens)
+    route_idx = nodes.new_tensor([[route + [0] * (max_len - len(route)) for route in inst_routes]
+        for inst_routes in routes], dtype = torch.int64) #.size() = N x L_v x R
+    lens = nodes.new_tensor(lens, dtype = torch.int64) #.size() = N x L_v
+
+    ins_count = insert_mask.sum(1)
+    ins_order = (insert_mask ^ True).long().sort(dim = 1, stable = True)[1]
+    b_idx = torch.arange(batch_size, device = nodes.device)
+
+    for k in range(int(ins_count.max()) if batch_size > 0 else 0):
+        r_len = route_idx.size(2)
+        pos = torch.arange(r_len, device = nodes.device)
+        valid = pos < lens[:,:,None] #.size() = N x L_v x R
+
+        rn = nodes.gather(1, route_idx.view(batch_size, -1, 1).expand(-1,-1,feat_size)).view(
+                batch_size, veh_count, r_len, feat_size)
+        rdy, due, dur = rn[:,:,:,3], rn[:,:,:,4], rn[:,:,:,5]
+        prv = torch.cat((states[:,:,None,:2], rn[:,:,:-1,:2]), 2)
+        dist = (prv - rn[:,:,:,:2]).pow(2).sum(3).sqrt() * valid
+
+        # Departure times and lateness along current routes
+        dep = [states[:,:,3]]
+        late = torch.zeros_like(dep[0])
+        for r in range(r_len):
+            t = torch.max(dep[r] + dist[:,:,r], rdy[:,:,r])
+            late = late + (t - due[:,:,r]).clamp(min = 0) * valid[:,:,r]
+            dep.append( torch.where(valid[:,:,r], t + dur[:,:,r], dep[r]) )
+        dep = torch.stack(dep[:-1], 2)
+        dist_sum = dist.sum(2)
+        costs = dist_sum + late
+
+        # Insertion of k-th new customer before every route position
+        ins_j = ins_order[:,k]
+        ins = nodes[b_idx, ins_j][:,None,None,:]
+        detour0 = (prv - ins[:,:,:,:2]).pow(2).sum(3).sqrt()
+        detour1 = (rn[:,:,:,:2] - ins[:,:,:,:2]).pow(2).sum(3).sqrt()
+        t = torch.max(dep + detour0, ins[:,:,:,3])
+        ins_late = (t - ins[:,:,:,4]).clamp(min = 0)
+        t = torch.max(t + ins[:,:,:,5] + detour1, rdy)
+        ins_late = ins_late + (t - due).clamp(min = 0)
+        t = t + dur
+        for r in range(1, r_len):
+            upd = (pos < r) & valid[:,:,r:r+1]
+            t_r = torch.max(t + dist[:,:,r:r+1], rdy[:,:,r:r+1])
+            ins_late = ins_late + (t_r - due[:,:,r:r+1]).clamp(min = 0) * upd
+            t = torch.where(upd, t_r + dur[:,:,r:r+1], t)
+
+        delta = dist_sum[:,:,None] + detour0 + detour1 - dist + ins_late - costs[:,:,None]
+        delta[~valid] = float('inf')
+        flat = delta.view(batch_size, -1).argmin(1)
+        best = delta.view(batch_size, -1).gather(1, flat[:,None]).squeeze(1)
+        do = (ins_count > k) & (best < threshold)
+        if not do.any():
+            continue
+
+        best_i = flat // r_len
+        best_at = flat % r_len
+        for b, i, at, j in zip(*(x[do].tolist() for x in (b_idx, best_i, best_at, ins_j))):
+            if routes[b][i]:
+                routes[b][i].insert(at, j)
+            else:
+                routes[b][i] = [j, 0]
+
+        at = torch.full_like(lens, r_len + 1)
+        at[b_idx[do], best_i[do]] = best_at[do]
+        pos = torch.arange(r_len + 1, device = nodes.device)
+        src = (pos - (pos > at[:,:,None]).long()).clamp(max = r_len - 1)
+        route_idx = torch.where(pos == at[:,:,None], ins_j[:,None,None], route_idx.gather(2, src))
+        lens = lens + (at <= r_len)
@@ -0,0 +1,172 @@
+from marpdan.problems import VRPTW_Environment, SDVRPTW_Environment, ARP_Environment
+
+import torch
+import time
+
+_BIG_FLOAT = 1e4
+
+
+def _route_costs(nodes, routes, veh_capa, veh_speed, kind, late_cost):
+    r"""
+    :param nodes:  :math:`N \times L_c \times D_c` tensor containing minibatch of customers' features
+    :param routes: :math:`N \times ... \times R` tensor of customers' indices per route, padded with trailing zeros
+    :return:       :math:`N \times ...` tensor of routes costs, where constraint violations weigh ``_BIG_FLOAT``
+    """
+    size = routes.size()
+    n, feat_size = nodes.size(0), nodes.size(2)
+    feats = nodes.gather(1, routes.reshape(n, -1, 1).expand(-1,-1,feat_size)).view(*size, feat_size)
+    depot = nodes[:,0,:2].view(n, *(1 for _ in size[1:]), 2).expand(*size[:-1], 1, 2)
+    legs = (feats[...,:2] - torch.cat((depot, feats[...,:-1,:2]), -2)).pow(2).sum(-1).sqrt()
+
+    cost = legs.sum(-1)
+    viol = (feats[...,2].sum(-1) - veh_capa).clamp(min = 0)
+    if kind == "vrp":
+        return cost + _BIG_FLOAT * viol
+
+    is_cust = routes > 0
+    is_ret = (routes == 0) & ((routes == 0).long().cumsum(-1) == 1)
+    t = torch.zeros_like(cost)
+    late = torch.zeros_like(cost)
+    ret = torch.zeros_like(cost)
+    for r in range(size[-1]):
+        t = t + legs[...,r] / veh_speed
+        if kind == "vrptw":
+            t = torch.max(t, feats[...,r,3])
+            late = late + torch.where(is_cust[...,r] | is_ret[...,r], (t - feats[...,r,4]).clamp(min = 0), 0)
+            t = t + feats[...,r,5]
+        else: # kind == "arp"
+            viol = viol + torch.where(is_cust[...,r], (t - feats[...,r,4]).clamp(min = 0), 0)
+            ret = torch.where(is_ret[...,r], t, ret)
+    if kind == "arp":
+        viol = viol + torch.where(is_cust, (ret[...,None] - feats[...,3]).clamp(min = 0), 0).sum(-1)
+    return cost + late_cost * late + _BIG_FLOAT * viol
+
+
+def _two_opt_perms(r_len, device):
+    i, j = torch.triu_indices(r_len, r_len, 1, device = device)
+    pos = torch.arange(r_len, device = device)
+    inside = (pos >= i[:,None]) & (pos <= j[:,None])
+    return torch.where(inside, i[:,None] + j[:,None] - pos, pos), j #.size() = C x R, C
+
+
+def local_search(env, routes, max_iter = 100, time_limit = None, late_cost = None):
+    r"""
+    Improve routes of every instance of the minibatch together with best-improvement intra-route 2-opt,
+    inter-route relocate and inter-route swap moves, applying at most one move per instance and iteration.
+    Capacity is always enforced, time windows are soft (weighted by ``late_cost``) for VRPTW,
+    and pick-up deadlines and survival times of patients are enforced for ARP.
+
+    :param env:        Environment holding the minibatch of nodes the routes visit
+    :param routes:     Sequence of customers served by every vehicle of every instance, e.g. from :func:`actions_to_routes`
+    :param max_iter:   Maximum number of iterations
+    :param time_limit: Maximum time spent in seconds
+    :param late_cost:  Weight of lateness in the cost (defaults to ``env.late_cost``)
+    :return:           Improved routes, and trace of (elapsed time, mean cost) after every iteration
+    """
+    if isinstance(env, SDVRPTW_Environment):
+        raise ValueError("Local search does not support dynamically appearing customers")
+    if isinstance(env, ARP_Environment):
+        kind = "arp"
+    elif isinstance(env, VRPTW_Environment):
+        kind = "vrptw"
+    else:
+        kind = "vrp"
+    if late_cost is None:
+        late_cost = getattr(env, "late_cost", 1)
+
+    def eval_routes(r):
+        return _route_costs(env.nodes, r, env.veh_capa, env.veh_speed, kind, late_cost)
+
+    start = time.perf_counter()
+    batch_size, veh_count = env.minibatch_size, env.veh_count
+    custs = [[[j for j in route if j > 0] for route in inst_routes] for inst_routes in routes]
+    r_len = max(len(route) for inst_routes in custs for route in inst_routes) + 1
+    routes = env.nodes.new_tensor([[route + [0] * (r_len - len(route)) for route in inst_routes]
+        for inst_routes in custs], dtype = torch.int64) #.size() = N x L_v x R
+    b_idx = torch.arange(batch_size, device = routes.device)
+
+    costs = eval_routes(routes) #.size() = N x L_v
+    trace = [(time.perf_counter() - start, costs.sum(1).mean().item())]
+    for it in range(max_iter):
+        if time_limit is not None and time.perf_counter() - start > time_limit:
+            break
+        lens = (routes > 0).sum(2)
+        pos = torch.arange(r_len + 1, device = routes.device)
+        padded = torch.cat((routes, routes.new_zeros((batch_size, veh_count, 1))), 2)
+
+        best = costs.new_zeros(batch_size)
+        best_u = b_idx.new_zeros(batch_size)
+        best_w = b_idx.new_zeros(batch_size)
+        best_ru = padded[:,0].clone()
+        best_rw = padded[:,0].clone()
+
+        def keep_best(delta, u, w, ru, rw):
+            better = delta < best
+            best[better] = delta[better]
+            best_u[better] = u[better]
+            best_w[better] = w[better]
+            best_ru[better] = ru[better]
+            best_rw[better] = rw[better]
+
+        # Intra-route 2-opt
+        perms, j = _two_opt_perms(r_len, routes.device)
+        if perms.size(0) > 0:
+            cand = routes[:,:,perms] #.size() = N x L_v x C x R
+            delta = eval_routes(cand) - costs[:,:,None]
+            delta[j >= lens[:,:,None]] = float('inf')
+            delta, flat = delta.view(batch_size, -1).min(1)
+            u = flat // perms.size(0)
+            ru = padded[b_idx, u].scatter(1, pos[None,:r_len].expand(batch_size, -1),
+                    cand.view(batch_size, -1, r_len)[b_idx, flat])
+            keep_best(delta, u, u, ru, ru)
+
+        # Inter-route relocate and swap, for every source slot (u, p)
+        ins_src = (pos - (pos[:,None] < pos).long())[:r_len] #.size() = R x (R+1)
+        for u in range(veh_count):
+            u_idx = b_idx.new_full((batch_size,), u)
+            for p in range(r_len - 1):
+                active = p < lens[:,u]
+                if not active.any():
+                    continue
+                x = routes[:,u,p]
+
+                # Relocate x from u to position q of route w
+                rem_u = torch.cat((routes[:,u,:p], routes[:,u,p+1:], routes.new_zeros((batch_size, 2))), 1)
+                ins = torch.where(pos[None,None,None,:] == pos[None,None,:r_len,None], x[:,None,None,None],
+                        padded[:,:,ins_src]) #.size() = N x L_v x R x (R+1)
+                delta = eval_routes(ins) - costs[:,:,None] \
+                        + (eval_routes(rem_u[:,:r_len]) - costs[:,u])[:,None,None]
+                invalid = (pos[:r_len] > lens[:,:,None]) | ~active[:,None,None]
+                invalid[:,u] = True
+                delta[invalid] = float('inf')
+                delta, flat = delta.view(batch_size, -1).min(1)
+                w = flat // r_len
+                keep_best(delta, u_idx, w, rem_u, ins.view(batch_size, -1, r_len + 1)[b_idx, flat])
+
+                # Swap x with customer at position q of route w
+                repl_w = torch.where(pos[None,None,:r_len,None] == pos[None,None,None,:r_len], x[:,None,None,None],
+                        routes[:,:,None,:]) #.size() = N x L_v x R x R
+                repl_u = routes[:,u,None,:].repeat(1, veh_count * r_len, 1)
+                repl_u[:,:,p] = routes.view(batch_size, -1)
+                delta = eval_routes(repl_w) - costs[:,:,None] \
+                        + eval_routes(repl_u).view(batch_size, veh_count, r_len) - costs[:,u,None,None]
+                invalid = (pos[:r_len] >= lens[:,:,None]) | ~active[:,None,None]
+                invalid[:,:u+1] = True
+                delta[invalid] = float('inf')
+                delta, flat = delta.view(batch_size, -1).min(1)
+                w = flat // r_len
+                zero = routes.new_zeros((batch_size, 1))
+                keep_best(delta, u_idx, w, torch.cat((repl_u[b_idx, flat], zero), 1),
+                        torch.cat((repl_w.view(batch_size, -1, r_len)[b_idx, flat], zero), 1))
+
+        improved = best < -1e-6
+        if not improved.any():
+            break
+        padded[b_idx[improved], best_u[improved]] = best_ru[improved]
+        padded[b_idx[improved], best_w[improved]] = best_rw[improved]
+        r_len = int((padded > 0).sum(2).max()) + 1
+        routes = padded[:,:,:r_len].contiguous()
+        costs = eval_routes(routes)
+        trace.append( (time.perf_counter() - start, costs.sum(1).mean().item()) )
+
+    return [[[j for j in route if j > 0] + [0] for route in inst_routes] for inst_routes in routes.tolist()], trace
@@ -2,15 +2,35 @@ from marpdan.dep import ORTOOLS_ENABLED, pywrapcp, routing_enums_pb2
 from marpdan.dep import tqdm
 
 from multiprocessing import Pool
+import time
 
-def _solve_cp(nodes, veh_count, veh_capa, veh_speed, late_cost):
+def _check_budget(time_limit, metaheuristic):
+    if metaheuristic is not None and time_limit is None:
+        raise ValueError("Metaheuristic '{}' never stops on its own, a time limit is required".format(metaheuristic))
+
+
+def _solve_cp(nodes, veh_count, veh_capa, veh_speed, late_cost,
+        time_limit = None, metaheuristic = None, init_routes = None, trace = False, travel = None):
+    r"""
+    :param time_limit:    Search time budget in seconds (None = stop at first local optimum, only without metaheuristic)
+    :param metaheuristic: Name of an OR-Tools ``LocalSearchMetaheuristic`` (e.g. "GUIDED_LOCAL_SEARCH"),
+            which never stops on its own and requires ``time_limit``
+    :param init_routes:   Initial routes (one list of node indices per vehicle, depot excluded) to start search from
+    :param trace:         Also return the list of (elapsed time, cost) of every improving solution found
+    :param travel:        :math:`L_c \times L_c` table of travel distances between nodes, straight-line ones if None
+    """
+    _check_budget(time_limit, metaheuristic)
     manager = pywrapcp.RoutingIndexManager(nodes.size(0), veh_count, 0)
     routing = pywrapcp.RoutingModel(manager)
 
+    if travel is None:
+        travel = (nodes[:,None,:2] - nodes[None,:,:2]).pow(2).sum(-1).pow(0.5)
+    travel = travel.tolist()
+
     def dist_cb(from_idx, to_idx):
         src = manager.IndexToNode(from_idx)
         dst = manager.IndexToNode(to_idx)
-        return int(nodes[src, :2].sub(nodes[dst, :2]).pow(2).sum().pow(0.5))
+        return int(travel[src][dst])
     d_cb_idx = routing.RegisterTransitCallback(dist_cb)
     routing.SetArcCostEvaluatorOfAllVehicles(d_cb_idx)
 
@@ -19,13 +39,13 @@ def _solve_cp(nodes, veh_count, veh_capa, veh_speed, late_cost):
         return int(nodes[j,2])
     q_cb_idx = routing.RegisterUnaryTransitCallback(dem_cb)
     routing.AddDimensionWithVehicleCapacity(q_cb_idx, 0, [veh_capa for _ in range(veh_count)], True, "Capacity")
-    
+
     if nodes.size(1) > 3:
         horizon = int(nodes[0,4])
         def time_cb(from_idx, to_idx):
             src = manager.IndexToNode(from_idx)
             dst = manager.IndexToNode(to_idx)
-            return int(nodes[src, 5] + nodes[src, :2].sub(nodes[dst, :2]).pow(2).sum().pow(0.5) / veh_speed)
+            return int(nodes[src, 5] + travel[src][dst] / veh_speed)
         t_cb_idx = routing.RegisterTransitCallback(time_cb)
         routing.AddDimension(t_cb_idx, horizon, 2*horizon, True, "Time")
         t_dim = routing.GetDimensionOrDie("Time")
@@ -39,7 +59,28 @@ def _solve_cp(nodes, veh_count, veh_capa, veh_speed, late_cost):
 
     params = pywrapcp.DefaultRoutingSearchParameters()
     params.first_solution_strategy = routing_enums_pb2.FirstSolutionStrategy.PATH_CHEAPEST_ARC
-    assign = routing.SolveWithParameters(params)
+    if metaheuristic is not None:
+        params.local_search_metaheuristic = getattr(routing_enums_pb2.LocalSearchMetaheuristic, metaheuristic)
+    if time_limit is not None:
+        params.time_limit.FromMilliseconds(int(1000 * time_limit))
+
+    costs = []
+    start = time.perf_counter()
+    def trace_cb():
+        c = routing.CostVar().Max()
+        if not costs or c < costs[-1][1]:
+            costs.append( (time.perf_counter() - start, c) )
+    if trace:
+        routing.AddAtSolutionCallback(trace_cb)
+
+    init = None
+    if init_routes is not None:
+        routing.CloseModelWithParameters(params)
+        init = routing.ReadAssignmentFromRoutes(init_routes, True)
+    if init is None:
+        assign = routing.SolveWithParameters(params)
+    else:
+        assign = routing.SolveFromAssignmentWithParameters(init, params)
 
     routes = []
     for i in range(veh_count):
@@ -50,13 +91,54 @@ def _solve_cp(nodes, veh_count, veh_capa, veh_speed, late_cost):
             route.append( manager.IndexToNode(idx) )
         routes.append(route)
 
+    if trace:
+        return routes, costs
     return routes
 
 
-def ort_solve(data, late_cost = 1):
+def _to_solver_routes(routes, cust_mask = None):
+    r"""
+    Convert routes indexing the (padded) minibatch nodes, as returned by :func:`actions_to_routes`,
+    to routes indexing the nodes yielded by ``nodes_gen()``, with all depot visits removed.
+    """
+    if cust_mask is None:
+        return [[j for j in route if j > 0] for route in routes]
+    remap = (cust_mask ^ True).long().cumsum(0).sub(1).tolist()
+    return [[remap[j] for j in route if j > 0] for route in routes]
+
+
+def ort_solve(data, late_cost = 1, time_limit = None, metaheuristic = None, init_routes = None, trace = False,
+        travel_oracle = None):
+    r"""
+    :param time_limit:    Search time budget in seconds per instance
+    :param metaheuristic: Name of an OR-Tools ``LocalSearchMetaheuristic``, e.g. "GUIDED_LOCAL_SEARCH",
+            which requires ``time_limit``
+    :param init_routes:   Routes per instance used as warm start, e.g. ``actions_to_routes`` of a greedy learner
+    :param trace:         Also return the cost-vs-time trace of every instance
+    :param travel_oracle: Oracle returning tables of travel distances between nodes (e.g. ``RoadNetwork``),
+            straight-line distances if None
+    """
+    _check_budget(time_limit, metaheuristic)
+    if init_routes is None:
+        init_routes = [None for _ in range(data.batch_size)]
+    elif data.cust_mask is None:
+        init_routes = [_to_solver_routes(rs) for rs in init_routes]
+    else:
+        init_routes = [_to_solver_routes(rs, m) for rs, m in zip(init_routes, data.cust_mask)]
+
+    if travel_oracle is None:
+        travels = [None for _ in range(data.batch_size)]
+    else:
+        travels = [travel_oracle(nodes[None])[0] for nodes in data.nodes_gen()]
+
     with Pool() as p:
         with tqdm(desc = "Calling ORTools", total = data.batch_size) as pbar:
-            results = [p.apply_async(_solve_cp, (nodes, data.veh_count, data.veh_capa, data.veh_speed, late_cost),
-                callback = lambda _:pbar.update()) for nodes in data.nodes_gen()]
+            results = [p.apply_async(_solve_cp, (nodes, data.veh_count, data.veh_capa, data.veh_speed, late_cost,
+                time_limit, metaheuristic, init, trace, travel),
+                callback = lambda _:pbar.update())
+                for nodes, init, travel in zip(data.nodes_gen(), init_routes, travels)]
             routes = [res.get() for res in results]
+    if trace:
+        routes, traces = zip(*routes)
+        return list(routes), list(traces)
     return routes
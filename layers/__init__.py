@@ -1,3 +1,5 @@
-from ._mha         import _MHA_V2 as MultiHeadAttention
-from ._transformer import TransformerEncoder, TransformerEncoderLayer
-from ._loss        import reinforce_loss
+from ._mha         import _MHA_V2 as MultiHeadAttention, _SparseMHA as SparseMultiHeadAttention
+from ._transformer import TransformerEncoder, TransformerEncoderLayer, \
+        SparseTransformerEncoder, SparseTransformerEncoderLayer, \
+        nearest_nodes, neighbour_index
+from ._loss        import reinforce_loss, importance_weights
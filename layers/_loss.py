@@ -57,3 +57,20 @@ def reinforce_loss(logprobs, rewards, baseline = None, weights = None, discount
         return loss.sum()
     else: # reduction == 'mean'
         return loss.mean()
+
+
+def importance_weights(logprobs, behaviour_logprobs, clip = 1.0):
+    r"""
+    Truncated per-step importance sampling ratios correcting for actions sampled with stale weights,
+    to be passed as ``weights`` to :func:`reinforce_loss`.
+
+    :param logprobs:           Iterable of length :math:`L` on tensors of size :math:`N \times 1`
+                    of log-probabilities under the current policy
+    :param behaviour_logprobs: Iterable of length :math:`L` on tensors of size :math:`N \times 1`
+                    of log-probabilities under the policy which sampled the actions
+    :param clip:               Upper bound of the ratios, or None to leave them untruncated
+    """
+    ratios = [(logp.detach() - old).exp() for logp, old in zip(logprobs, behaviour_logprobs)]
+    if clip is None:
+        return ratios
+    return [rho.clamp(max = clip) for rho in ratios]
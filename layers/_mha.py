@@ -161,3 +161,37 @@ class _MHA_V2(nn.Module):
         att_applied = weights.matmul(v_proj).permute(0,2,1,3).contiguous().view(
                 *size, l_q, self.head_count * self.value_size_per_head)
         return self.recombine(att_applied)
+
+
+class _SparseMHA(_MHA_V2):
+    r"""Multi-Head self-attention where every query only attends over its own subset of keys,
+    given as indices into the sequence (e.g. spatial neighbours), so that weights are
+    :math:`N \times L \times K \times H` instead of :math:`N \times H \times L \times L`.
+    """
+    def forward(self, queries, nbr_idx, mask = None):
+        r"""
+        :param queries: :math:`N \times L \times D`
+        :param nbr_idx: :math:`N \times L \times K` indices of the keys every query attends over
+        :param mask:    :math:`N \times L` where :math:`m_{nj} = 1` if element :math:`j` cannot be attended
+        :return:        :math:`N \times L \times D`
+        """
+        n, l_q, _ = queries.size()
+        nbr_count = nbr_idx.size(2)
+        flat_idx = (nbr_idx + l_q * torch.arange(n, device = nbr_idx.device)[:,None,None]).view(-1)
+
+        q_proj = self.query_project(queries).view(n, l_q, 1, self.head_count, self.key_size_per_head)
+        k_proj = self.key_project(queries).view(n * l_q, -1)[flat_idx].view(
+                n, l_q, nbr_count, self.head_count, self.key_size_per_head)
+        v_proj = self.value_project(queries).view(n * l_q, -1)[flat_idx].view(
+                n, l_q, nbr_count, self.head_count, self.value_size_per_head)
+
+        weights = (q_proj * k_proj).sum(dim = 4) #.size() = N x L x K x H
+        weights *= self._inv_sqrt_d
+        if mask is not None:
+            m = mask.view(-1)[flat_idx].view(n, l_q, nbr_count, 1).expand_as(weights)
+            weights[m] = -float('inf')
+        weights = F.softmax(weights, dim = 2)
+
+        att_applied = (weights.unsqueeze(4) * v_proj).sum(dim = 2).view(
+                n, l_q, self.head_count * self.value_size_per_head)
+        return self.recombine(att_applied)
@@ -1,8 +1,34 @@
-from marpdan.layers import MultiHeadAttention
+from marpdan.layers import MultiHeadAttention, SparseMultiHeadAttention
 
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
+from torch.utils.checkpoint import checkpoint
+
+from contextlib import contextmanager, nullcontext
+
+
+@contextmanager
+def _frozen_bn_stats(module):
+    r"""Keep running statistics of batch norms unchanged while a checkpointed layer is recomputed,
+    so that they are only updated once per forward pass."""
+    bns = [m for m in module.modules() if isinstance(m, nn.modules.batchnorm._BatchNorm)]
+    saved = [(bn.momentum, bn.num_batches_tracked.clone()) for bn in bns]
+    for bn in bns:
+        bn.momentum = 0.0
+    try:
+        yield
+    finally:
+        for bn, (momentum, tracked) in zip(bns, saved):
+            bn.momentum = momentum
+            bn.num_batches_tracked.copy_(tracked)
+
+
+def _run_layer(layer, use_checkpoint, *args):
+    if use_checkpoint and torch.is_grad_enabled():
+        return checkpoint(layer, *args, use_reentrant = False,
+                context_fn = lambda: (nullcontext(), _frozen_bn_stats(layer)))
+    return layer(*args)
 
 class TransformerEncoderLayer(nn.Module):
     def __init__(self, head_count, model_size, ff_size):
@@ -21,6 +47,9 @@ class TransformerEncoderLayer(nn.Module):
         :return:        :math:`N \times L \times D_M`
         """
         att = self.mha(h_in, mask = mask)
+        return self._feed_forward(h_in, att, mask)
+
+    def _feed_forward(self, h_in, att, mask):
         att = self.bn1( (h_in + att).permute(0,2,1) ).permute(0,2,1)
 
         h_out = F.relu( self.ff1(att) )
@@ -36,9 +65,11 @@ class TransformerEncoder(nn.Module):
     r"""Neural Network module implementing a self-attention mechanism used as encoder.
     This layer structure was first introduced in "Attention Is All You Need" by \
             `[Vaswani et al. (2017)] <http://papers.nips.cc/paper/7181-attention-is-all-you-need.pdf>`_
+    Setting ``checkpoint`` recomputes every layer during backward instead of storing its activations.
     """
     def __init__(self, layer_count, head_count, model_size, ff_size):
         super().__init__()
+        self.checkpoint = False
         for l in range(layer_count):
             self.add_module( str(l), TransformerEncoderLayer(head_count, model_size, ff_size) )
 
@@ -50,5 +81,75 @@ class TransformerEncoder(nn.Module):
         """
         h = inputs
         for child in self.children():
-            h = child(h, mask)
+            h = _run_layer(child, self.checkpoint, h, mask)
+        return h
+
+
+def nearest_nodes(coords, count, chunk_size = 256):
+    r"""
+    :param coords:     :math:`N \times L \times 2` coordinates of the nodes, depot first
+    :param count:      Number :math:`k` of nearest nodes (itself included, depot excluded) to find for every node
+    :param chunk_size: Number of nodes whose distances to all others are computed at once, so that
+            memory stays :math:`N \times chunk\_size \times L` instead of :math:`N \times L \times L`
+    :return:           :math:`N \times L \times k` indices of the :math:`k` nearest nodes of every node
+    """
+    count = min(count, coords.size(1) - 1)
+    nbr_idx = []
+    for chunk in coords.split(chunk_size, dim = 1):
+        sqd = (chunk[:,:,None,:] - coords[:,None,:,:]).pow(2).sum(dim = 3) #.size() = N x C x L
+        sqd[:,:,0] = float('inf')
+        nbr_idx.append( sqd.topk(count, dim = 2, largest = False)[1] )
+    return torch.cat(nbr_idx, dim = 1)
+
+
+def neighbour_index(coords, nbr_count):
+    r"""
+    :param coords:    :math:`N \times L \times 2` coordinates of the nodes, depot first
+    :param nbr_count: Number :math:`k` of nearest nodes (itself included) every node attends over, besides the depot
+    :return:          :math:`N \times L \times (k+1)` indices of the depot followed by the :math:`k` nearest other nodes
+    """
+    nbr_idx = nearest_nodes(coords, nbr_count)
+    return torch.cat((nbr_idx.new_zeros((*nbr_idx.size()[:2], 1)), nbr_idx), dim = 2)
+
+
+class SparseTransformerEncoderLayer(TransformerEncoderLayer):
+    def __init__(self, head_count, model_size, ff_size):
+        super().__init__(head_count, model_size, ff_size)
+        self.mha = SparseMultiHeadAttention(head_count, model_size)
+
+    def forward(self, h_in, nbr_idx, mask = None):
+        r"""
+        :param h_in:    :math:`N \times L \times D_M`
+        :param nbr_idx: :math:`N \times L \times K`
+        :param mask:    :math:`N \times L`
+        :return:        :math:`N \times L \times D_M`
+        """
+        att = self.mha(h_in, nbr_idx, mask = mask)
+        return self._feed_forward(h_in, att, mask)
+
+
+class SparseTransformerEncoder(nn.Module):
+    r"""Same as :class:`TransformerEncoder`, but every node only attends over the depot
+    and its :math:`k` nearest spatial neighbours, so that memory and time of the attention layers grow linearly
+    with :math:`L`. Neighbours are searched once per forward pass by chunks of nodes, which keeps memory linear
+    but costs :math:`O(L^2)` distance computations.
+    """
+    def __init__(self, layer_count, head_count, model_size, ff_size, nbr_count):
+        super().__init__()
+        self.nbr_count = nbr_count
+        self.checkpoint = False
+        for l in range(layer_count):
+            self.add_module( str(l), SparseTransformerEncoderLayer(head_count, model_size, ff_size) )
+
+    def forward(self, inputs, mask = None, coords = None):
+        r"""
+        :param inputs: :math:`N \times L \times D_M`
+        :param mask:   :math:`N \times L`
+        :param coords: :math:`N \times L \times 2` coordinates used to find neighbours
+        :return:       :math:`N \times L \times D_M`
+        """
+        nbr_idx = neighbour_index(coords, self.nbr_count)
+        h = inputs
+        for child in self.children():
+            h = _run_layer(child, self.checkpoint, h, nbr_idx, mask)
         return h
@@ -8,3 +8,6 @@ from ._env_arp   import ARP_Environment
 from ._env_tw    import VRPTW_Environment
 from ._env_stw   import SVRPTW_Environment
 from ._env_sdtw  import SDVRPTW_Environment
+
+from ._road      import RoadNetwork
+from ._speed     import SpeedProfile
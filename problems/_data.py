@@ -1,5 +1,6 @@
 import torch
 from torch.utils.data import Dataset
+from torch.utils.data.dataloader import default_collate
 
 class VRP_Dataset(Dataset):
     CUST_FEAT_SIZE = 3
@@ -61,6 +62,29 @@ class VRP_Dataset(Dataset):
         else:
             return self.nodes[i], self.cust_mask[i]
 
+    def _real_counts(self, cust_mask):
+        return (cust_mask ^ True).sum(1)
+
+    def nodes_counts(self):
+        r"""
+        :return: :math:`N` tensor containing the number of nodes of every instance (depot included) without padding
+        """
+        if self.cust_mask is None:
+            return torch.full((self.batch_size,), self.nodes_count, dtype = torch.int64)
+        return self._real_counts(self.cust_mask)
+
+    def collate(self, batch):
+        r"""
+        Stack a list of samples into a minibatch like the default ``collate_fn`` of ``DataLoader``,
+        then trim padding nodes beyond the largest instance of the minibatch.
+        Padding nodes are always last, so this keeps every real node at its index.
+        """
+        if self.cust_mask is None:
+            return default_collate(batch)
+        nodes, cust_mask = default_collate(batch)
+        size = int(self._real_counts(cust_mask).max())
+        return nodes[:,:size].contiguous(), cust_mask[:,:size].contiguous()
+
     def nodes_gen(self):
         if self.cust_mask is None:
             yield from self.nodes
@@ -5,6 +5,10 @@ class ARP_Dataset(VRP_Dataset):
     # Customer features: [x, y, demand=1, survival_time, time_window_upper_bound]
     CUST_FEAT_SIZE = 5
 
+    def _real_counts(self, cust_mask):
+        # Patient mask is True for valid nodes
+        return cust_mask.sum(1)
+
     @classmethod
     def generate(cls,
                  batch_size=1,
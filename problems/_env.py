@@ -4,6 +4,11 @@ class VRP_Environment:
     VEH_STATE_SIZE = 4
     CUST_FEAT_SIZE = 3
 
+    # Oracle returning a table of travel times between nodes (e.g. RoadNetwork), straight-line distances if None
+    travel_oracle = None
+    # Time-dependent speeds (e.g. SpeedProfile) applied to travel times, constant speed if None
+    speed_profile = None
+
     def __init__(self, data, nodes = None, cust_mask = None,
             pending_cost = 2):
         self.veh_count = data.veh_count
@@ -14,10 +19,43 @@ class VRP_Environment:
         self.minibatch_size, self.nodes_count, _ = self.nodes.size()
     
         self.pending_cost = pending_cost
-
-    def _update_vehicles(self, dest):
-        dist = torch.pairwise_distance(self.cur_veh[:,0,:2], dest[:,0,:2], keepdim = True)
-        tt = dist / self.veh_speed
+        self.travel = None
+
+    def _travel_from_cur_veh(self):
+        r"""
+        :return: :math:`N \times 1 \times L_c` tensor of travel times from the node of the acting vehicle to every node,
+                looked up in the table of the travel oracle
+        """
+        return self.travel.gather(1, self.cur_veh_node[:,:,None].expand(-1,-1,self.nodes_count))
+
+    def _dist(self, dest, cust_idx):
+        r"""
+        :param dest:     :math:`N \times 1 \times D_c` tensor of the features of the nodes the acting vehicles go to
+        :param cust_idx: :math:`N \times 1` tensor of the indices of these nodes
+        :return:         :math:`N \times 1` tensor of distances travelled to get there
+        """
+        if self.travel is None:
+            return torch.pairwise_distance(self.cur_veh[:,0,:2], dest[:,0,:2], keepdim = True)
+        return self._travel_from_cur_veh().squeeze(1).gather(1, cust_idx)
+
+    def _update_veh_node(self, cust_idx):
+        self.veh_node = self.veh_node.scatter(1, self.cur_veh_idx, cust_idx)
+
+    def _travel_time(self, depart, dist, pos, speed):
+        r"""
+        :param depart: Departure times, broadcastable with ``dist``
+        :param dist:   Distances to travel
+        :param pos:    :math:`... \times 2` coordinates of departure
+        :param speed:  Nominal (or sampled) speed of vehicles
+        :return:       Travel times, following the speed profile from the departure time if any
+        """
+        if self.speed_profile is None:
+            return dist / speed
+        return self.speed_profile.travel_time(depart, dist / speed, pos)
+
+    def _update_vehicles(self, dest, cust_idx):
+        dist = self._dist(dest, cust_idx)
+        tt = self._travel_time(self.cur_veh[:,:,3], dist, self.cur_veh[:,:,:2], self.veh_speed)
 
         self.cur_veh[:,:,:2] = dest[:,:,:2]
         self.cur_veh[:,:,2] -= dest[:,:,2]
@@ -25,6 +63,7 @@ class VRP_Environment:
 
         self.vehicles = self.vehicles.scatter(1,
                 self.cur_veh_idx[:,:,None].expand(-1,-1,self.VEH_STATE_SIZE), self.cur_veh)
+        self._update_veh_node(cust_idx)
         return dist
 
     def _update_done(self, cust_idx):
@@ -45,12 +84,16 @@ class VRP_Environment:
         avail[self.veh_done] = float('inf')
         self.cur_veh_idx = avail.argmin(1, keepdim = True)
         self.cur_veh = self.vehicles.gather(1, self.cur_veh_idx[:,:,None].expand(-1,-1,self.VEH_STATE_SIZE))
+        self.cur_veh_node = self.veh_node.gather(1, self.cur_veh_idx)
         self.cur_veh_mask = self.mask.gather(1, self.cur_veh_idx[:,:,None].expand(-1,-1,self.nodes_count))
 
     def reset(self):
+        self.travel = None if self.travel_oracle is None else self.travel_oracle(self.nodes)
         self.vehicles = self.nodes.new_zeros((self.minibatch_size, self.veh_count, self.VEH_STATE_SIZE))
         self.vehicles[:,:,:2] = self.nodes[:,0:1,:2]
         self.vehicles[:,:,2] = self.veh_capa
+        # Index of the node where every vehicle stands, to look up travel times
+        self.veh_node = self.nodes.new_zeros((self.minibatch_size, self.veh_count), dtype = torch.int64)
 
         self.veh_done = self.nodes.new_zeros((self.minibatch_size, self.veh_count), dtype = torch.bool)
         self.done = False
@@ -64,11 +107,12 @@ class VRP_Environment:
 
         self.cur_veh_idx = self.nodes.new_zeros((self.minibatch_size, 1), dtype = torch.int64)
         self.cur_veh = self.vehicles.gather(1, self.cur_veh_idx[:,:,None].expand(-1,-1,self.VEH_STATE_SIZE))
+        self.cur_veh_node = self.veh_node.gather(1, self.cur_veh_idx)
         self.cur_veh_mask = self.mask.gather(1, self.cur_veh_idx[:,:,None].expand(-1,-1,self.nodes_count))
 
     def step(self, cust_idx):
         dest = self.nodes.gather(1, cust_idx[:,:,None].expand(-1,-1,self.CUST_FEAT_SIZE))
-        dist = self._update_vehicles(dest)
+        dist = self._update_vehicles(dest, cust_idx)
         self._update_done(cust_idx)
         self._update_mask(cust_idx)
         self._update_cur_veh()
@@ -84,6 +128,7 @@ class VRP_Environment:
         if dest_dict is None:
             dest_dict = {
                     "vehicles": self.vehicles,
+                    "veh_node": self.veh_node,
                     "veh_done": self.veh_done,
                     "served": self.served,
                     "mask": self.mask,
@@ -91,6 +136,7 @@ class VRP_Environment:
                     }
         else:
             dest_dict["vehicles"].copy_(self.vehicles)
+            dest_dict["veh_node"].copy_(self.veh_node)
             dest_dict["veh_done"].copy_(self.veh_done)
             dest_dict["served"].copy_(self.served)
             dest_dict["mask"].copy_(self.mask)
@@ -99,10 +145,12 @@ class VRP_Environment:
 
     def load_state_dict(self, state_dict):
         self.vehicles.copy_(state_dict["vehicles"])
+        self.veh_node.copy_(state_dict["veh_node"])
         self.veh_done.copy_(state_dict["veh_done"])
         self.served.copy_(state_dict["served"])
         self.mask.copy_(state_dict["mask"])
         self.cur_veh_idx.copy_(state_dict["cur_veh_idx"])
 
         self.cur_veh = self.vehicles.gather(1, self.cur_veh_idx[:,:,None].expand(-1,-1,self.VEH_STATE_SIZE))
+        self.cur_veh_node = self.veh_node.gather(1, self.cur_veh_idx)
         self.cur_veh_mask = self.mask.gather(1, self.cur_veh_idx[:,:,None].expand(-1,-1,self.nodes_count))
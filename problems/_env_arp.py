@@ -66,6 +66,7 @@ class ARP_Environment(VRP_Environment):
         avail[self.veh_done] = float('inf')     # Mark done vehicles as unavailable
         self.cur_veh_idx = avail.argmin(dim=1).unsqueeze(1)  # Shape: [batch_size, 1]
         self.cur_veh = self.vehicles.gather(1, self.cur_veh_idx.unsqueeze(2).expand(-1, -1, self.VEH_STATE_SIZE))
+        self.cur_veh_node = self.veh_node.gather(1, self.cur_veh_idx)
         self.cur_veh_mask = self.mask.gather(1, self.cur_veh_idx.unsqueeze(2).expand(-1, -1, self.nodes_count))
 
     def _update_mask(self):
@@ -79,10 +80,15 @@ class ARP_Environment(VRP_Environment):
 
         # Calculate travel times to all nodes
         node_positions = self.nodes[:, :, :2]  # Shape: [batch_size, nodes_count, 2]
-        travel_times = torch.norm(
-            current_positions.unsqueeze(2) - node_positions.unsqueeze(1),
-            dim=-1
-        ) / self._sample_speed()  # Shape: [batch_size, 1, nodes_count]
+        if self.travel is None:
+            dists = torch.norm(
+                current_positions.unsqueeze(2) - node_positions.unsqueeze(1),
+                dim=-1
+            )  # Shape: [batch_size, 1, nodes_count]
+        else:
+            dists = self._travel_from_cur_veh()  # Looked up in the oracle table
+        travel_times = self._travel_time(current_time.unsqueeze(2), dists, current_positions.unsqueeze(2),
+                self._sample_speed())  # Shape: [batch_size, 1, nodes_count]
 
         # Calculate arrival times at nodes
         arrival_times = current_time.unsqueeze(2) + travel_times  # Shape: [batch_size, 1, nodes_count]
@@ -104,10 +110,16 @@ class ARP_Environment(VRP_Environment):
         # Feasibility mask: Check if adding a node violates onboard patients' survival times
         # Calculate projected arrival time at hospital after visiting each node
         hospital_pos = self.nodes[:, 0:1, :2]  # Shape: [batch_size, 1, 2]
-        travel_to_hospital = torch.norm(
-            node_positions.unsqueeze(1) - hospital_pos.unsqueeze(2),
-            dim=-1
-        ) / self._sample_speed()  # Shape: [batch_size, 1, nodes_count]
+        if self.travel is None:
+            dists_to_hospital = torch.norm(
+                node_positions.unsqueeze(1) - hospital_pos.unsqueeze(2),
+                dim=-1
+            )  # Shape: [batch_size, 1, nodes_count]
+        else:
+            dists_to_hospital = self.travel[:, :, 0].unsqueeze(1)
+        # Leaving each node when arriving there
+        travel_to_hospital = self._travel_time(arrival_times, dists_to_hospital, node_positions.unsqueeze(1),
+                self._sample_speed())  # Shape: [batch_size, 1, nodes_count]
         total_times_to_hospital = arrival_times + 0 + travel_to_hospital  # Assuming zero service time
 
         # Get minimum survival times among onboard patients
@@ -125,11 +137,15 @@ class ARP_Environment(VRP_Environment):
         self.mask.scatter_(1, self.cur_veh_idx.unsqueeze(2).expand(-1, -1, self.nodes_count), combined_mask)
         self.mask[:, :, 0] = False  # Depot is always available
 
-    def _update_vehicles(self, dest):
+    def _update_vehicles(self, dest, cust_idx):
         """Update vehicle states after moving to a destination node."""
         # Calculate travel distance and time to destination
-        dist = torch.norm(self.cur_veh[:, :, :2] - dest[:, :, :2], dim=2, keepdim=True)  # Shape: [batch_size, 1, 1]
-        tt = dist / self._sample_speed()  # Shape: [batch_size, 1, 1]
+        if self.travel is None:
+            dist = torch.norm(self.cur_veh[:, :, :2] - dest[:, :, :2], dim=2, keepdim=True)  # Shape: [batch_size, 1, 1]
+        else:
+            dist = self._dist(dest, cust_idx).unsqueeze(2)  # Looked up in the oracle table
+        tt = self._travel_time(self.cur_veh[:, :, 3].unsqueeze(2), dist, self.cur_veh[:, :, None, :2],
+                self._sample_speed())  # Shape: [batch_size, 1, 1]
 
         # Update current time after moving to destination
         arrival_time_at_dest = self.cur_veh[:, :, 3].unsqueeze(2) + tt  # Shape: [batch_size, 1, 1]
@@ -180,6 +196,8 @@ class ARP_Environment(VRP_Environment):
             self.cur_veh
         )
 
+        self._update_veh_node(cust_idx)
+
         # Calculate reward: negative distance plus penalties
         reward = -dist.squeeze(2) + penalties
 
@@ -220,7 +238,7 @@ class ARP_Environment(VRP_Environment):
             1,
             cust_idx.unsqueeze(2).expand(-1, -1, self.CUST_FEAT_SIZE)
         )  # Shape: [batch_size, 1, CUST_FEAT_SIZE]
-        reward = self._update_vehicles(dest)
+        reward = self._update_vehicles(dest, cust_idx)
 
         # Mark customers as served
         served_customers = cust_idx.squeeze(1)  # Shape: [batch_size]
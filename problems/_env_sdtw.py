@@ -19,9 +19,11 @@ class SDVRPTW_Environment(SVRPTW_Environment):
             self._update_cur_veh()
 
     def reset(self):
+        self.travel = None if self.travel_oracle is None else self.travel_oracle(self.nodes)
         self.vehicles = self.nodes.new_zeros((self.minibatch_size, self.veh_count, self.VEH_STATE_SIZE))
         self.vehicles[:,:,:2] = self.nodes[:,0:1,:2]
         self.vehicles[:,:,2] = self.veh_capa
+        self.veh_node = self.nodes.new_zeros((self.minibatch_size, self.veh_count), dtype = torch.int64)
 
         self.veh_done = self.nodes.new_zeros((self.minibatch_size, self.veh_count), dtype = torch.bool)
         self.done = False
@@ -36,6 +38,7 @@ class SDVRPTW_Environment(SVRPTW_Environment):
 
         self.cur_veh_idx = self.nodes.new_zeros((self.minibatch_size, 1), dtype = torch.int64)
         self.cur_veh = self.vehicles.gather(1, self.cur_veh_idx[:,:,None].expand(-1,-1,self.VEH_STATE_SIZE))
+        self.cur_veh_node = self.veh_node.gather(1, self.cur_veh_idx)
         self.cur_veh_mask = self.mask.gather(1, self.cur_veh_idx[:,:,None].expand(-1,-1,self.nodes_count))
 
     def step(self, cust_idx):
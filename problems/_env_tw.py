@@ -12,9 +12,9 @@ class VRPTW_Environment(VRP_Environment):
     def _sample_speed(self):
         return self.veh_speed
 
-    def _update_vehicles(self, dest):
-        dist = torch.pairwise_distance(self.cur_veh[:,0,:2], dest[:,0,:2], keepdim = True)
-        tt = dist / self._sample_speed()
+    def _update_vehicles(self, dest, cust_idx):
+        dist = self._dist(dest, cust_idx)
+        tt = self._travel_time(self.cur_veh[:,:,3], dist, self.cur_veh[:,:,:2], self._sample_speed())
         arv = torch.max(self.cur_veh[:,:,3] + tt, dest[:,:,3])
         late = ( arv - dest[:,:,4] ).clamp_(min = 0)
 
@@ -24,11 +24,12 @@ class VRPTW_Environment(VRP_Environment):
 
         self.vehicles = self.vehicles.scatter(1,
                 self.cur_veh_idx[:,:,None].expand(-1,-1,self.VEH_STATE_SIZE), self.cur_veh)
+        self._update_veh_node(cust_idx)
         return dist, late
 
     def step(self, cust_idx):
         dest = self.nodes.gather(1, cust_idx[:,:,None].expand(-1,-1,self.CUST_FEAT_SIZE))
-        dist, late = self._update_vehicles(dest)
+        dist, late = self._update_vehicles(dest, cust_idx)
         self._update_done(cust_idx)
         self._update_mask(cust_idx)
         self._update_cur_veh()
@@ -0,0 +1,188 @@
+from marpdan.dep import CSGRAPH_ENABLED, csr_matrix, dijkstra
+
+import torch
+import heapq
+from collections import OrderedDict
+
+
+class RoadNetwork:
+    r"""
+    Travel-time oracle on a road graph, replacing straight-line distances between nodes.
+    Nodes are snapped to their nearest graph vertex, and the travel time between two nodes is the length of the
+    shortest path between their vertices plus the straight-line legs from and to the road.
+    Tables of a minibatch are computed with multi-source Dijkstra runs over chunks of its new vertices,
+    and both shortest path rows per source vertex and tables per set of node coordinates are cached
+    up to a size in bytes. Training samples new instances at every minibatch, which never hit the table cache,
+    so its default size only fits a fixed test set (e.g. 1024 instances of 100 customers).
+
+    An environment uses it once its ``travel_oracle`` attribute is set, before calling ``reset``.
+    Coordinates and weights must be in the same frame as the nodes, see :meth:`normalized`.
+    """
+    def __init__(self, coords, edges, weights, directed = False, max_row_bytes = 2**28, max_table_bytes = 2**26,
+            source_chunk = 256):
+        r"""
+        :param coords:          :math:`V \times 2` tensor of vertex coordinates
+        :param edges:           :math:`E \times 2` tensor of source and target vertex indices
+        :param weights:         :math:`E` tensor of travel times along edges
+        :param directed:        Only allow travelling edges from source to target
+        :param max_row_bytes:   Size of the cache of shortest path rows (one per source vertex, of size :math:`V`)
+        :param max_table_bytes: Size of the cache of tables (one per set of node coordinates)
+        :param source_chunk:    Number of source vertices whose rows are computed and held at once
+        """
+        self.coords = coords.float()
+        self.edges = edges.long()
+        self.weights = weights.float()
+        self.directed = directed
+        self.max_row_bytes = max_row_bytes
+        self.max_table_bytes = max_table_bytes
+        self.source_chunk = source_chunk
+
+        self._rows = OrderedDict()
+        self._row_bytes = 0
+        self._tables = OrderedDict()
+        self._table_bytes = 0
+        self._use_csgraph = CSGRAPH_ENABLED
+        if self._use_csgraph:
+            # Parallel edges would be summed when building the sparse matrix, keep the fastest of them
+            v = self.coords.size(0)
+            keys, inv = (self.edges[:,0] * v + self.edges[:,1]).unique(return_inverse = True)
+            fastest = self.weights.new_full(keys.size(), float('inf')).scatter_reduce(0, inv, self.weights, "amin")
+            self._csr = csr_matrix((fastest.numpy(), ((keys // v).numpy(), (keys % v).numpy())), shape = (v, v))
+        else:
+            self._adj = [[] for _ in range(self.coords.size(0))]
+            for (u, w), c in zip(self.edges.tolist(), self.weights.tolist()):
+                self._adj[u].append( (w, c) )
+                if not directed:
+                    self._adj[w].append( (u, c) )
+
+    @classmethod
+    def load(cls, fpath, **kwargs):
+        r"""
+        Read a graph from a text file with one vertex ``v <x> <y>``, undirected edge ``e <u> <v> <time>``
+        or directed arc ``a <u> <v> <time>`` per line (vertices indexed from 0 in order), or from a ``.pyth``
+        file holding a dict with ``coords``, ``edges``, ``weights`` and optionally ``directed``.
+        """
+        if fpath.endswith(".pyth"):
+            graph = torch.load(fpath)
+            return cls(graph["coords"], graph["edges"], graph["weights"], graph.get("directed", False), **kwargs)
+        coords, edges, weights = [], [], []
+        with open(fpath) as f:
+            for line in f:
+                tok = line.split()
+                if not tok or tok[0].startswith('#'):
+                    continue
+                if tok[0] == 'v':
+                    coords.append( (float(tok[1]), float(tok[2])) )
+                elif tok[0] in ('e', 'a'):
+                    u, w, c = int(tok[1]), int(tok[2]), float(tok[3])
+                    edges.append( (u, w) )
+                    weights.append(c)
+                    if tok[0] == 'e':
+                        edges.append( (w, u) )
+                        weights.append(c)
+        return cls(torch.tensor(coords), torch.tensor(edges).view(-1, 2), torch.tensor(weights), True, **kwargs)
+
+    def normalized(self, loc_off, loc_scl):
+        r"""
+        :return: Copy of the network in the frame of a dataset normalized with location offset ``loc_off``
+                and scale ``loc_scl``, where travel times are expressed in the same unit as normalized distances
+        """
+        return type(self)((self.coords - loc_off) / loc_scl, self.edges, self.weights / loc_scl, self.directed,
+                self.max_row_bytes, self.max_table_bytes, self.source_chunk)
+
+    def snap(self, xy, chunk_size = 4096):
+        r"""
+        :param xy: :math:`P \times 2` tensor of coordinates
+        :return:   :math:`P` tensors of the nearest vertex indices and the distances to them
+        """
+        dists, idx = [], []
+        for chunk in xy.float().cpu().split(chunk_size):
+            d, i = torch.cdist(chunk, self.coords).min(dim = 1)
+            dists.append(d)
+            idx.append(i)
+        return torch.cat(idx), torch.cat(dists)
+
+    def _shortest_paths(self, sources):
+        if self._use_csgraph:
+            return torch.from_numpy(dijkstra(self._csr, directed = self.directed, indices = sources)).float()
+        rows = torch.full((len(sources), self.coords.size(0)), float('inf'))
+        for k, s in enumerate(sources):
+            dist = rows[k].tolist()
+            dist[s] = 0.0
+            heap = [(0.0, s)]
+            while heap:
+                d, u = heapq.heappop(heap)
+                if d > dist[u]:
+                    continue
+                for w, c in self._adj[u]:
+                    if d + c < dist[w]:
+                        dist[w] = d + c
+                        heapq.heappush(heap, (d + c, w))
+            rows[k] = torch.tensor(dist)
+        return rows
+
+    @staticmethod
+    def _evict(cache, size, max_size):
+        while cache and size > max_size:
+            _, val = cache.popitem(last = False)
+            size -= val.numel() * val.element_size()
+        return size
+
+    def _get_rows(self, sources):
+        r"""
+        :param sources: List of distinct source vertices
+        :return:        :math:`len(sources) \times V` tensor of shortest path lengths from them
+        """
+        missing = [s for s in sources if s not in self._rows]
+        computed = dict(zip(missing, self._shortest_paths(missing))) if missing else {}
+        rows = torch.stack([computed[s] if s in computed else self._rows[s] for s in sources])
+        for s in sources:
+            if s in computed:
+                # Cloned so that a cached row does not keep the whole chunk it was computed with alive
+                self._rows[s] = computed[s].clone()
+                self._row_bytes += computed[s].numel() * computed[s].element_size()
+            self._rows.move_to_end(s)
+        self._row_bytes = self._evict(self._rows, self._row_bytes, self.max_row_bytes)
+        return rows
+
+    def _build_tables(self, coords):
+        r"""
+        :param coords: :math:`N \times L_c \times 2` tensor of node coordinates
+        :return:       :math:`N \times L_c \times L_c` tensor of travel times between every pair of nodes
+        """
+        n, l_c, _ = coords.size()
+        vert, offroad = self.snap(coords.view(-1, 2))
+        vert = vert.view(n, l_c)
+        offroad = offroad.view(n, l_c)
+        uniq, inv = vert.unique(return_inverse = True)
+        tables = offroad.new_empty((n, l_c, l_c))
+        # Only the rows of a chunk of source vertices are held at once, and only columns of the nodes are kept
+        for lo in range(0, uniq.size(0), self.source_chunk):
+            rows = self._get_rows(uniq[lo:lo + self.source_chunk].tolist()) #.size() = C x V
+            inst, src = ((inv >= lo) & (inv < lo + self.source_chunk)).nonzero(as_tuple = True)
+            tables[inst, src] = rows[inv[inst, src][:,None] - lo, vert[inst]]
+        tables += offroad[:,:,None] + offroad[:,None,:]
+        # Distinct nodes at the same location (e.g. co-located patients) are reached without travelling
+        tables[(coords[:,:,None,:] == coords[:,None,:,:]).all(dim = 3)] = 0
+        return tables
+
+    def __call__(self, nodes):
+        r"""
+        :param nodes: :math:`N \times L_c \times D_c` tensor containing minibatch of nodes' features
+        :return:      :math:`N \times L_c \times L_c` tensor of travel times between every pair of nodes
+        """
+        coords = nodes[:,:,:2].detach().cpu().contiguous()
+        keys = [c.numpy().tobytes() for c in coords]
+        tables = [self._tables.get(key) for key in keys]
+        missing = [n for n, table in enumerate(tables) if table is None]
+        if missing:
+            for n, table in zip(missing, self._build_tables(coords[missing])):
+                tables[n] = table
+                if keys[n] not in self._tables:
+                    self._tables[keys[n]] = table
+                    self._table_bytes += table.numel() * table.element_size()
+        for key in keys:
+            if key in self._tables:
+                self._tables.move_to_end(key)
+        self._table_bytes = self._evict(self._tables, self._table_bytes, self.max_table_bytes)
+        return torch.stack(tables).to(nodes.device)
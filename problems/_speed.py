@@ -0,0 +1,99 @@
+import torch
+
+
+class SpeedProfile:
+    r"""
+    Time-dependent speeds, as a :math:`S \times Z` tensor of factors of the nominal vehicle speed for every
+    time slot of length :math:`W` (repeating with period :math:`S W`) and every zone of a regular grid.
+    The zone of a trip is the one of its departure, and the speed follows the slots during the trip, so that
+    travel times are the piecewise integration of the speeds and vehicles departing later never arrive earlier.
+
+    An environment uses it once its ``speed_profile`` attribute is set. Times and coordinates are in the frame
+    of the environment, e.g. slot lengths are fractions of the horizon for normalized datasets.
+    """
+    def __init__(self, factors, slot_len, zone_grid = (1, 1), extent = (0, 0, 1, 1), min_factor = 1e-3):
+        r"""
+        :param factors:    :math:`S \times Z` tensor of speed factors
+        :param slot_len:   Length :math:`W` of time slots
+        :param zone_grid:  Number of zones along :math:`x` and :math:`y`, such that :math:`Z = Z_x Z_y`
+        :param extent:     Area :math:`(x_0, y_0, x_1, y_1)` split in zones, locations outside of it belong to the closest zone
+        :param min_factor: Lower bound on speed factors, which must be positive for travel times to be finite
+        """
+        if factors.size(1) != zone_grid[0] * zone_grid[1]:
+            raise ValueError("Expected {} zones of speed factors, got {}".format(
+                zone_grid[0] * zone_grid[1], factors.size(1)))
+        self.slot_count = factors.size(0)
+        self.slot_len = slot_len
+        self.period = self.slot_count * slot_len
+        self.zone_grid = zone_grid
+        self.extent = extent
+
+        self.factors = factors.t().float().clamp(min = min_factor).contiguous() #.size() = Z x S
+        # Distance covered at unit nominal speed from the start of the period to the start of every slot
+        self.cum = torch.cat((self.factors.new_zeros((self.factors.size(0), 1)),
+            self.factors.cumsum(dim = 1) * slot_len), dim = 1) #.size() = Z x (S+1)
+        self._build_tables()
+
+    def _build_tables(self):
+        z, s = self.factors.size()
+        dev = self.factors.device
+        # Per zone and slot (flat index zone * S + slot), the affine pieces of the distance covered since time 0
+        # as a function of the time, and of their inverse, as rows gathered once per trip
+        slot_start = torch.arange(s, device = dev, dtype = torch.float) * self.slot_len
+        per_dist = self.cum[:,-1:].expand(-1, s)
+        per_ratio = per_dist / self.period
+        self._fwd = torch.stack((self.cum[:,:-1] - self.factors * slot_start, self.factors - per_ratio,
+            per_ratio, per_dist), dim = 2).view(-1, 4) #.size() = ZS x 4
+        self._inv = torch.stack((self.cum[:,:-1], self.factors.reciprocal(), slot_start.expand(z, -1),
+            per_ratio.reciprocal()), dim = 2).view(-1, 4) #.size() = ZS x 4
+        # Inner slot bounds of every zone closed by a bound out of reach, offset by zone so that they are sorted
+        # as a whole and that the count of bounds below a distance is its flat index
+        max_dist = self.cum[:,-1].max().item()
+        self._zone_off = 4 * max_dist
+        self._bounds = (torch.cat((self.cum[:,1:-1], self.cum.new_full((z, 1), 2 * max_dist)), dim = 1)
+                + self._zone_off * torch.arange(z, device = dev, dtype = torch.float)[:,None]).view(-1) #.size() = ZS
+        # Zone of a location from both of its coordinates at once
+        x0, y0, x1, y1 = self.extent
+        gx, gy = self.zone_grid
+        self._origin = torch.tensor([x0, y0], device = dev, dtype = torch.float)
+        self._scale = torch.tensor([gx / (x1 - x0), gy / (y1 - y0)], device = dev, dtype = torch.float)
+        self._last_cell = torch.tensor([gx-1, gy-1], device = dev)
+        self._stride = torch.tensor([gy, 1], device = dev)
+
+    def to(self, device):
+        self.factors = self.factors.to(device)
+        self.cum = self.cum.to(device)
+        self._build_tables()
+        return self
+
+    def zone(self, pos):
+        r"""
+        :param pos: :math:`... \times 2` tensor of coordinates
+        :return:    :math:`...` tensor of zone indices
+        """
+        cell = ((pos - self._origin) * self._scale).long().clamp_(min = 0)
+        return (torch.minimum(cell, self._last_cell) * self._stride).sum(-1)
+
+    def travel_time(self, depart, dist, pos):
+        r"""
+        :param depart: Departure times, broadcastable with ``dist``
+        :param dist:   Distances to travel, in time units at nominal speed (distance divided by nominal speed)
+        :param pos:    :math:`... \times 2` coordinates of departure, whose zones are broadcastable with ``dist``
+        :return:       Travel times with the size of ``dist`` broadcast with the other inputs
+        """
+        if self.cum.device != dist.device:
+            self.to(dist.device)
+        depart, dist, zone = torch.broadcast_tensors(depart, dist, self.zone(pos))
+        size = dist.size()
+        depart, dist, zone = depart.reshape(-1), dist.reshape(-1), zone.reshape(-1)
+
+        # Distance covered since time 0 at departure, then time at which the trip distance is covered
+        tau = depart.remainder(self.period)
+        slot = torch.div(tau, self.slot_len, rounding_mode = "floor").long().clamp_(0, self.slot_count - 1)
+        base, slope, per_ratio, per_dist = self._fwd.index_select(0, zone * self.slot_count + slot).unbind(1)
+        target = (base + dist).addcmul_(slope, tau).addcmul_(per_ratio, depart)
+        rem = target.remainder(per_dist)
+        idx = torch.searchsorted(self._bounds, rem + self._zone_off * zone, right = True)
+        cum, inv_factor, slot_start, inv_ratio = self._inv.index_select(0, idx).unbind(1)
+        arrive = slot_start.addcmul(inv_ratio, target - rem).addcmul_(inv_factor, rem - cum)
+        return (arrive - depart).view(size)
@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+
+from marpdan import AttentionLearner
+from marpdan.problems import *
+
+import torch
+
+from argparse import ArgumentParser
+import subprocess
+import resource
+import platform
+import json
+import time
+import sys
+
+ENVS = {
+        "vrp": (VRP_Dataset, VRP_Environment),
+        "vrptw": (VRPTW_Dataset, VRPTW_Environment),
+        "svrptw": (VRPTW_Dataset, SVRPTW_Environment),
+        "sdvrptw": (SDVRPTW_Dataset, SDVRPTW_Environment),
+        "arp": (ARP_Dataset, ARP_Environment)
+        }
+SIZES = (10, 20, 50, 100)
+BATCH_SIZES = (1, 64, 512)
+REPEAT = 3
+TOLERANCE = 0.15
+
+# Metrics where higher is better, all others are latencies or memory where lower is better
+THROUGHPUTS = ("env_steps_s", "policy_steps_s")
+
+
+def parse_args():
+    parser = ArgumentParser()
+    parser.add_argument("--envs", nargs = '+', choices = list(ENVS), default = list(ENVS))
+    parser.add_argument("--sizes", type = int, nargs = '+', default = SIZES)
+    parser.add_argument("--batch-sizes", type = int, nargs = '+', default = BATCH_SIZES)
+    parser.add_argument("--repeat", type = int, default = REPEAT,
+            help = "Number of timed runs of every configuration, of which the best is kept")
+    parser.add_argument("--output", "-o", type = str, default = "benchmark.json")
+    parser.add_argument("--compare", "-c", type = str, default = None,
+            help = "Path to the results of a previous run, to flag regressions against")
+    parser.add_argument("--tolerance", type = float, default = TOLERANCE,
+            help = "Relative slow down beyond which a metric is flagged as a regression")
+    parser.add_argument("--no-cuda", action = "store_true", default = False)
+    parser.add_argument("--single", nargs = 3, default = None, metavar = ("ENV", "SIZE", "BATCH"),
+            help = "Benchmark a single configuration in this process and print its results (used internally)")
+    return parser.parse_args()
+
+
+def _timed(fn, repeat, dev):
+    best = float('inf')
+    for _ in range(repeat):
+        if dev.type == "cuda":
+            torch.cuda.synchronize()
+        start = time.perf_counter()
+        out = fn()
+        if dev.type == "cuda":
+            torch.cuda.synchronize()
+        best = min(best, time.perf_counter() - start)
+    return best, out
+
+
+def _make_env(env_key, size, batch_size, dev):
+    Dataset, Environment = ENVS[env_key]
+    if env_key == "arp":
+        data = ARP_Dataset.generate(batch_size, size, size // 5)
+        return data, Environment(data, data.nodes.to(dev))
+    data = Dataset.generate(batch_size, size, size // 5)
+    data.normalize()
+    return data, Environment(data, data.nodes.to(dev))
+
+
+def _random_rollout(dyna):
+    dyna.reset()
+    steps = 0
+    while not dyna.done:
+        cust_idx = (dyna.cur_veh_mask.squeeze(1) ^ True).float().multinomial(1)
+        dyna.step(cust_idx)
+        steps += 1
+    return steps
+
+
+def _policy_rollout(learner, dyna):
+    dyna.reset()
+    steps = 0
+    with torch.no_grad():
+        while not dyna.done:
+            if dyna.new_customers:
+                learner._encode_customers(dyna.nodes, dyna.cust_mask)
+            cust_idx, _ = learner.step(dyna)
+            dyna.step(cust_idx)
+            steps += 1
+    return steps
+
+
+def bench_single(env_key, size, batch_size, repeat, dev):
+    torch.manual_seed(0)
+    data, dyna = _make_env(env_key, size, batch_size, dev)
+    res = {"env": env_key, "size": size, "veh_count": size // 5, "batch_size": batch_size}
+
+    if dev.type == "cuda":
+        torch.cuda.reset_peak_memory_stats()
+    base_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    t, steps = _timed(lambda: _random_rollout(dyna), repeat, dev)
+    res["env_steps_s"] = steps * batch_size / t
+
+    if env_key == "arp":
+        # The hospital node has infinite survival times, which the attention model cannot embed yet
+        res.update(encode_ms = None, decode_ms_per_inst = None, policy_steps_s = None)
+    else:
+        learner = AttentionLearner(data.CUST_FEAT_SIZE, dyna.VEH_STATE_SIZE, greedy = True).to(dev)
+        learner.eval()
+        with torch.no_grad():
+            t, _ = _timed(lambda: learner._encode_customers(dyna.nodes, dyna.init_cust_mask), repeat, dev)
+        res["encode_ms"] = 1e3 * t
+        t, steps = _timed(lambda: _policy_rollout(learner, dyna), repeat, dev)
+        res["decode_ms_per_inst"] = 1e3 * t / batch_size
+        res["policy_steps_s"] = steps * batch_size / t
+
+    if dev.type == "cuda":
+        res["peak_mem_mb"] = torch.cuda.max_memory_allocated() / 2**20
+    else:
+        # Growth of the resident set size high-water mark above what data generation needed (kB on Linux)
+        res["peak_mem_mb"] = (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - base_rss) / 2**10
+    return res
+
+
+def compare(results, ref_results, tolerance):
+    ref = {(r["env"], r["size"], r["batch_size"]): r for r in ref_results}
+    regressions = []
+    for res in results:
+        prev = ref.get( (res["env"], res["size"], res["batch_size"]) )
+        if prev is None or "error" in res or "error" in prev:
+            continue
+        for key, val in res.items():
+            if not isinstance(val, float) or not isinstance(prev.get(key), float) or prev[key] <= 0:
+                continue
+            ratio = val / prev[key]
+            if (key in THROUGHPUTS and ratio < 1 - tolerance) or (key not in THROUGHPUTS and ratio > 1 + tolerance):
+                regressions.append( (res["env"], res["size"], res["batch_size"], key, prev[key], val) )
+    return regressions
+
+
+def main(args):
+    dev = torch.device("cuda" if torch.cuda.is_available() and not args.no_cuda else "cpu")
+    if args.single is not None:
+        env_key, size, batch_size = args.single
+        try:
+            res = bench_single(env_key, int(size), int(batch_size), args.repeat, dev)
+        except Exception as e:
+            res = {"env": env_key, "size": int(size), "veh_count": int(size) // 5, "batch_size": int(batch_size),
+                    "error": "{}: {}".format(type(e).__name__, e)}
+        print(json.dumps(res))
+        return
+
+    results = []
+    print("{: <8} {: >5} {: >6} {: >14} {: >12} {: >16} {: >14} {: >12}".format(
+        "ENV", "N", "BATCH", "ENV STEPS/S", "ENCODE MS", "DECODE MS/INST", "POL. STEPS/S", "PEAK MB"))
+    for env_key in args.envs:
+        for size in args.sizes:
+            for batch_size in args.batch_sizes:
+                # Every configuration runs in a fresh process to measure its own peak memory
+                cmd = [sys.executable, __file__, "--single", env_key, str(size), str(batch_size),
+                        "--repeat", str(args.repeat)] + (["--no-cuda"] if args.no_cuda else [])
+                res = json.loads( subprocess.run(cmd, capture_output = True, check = True, text = True).stdout )
+                results.append(res)
+                if "error" in res:
+                    print("{env: <8} {size: >5d} {batch_size: >6d} FAILED {error}".format(**res))
+                    continue
+                print("{env: <8} {size: >5d} {batch_size: >6d} {0: >14} {1: >12} {2: >16} {3: >14} {4: >12}".format(
+                    *("-" if res[key] is None else "{:.4g}".format(res[key]) for key in
+                        ("env_steps_s", "encode_ms", "decode_ms_per_inst", "policy_steps_s", "peak_mem_mb")),
+                    **res))
+
+    with open(args.output, 'w') as f:
+        json.dump({
+            "torch": torch.__version__,
+            "device": dev.type,
+            "threads": torch.get_num_threads(),
+            "machine": platform.processor() or platform.machine(),
+            "results": results
+            }, f, indent = 4)
+
+    if args.compare is not None:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f)["results"], args.tolerance)
+        for env_key, size, batch_size, key, prev, val in regressions:
+            print("REGRESSION {} n{} b{} {}: {:.4g} -> {:.4g}".format(env_key, size, batch_size, key, prev, val))
+        if regressions:
+            sys.exit(1)
+        print("No regression beyond {:.0%} against '{}'".format(args.tolerance, args.compare))
+
+
+if __name__ == "__main__":
+    main(parse_args())
@@ -1,5 +1,5 @@
-from mardan.dep import ORTOOLS_ENABLED, pywrapcp, routing_enums_pb2
-from mardan.dep import tqdm
+from marpdan.dep import ORTOOLS_ENABLED, pywrapcp, routing_enums_pb2
+from marpdan.dep import tqdm
 
 from argparse import ArgumentParser
 import os.path
@@ -18,34 +18,38 @@ LOC = slice(0, 2)
 TIMES = slice(3, 7)
 
 
-def _solve_cp(nodes, dist, veh_count, veh_capa, veh_speed, pending_cost, late_cost, partial_routes=None, t=0):
+def _solve_cp(nodes, dist, veh_count, veh_capa, veh_speed, pending_cost, late_cost, partial_routes=None, t=0,
+              init_routes=None, time_limit=None, metaheuristic=None):
     horizon = int(nodes[DEPOT, DUE])
     nodes_count = nodes.size(0)
 
     vis = nodes[:, APR] <= t
     vis_idx = torch.arange(nodes_count)[vis].tolist()
-    vis_count = int(vis.sum())
+    vis_count = len(vis_idx)
+    rev_idx = {vis_i:to_n for to_n, vis_i in enumerate(vis_idx)}
+
+    # Callbacks only look up plain lists of ints restricted to visible nodes
+    vis_nodes = nodes[vis]
+    vis_dist = dist[vis][:, vis]
+    dist_mat = vis_dist.long().tolist()
+    time_mat = (vis_nodes[:, DUR, None] + vis_dist / veh_speed).long().tolist()
+    dems = vis_nodes[:, DEM].long().tolist()
 
     manager = pywrapcp.RoutingIndexManager(vis_count, veh_count, 0)
     routing = pywrapcp.RoutingModel(manager)
 
     def dist_cb(from_i, to_i):
-        from_n = manager.IndexToNode(from_i)
-        to_n = manager.IndexToNode(to_i)
-        return int(dist[vis_idx[from_n], vis_idx[to_n]])
+        return dist_mat[manager.IndexToNode(from_i)][manager.IndexToNode(to_i)]
     dist_cb_idx = routing.RegisterTransitCallback(dist_cb)
     routing.SetArcCostEvaluatorOfAllVehicles(dist_cb_idx)
 
     def dem_cb(from_i):
-        from_n = manager.IndexToNode(from_i)
-        return int(nodes[vis_idx[from_n], DEM])
+        return dems[manager.IndexToNode(from_i)]
     dem_cb_idx = routing.RegisterUnaryTransitCallback(dem_cb)
     routing.AddDimension(dem_cb_idx, 0, veh_capa, True, "Capacity")
 
     def t_cb(from_i, to_i):
-        from_n = manager.IndexToNode(from_i)
-        to_n = manager.IndexToNode(to_i)
-        return int(nodes[vis_idx[from_n], DUR] + dist[vis_idx[from_n], vis_idx[to_n]] / veh_speed)
+        return time_mat[manager.IndexToNode(from_i)][manager.IndexToNode(to_i)]
     t_cb_idx = routing.RegisterTransitCallback(t_cb)
     routing.AddDimension(t_cb_idx, horizon, 2 * horizon, False, "Time")
 
@@ -62,15 +66,28 @@ def _solve_cp(nodes, dist, veh_count, veh_capa, veh_speed, pending_cost, late_co
     for to_n in range(1, vis_count):
         routing.AddDisjunction([manager.NodeToIndex(to_n)], pending_cost, 1)
 
+    params = pywrapcp.DefaultRoutingSearchParameters()
+    params.first_solution_strategy = routing_enums_pb2.FirstSolutionStrategy.PATH_CHEAPEST_ARC
+    if metaheuristic is not None:
+        params.local_search_metaheuristic = getattr(routing_enums_pb2.LocalSearchMetaheuristic, metaheuristic)
+    if time_limit is not None:
+        params.time_limit.FromMilliseconds(int(1000 * time_limit))
+
+    if partial_routes is not None or init_routes is not None:
+        routing.CloseModelWithParameters(params)
     if partial_routes is not None:
-        routing.CloseModel()
-        rev_idx = {vis_i:to_n for to_n, vis_i in enumerate(vis_idx)}
         locks = [[rev_idx[vis_i] for vis_i in route] for route in partial_routes]
         routing.ApplyLocksToAllVehicles(locks, False)
 
-    params = pywrapcp.DefaultRoutingSearchParameters()
-    params.first_solution_strategy = routing_enums_pb2.FirstSolutionStrategy.PATH_CHEAPEST_ARC
-    solution = routing.SolveWithParameters(params)
+    init = None
+    if init_routes is not None:
+        # Previous plan, newly visible customers are left unperformed for the search to insert
+        init = routing.ReadAssignmentFromRoutes([[rev_idx[vis_i] for vis_i in route if vis_i != DEPOT]
+                                                 for route in init_routes], True)
+    if init is None:
+        solution = routing.SolveWithParameters(params)
+    else:
+        solution = routing.SolveFromAssignmentWithParameters(init, params)
 
     routes = [[] for _ in range(veh_count)]
     traj = []
@@ -87,7 +104,7 @@ def _solve_cp(nodes, dist, veh_count, veh_capa, veh_speed, pending_cost, late_co
     return routes, traj
 
 
-def _solve_loop(nodes, veh_count, veh_capa, veh_speed, pending_cost, late_cost):
+def _solve_loop(nodes, veh_count, veh_capa, veh_speed, pending_cost, late_cost, time_limit=None, metaheuristic=None):
     hidden = nodes[:, APR] > 0
     aprs = nodes[hidden, APR].tolist()
     aprs.sort(reverse=True)
@@ -95,11 +112,12 @@ def _solve_loop(nodes, veh_count, veh_capa, veh_speed, pending_cost, late_cost):
     dist = (nodes[:, None, LOC] - nodes[None, :, LOC]).pow(2).sum(axis=2).pow(0.5).ceil()
 
     partial = None
+    routes = None
     t = 0
 
     while aprs:
         routes, traj = _solve_cp(nodes, dist, veh_count, veh_capa, veh_speed, pending_cost, late_cost,
-                                 partial, t)
+                                 partial, t, routes, time_limit, metaheuristic)
         partial = [[] for _ in range(veh_count)]
         for t, veh_i, to_n in traj:
             if t < aprs[-1]:
@@ -111,22 +129,23 @@ def _solve_loop(nodes, veh_count, veh_capa, veh_speed, pending_cost, late_cost):
             break
         else:
             t = aprs.pop()
-    routes, traj = _solve_cp(nodes, dist, veh_count, veh_capa, veh_speed, pending_cost, late_cost, partial, t)
+    routes, traj = _solve_cp(nodes, dist, veh_count, veh_capa, veh_speed, pending_cost, late_cost, partial, t,
+                             routes, time_limit, metaheuristic)
     return routes
 
 
-def ort_solve_dyna(data, pending_cost=200, late_cost=1, no_mp=False):
+def ort_solve_dyna(data, pending_cost=200, late_cost=1, no_mp=False, time_limit=None, metaheuristic=None):
     if no_mp:
         routes = []
         for nodes in tqdm(data.nodes):
             routes.append(_solve_loop(nodes, data.veh_count, data.veh_capa, data.veh_speed,
-                                      pending_cost, late_cost))
+                                      pending_cost, late_cost, time_limit, metaheuristic))
         return routes
     else:
         with Pool() as p:
             with tqdm(desc = "Calling ORTools", total = data.batch_size) as pbar:
                 results = [p.apply_async(_solve_loop, (nodes, data.veh_count, data.veh_capa, data.veh_speed,
-                                                       pending_cost, late_cost),
+                                                       pending_cost, late_cost, time_limit, metaheuristic),
                                          callback=lambda _:pbar.update()) for nodes in data.nodes]
                 routes = [res.get(timeout=240) for res in results]
     return routes
@@ -140,7 +159,12 @@ def parse_args():
     parser.add_argument("--pending-cost", type=int, default=200)
     parser.add_argument("--late-cost", type=int, default=1)
     parser.add_argument("--no-mp", action="store_true")
-    return parser.parse_args()
+    parser.add_argument("--replan-time-limit", type=float, default=None)
+    parser.add_argument("--metaheuristic", type=str, default=None)
+    args = parser.parse_args()
+    if args.metaheuristic is not None and args.replan_time_limit is None:
+        parser.error("--metaheuristic never stops on its own and requires --replan-time-limit")
+    return args
 
 
 def main(args):
@@ -158,7 +182,8 @@ def main(args):
         unnorm_data = SDVRPTW_Dataset(data.veh_count, data.veh_capa, data.veh_speed, nodes, data.cust_mask)
         data.normalize()
 
-    routes = ort_solve_dyna(unnorm_data, args.pending_cost, args.late_cost, args.no_mp)
+    routes = ort_solve_dyna(unnorm_data, args.pending_cost, args.late_cost, args.no_mp,
+                            args.replan_time_limit, args.metaheuristic)
     torch.save(routes, "DUMP_routes_dyn.pyth")
 #    routes = torch.load("DUMP_routes_dyn.pyth")
 
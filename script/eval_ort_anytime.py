@@ -0,0 +1,55 @@
+from marpdan import AttentionLearner
+from marpdan.problems import VRPTW_Dataset, VRPTW_Environment
+from marpdan.externals import ort_solve
+from marpdan.utils import actions_to_routes, eval_apriori_routes, load_old_weights
+
+import torch
+import os
+
+TIME_LIMIT = 10
+BUDGETS = (0.1, 0.2, 0.5, 1, 2, 5, 10)
+METAHEURISTICS = ("GREEDY_DESCENT", "GUIDED_LOCAL_SEARCH")
+
+
+def best_cost_at(trace, budget):
+    costs = [c for t,c in trace if t <= budget]
+    return min(costs) if costs else float('nan')
+
+
+for n in (10, 20, 50):
+    m = n // 5
+    out_dir = "results/cvrptw_n{}m{}/".format(n, m)
+    os.makedirs(out_dir, exist_ok = True)
+    data_path = "data/cvrptw_n{}m{}/norm_data.pyth".format(n, m)
+    model_path = "pretrained/cvrptw_n{}m{}.pyth".format(n, m)
+
+    print(" cvrptw{} ".format(n).center(96, '-'))
+
+    data = torch.load(data_path)
+    nodes = data.nodes.clone()
+    nodes[:,:,:2] *= 100
+    nodes[:,:,2] *= 200
+    nodes[:,:,3:] *= 480
+    unnormed = VRPTW_Dataset(data.veh_count, 200, 1, nodes)
+    env = VRPTW_Environment(data)
+
+    learner = AttentionLearner(6,4)
+    chkpt = torch.load(model_path, map_location = "cpu")
+    load_old_weights(learner, chkpt["model"])
+    learner.eval()
+    learner.greedy = True
+    with torch.no_grad():
+        actions, _, _ = learner(env)
+    learned_routes = actions_to_routes(actions, data.batch_size, data.veh_count)
+
+    for meta in METAHEURISTICS:
+        for warm in (False, True):
+            routes, traces = ort_solve(unnormed, time_limit = TIME_LIMIT, metaheuristic = meta,
+                    init_routes = learned_routes if warm else None, trace = True)
+            costs = eval_apriori_routes(env, routes, 1)
+            key = "{}{}".format(meta.lower(), "_warm" if warm else "")
+            print("{: <28} {:.3f} +- {:.3f}".format(key, costs.mean(), costs.std()))
+            print("    " + "  ".join("t<={}s: {:.1f}".format(b,
+                sum(best_cost_at(tr, b) for tr in traces) / len(traces)) for b in BUDGETS))
+            torch.save({"costs": costs, "routes": routes, "traces": traces},
+                    out_dir + "ort_{}_t{}.pyth".format(key, TIME_LIMIT))
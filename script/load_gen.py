@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+
+from marpdan.problems import *
+
+import torch
+
+from argparse import ArgumentParser
+import asyncio
+import random
+import json
+import time
+
+HOST = "127.0.0.1"
+PORT = 8765
+CONCURRENCY = 64
+REQUEST_COUNT = 5000
+POOL_SIZE = 512
+CHUNK_SIZE = 64
+
+PROBLEMS = {
+        "vrp": (VRP_Dataset, VRP_Environment),
+        "vrptw": (VRPTW_Dataset, VRPTW_Environment),
+        "svrptw": (VRPTW_Dataset, SVRPTW_Environment),
+        "sdvrptw": (SDVRPTW_Dataset, SDVRPTW_Environment),
+        "arp": (ARP_Dataset, ARP_Environment)
+        }
+
+
+def parse_args():
+    parser = ArgumentParser(description = "Send concurrent dispatch requests to script/serve.py "
+            + "and report client-side latency percentiles and throughput")
+    parser.add_argument("--host", type = str, default = HOST)
+    parser.add_argument("--port", type = int, default = PORT)
+    parser.add_argument("--concurrency", "-c", type = int, default = CONCURRENCY,
+            help = "Number of clients, each on its own connection and waiting for its answer before the next request")
+    parser.add_argument("--requests", "-n", type = int, default = REQUEST_COUNT)
+    parser.add_argument("--pool-size", type = int, default = POOL_SIZE,
+            help = "Number of distinct instance states requests are drawn from")
+    parser.add_argument("--rng-seed", type = int, default = None)
+    return parser.parse_args()
+
+
+def make_requests(info, pool_size):
+    r"""
+    :return: List of JSON-encoded dispatch requests matching the problem served, taken at random decision points
+            of random rollouts (only at the start for ARP, which cannot be stepped yet)
+    """
+    Dataset, Environment = PROBLEMS[info["problem_type"]]
+    msgs = []
+    while len(msgs) < pool_size:
+        data = Dataset.generate(CHUNK_SIZE, info["customers_count"], info["vehicles_count"])
+        if info["problem_type"] != "arp":
+            data.normalize()
+        dyna = Environment(data)
+        dyna.reset()
+        if info["problem_type"] != "arp":
+            for _ in range(random.randrange(info["customers_count"])):
+                if dyna.done:
+                    break
+                dyna.step( (dyna.cur_veh_mask.squeeze(1) ^ True).float().multinomial(1) )
+        for n in range(CHUNK_SIZE):
+            veh_idx = dyna.cur_veh_idx[n, 0].item()
+            if dyna.mask[n, veh_idx].all():
+                continue
+            msgs.append( {
+                "nodes": dyna.nodes[n].tolist(),
+                "vehicles": dyna.vehicles[n].tolist(),
+                "veh_idx": veh_idx,
+                "mask": dyna.mask[n].int().tolist(),
+                "cust_mask": None if dyna.cust_mask is None else dyna.cust_mask[n].int().tolist()
+                } )
+    return [json.dumps(msg) for msg in msgs[:pool_size]]
+
+
+async def _query(reader, writer, msg):
+    writer.write(json.dumps(msg).encode() + b'\n')
+    await writer.drain()
+    return json.loads(await reader.readline())
+
+
+async def _client(args, pool, counter, latencies, errors):
+    reader, writer = await asyncio.open_connection(args.host, args.port, limit = 2**24)
+    while counter[0] < args.requests:
+        k = counter[0]
+        counter[0] += 1
+        body = pool[k % len(pool)]
+        start = time.perf_counter()
+        writer.write('{{"id": {}, {}\n'.format(k, body[1:]).encode())
+        await writer.drain()
+        res = json.loads(await reader.readline())
+        latencies.append(time.perf_counter() - start)
+        if "error" in res:
+            errors.append(res["error"])
+    writer.close()
+
+
+async def run(args):
+    reader, writer = await asyncio.open_connection(args.host, args.port, limit = 2**24)
+    info = await _query(reader, writer, {"type": "info"})
+    print("Generating {} requests for {} n{}m{}...".format(args.pool_size, info["problem_type"],
+        info["customers_count"], info["vehicles_count"]), flush = True)
+    pool = make_requests(info, args.pool_size)
+
+    latencies, errors, counter = [], [], [0]
+    start = time.perf_counter()
+    await asyncio.gather(*(_client(args, pool, counter, latencies, errors) for _ in range(args.concurrency)))
+    elapsed = time.perf_counter() - start
+    server_stats = await _query(reader, writer, {"type": "stats"})
+    writer.close()
+
+    latencies.sort()
+    print("{} requests, {} errors{}".format(len(latencies), len(errors), "" if not errors else " (" + errors[0] + ")"))
+    print("Client: p50 {:.2f}ms | p99 {:.2f}ms | {:.0f} req/s".format(1e3 * latencies[len(latencies) // 2],
+        1e3 * latencies[min(len(latencies) - 1, int(0.99 * len(latencies)))], len(latencies) / elapsed))
+    print("Server: " + " | ".join("{} {}".format(key, "{:.4g}".format(val) if isinstance(val, float) else val)
+        for key, val in server_stats.items()))
+
+
+def main(args):
+    if args.rng_seed is not None:
+        random.seed(args.rng_seed)
+        torch.manual_seed(args.rng_seed)
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main(parse_args())
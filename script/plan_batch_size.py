@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+
+from marpdan import AttentionLearner
+from marpdan.problems import *
+from marpdan.baselines import *
+from marpdan.utils import parse_args, write_config_file
+from marpdan.layers import reinforce_loss
+
+import torch
+from torch.optim import Adam
+
+from argparse import ArgumentParser
+import subprocess
+import resource
+import json
+import time
+import os
+import sys
+
+BATCH_SIZES = (32, 64, 128, 256, 512, 1024, 2048)
+PROBE_ITERS = 3
+HEADROOM = 0.9
+PROBE_TIMEOUT = 1800
+
+
+def parse_planner_args():
+    parser = ArgumentParser(description = "Probe training and testing at increasing batch sizes, "
+            + "and pick the ones with the highest throughput that fit in a memory budget. "
+            + "Unknown arguments are parsed as the ones of train.py to describe the run.")
+    parser.add_argument("--memory-budget", type = float, default = None,
+            help = "Memory budget in MB, defaults to the memory currently available")
+    parser.add_argument("--headroom", type = float, default = HEADROOM,
+            help = "Fraction of the budget that the peak memory of probes may use")
+    parser.add_argument("--candidates", type = int, nargs = '+', default = BATCH_SIZES)
+    parser.add_argument("--probe-iters", type = int, default = PROBE_ITERS)
+    parser.add_argument("--write", type = str, default = None,
+            help = "JSON file to write the chosen sizes to, defaults to the config file of the run if given, "
+            + "or to args.json in its output dir")
+    parser.add_argument("--probe", nargs = 2, default = None, metavar = ("MODE", "BATCH"),
+            help = "Run a single 'train' or 'test' probe in this process and print its results (used internally)")
+    return parser.parse_known_args()
+
+
+def _available_mb():
+    with open("/proc/meminfo") as f:
+        for line in f:
+            if line.startswith("MemAvailable:"):
+                return int(line.split()[1]) / 2**10
+    raise RuntimeError("Cannot read available memory, please give --memory-budget")
+
+
+def _build(args, batch_size):
+    Dataset = {
+            "vrp": VRP_Dataset,
+            "vrptw": VRPTW_Dataset,
+            "svrptw": VRPTW_Dataset,
+            "sdvrptw": SDVRPTW_Dataset
+            }.get(args.problem_type)
+    Environment = {
+            "vrp": VRP_Environment,
+            "vrptw": VRPTW_Environment,
+            "svrptw": SVRPTW_Environment,
+            "sdvrptw": SDVRPTW_Environment
+            }.get(args.problem_type)
+    gen_params = [args.customers_count, args.vehicles_count, args.veh_capa, args.veh_speed, args.min_cust_count,
+            args.loc_range, args.dem_range]
+    if args.problem_type != "vrp":
+        gen_params.extend( [args.horizon, args.dur_range, args.tw_ratio, args.tw_range] )
+    if args.problem_type == "sdvrptw":
+        gen_params.extend( [args.deg_of_dyna, args.appear_early_ratio] )
+    env_params = [args.pending_cost]
+    if args.problem_type != "vrp":
+        env_params.append(args.late_cost)
+        if args.problem_type != "vrptw":
+            env_params.extend( [args.speed_var, args.late_prob, args.slow_down, args.late_var] )
+
+    data = Dataset.generate(batch_size, *gen_params)
+    data.normalize()
+    learner = AttentionLearner(Dataset.CUST_FEAT_SIZE, Environment.VEH_STATE_SIZE, args.model_size,
+            args.layer_count, args.head_count, args.ff_size, args.tanh_xplor, cand_count = args.cand_count,
+            enc_nbr_count = args.enc_nbr_count, ckpt_encoder = args.ckpt_encoder, ckpt_segment = args.ckpt_segment,
+            autocast_dtype = {"fp32": None, "bf16": torch.bfloat16}[args.precision])
+    return data, Environment, env_params, learner
+
+
+def probe(args, mode, batch_size, iters):
+    r"""
+    :return: Peak RSS of this process in MB and throughput in instances per second,
+            excluding the first iteration which allocates most buffers
+    """
+    torch.manual_seed(0)
+    data, Environment, env_params, learner = _build(args, batch_size)
+    dyna = Environment(data, None, None, *env_params)
+    if mode == "train":
+        if args.baseline_type == "critic":
+            baseline = CriticBaseline(learner, args.customers_count, args.critic_use_qval, args.loss_use_cumul)
+        elif args.baseline_type == "nearnb":
+            baseline = NearestNeighbourBaseline(learner, args.loss_use_cumul)
+        elif args.baseline_type == "rollout" and not args.rollout_per_epoch:
+            baseline = RolloutBaseline(learner, args.rollout_count, args.rollout_threshold)
+        else: # Per-epoch rollout baseline values are precomputed out of the training loop
+            baseline = NoBaseline(learner)
+        optim = Adam(list(learner.parameters()) + list(baseline.parameters()), args.learning_rate)
+        learner.train()
+    else:
+        learner.eval()
+
+    for it in range(iters + 1):
+        if it == 1:
+            start = time.perf_counter()
+        if mode == "train":
+            actions, logps, rewards, bl_vals = baseline(dyna)
+            loss = reinforce_loss(logps, rewards, bl_vals)
+            optim.zero_grad()
+            loss.backward()
+            optim.step()
+        else:
+            with torch.no_grad():
+                learner(dyna)
+    elapsed = time.perf_counter() - start
+    # ru_maxrss is in kB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2**10, iters * batch_size / elapsed
+
+
+def _run_probe(mode, batch_size, probe_iters, train_argv):
+    cmd = [sys.executable, __file__, "--probe", mode, str(batch_size), "--probe-iters", str(probe_iters)] \
+            + train_argv
+    try:
+        proc = subprocess.run(cmd, capture_output = True, text = True, timeout = PROBE_TIMEOUT)
+    except subprocess.TimeoutExpired:
+        return None
+    if proc.returncode != 0: # Most likely killed for running out of memory
+        return None
+    return json.loads(proc.stdout.splitlines()[-1])
+
+
+def _dataset_mb(args, size):
+    r"""
+    :return: Memory in MB held by a dataset of ``size`` instances, which train.py keeps alongside the probed minibatch
+    """
+    feat_size = {"vrp": VRP_Dataset, "sdvrptw": SDVRPTW_Dataset}.get(args.problem_type, VRPTW_Dataset).CUST_FEAT_SIZE
+    return size * (args.customers_count + 1) * (4 * feat_size + 1) / 2**20
+
+
+def main():
+    plan_args, train_argv = parse_planner_args()
+    args = parse_args(train_argv)
+
+    if plan_args.probe is not None:
+        mode, batch_size = plan_args.probe
+        peak_mb, inst_s = probe(args, mode, int(batch_size), plan_args.probe_iters)
+        print(json.dumps({"peak_mb": peak_mb, "inst_s": inst_s}))
+        return
+
+    budget = _available_mb() if plan_args.memory_budget is None else plan_args.memory_budget
+    limit = plan_args.headroom * budget
+    print("Memory budget {:.0f} MB, probes may use up to {:.0f} MB".format(budget, limit))
+
+    chosen = {}
+    best = None
+    for batch_size in sorted(plan_args.candidates):
+        res = _run_probe("train", batch_size, plan_args.probe_iters, train_argv)
+        if res is None:
+            print("train batch {: >6d}: failed".format(batch_size))
+            break
+        # Training and test datasets stay in memory for the whole run
+        peak_mb = res["peak_mb"] + _dataset_mb(args, args.iter_count * batch_size) \
+                + _dataset_mb(args, args.test_batch_size)
+        print("train batch {: >6d}: peak {: >8.0f} MB, {: >8.1f} inst/s{}".format(
+            batch_size, peak_mb, res["inst_s"], "" if peak_mb <= limit else " (over budget)"))
+        if peak_mb > limit:
+            break
+        if best is None or res["inst_s"] > best[1]:
+            best = (batch_size, res["inst_s"])
+    if best is None:
+        print("No training batch size among candidates fits the budget, keeping {}".format(args.batch_size))
+    else:
+        chosen["batch_size"] = best[0]
+
+    # The whole test dataset is a single batch, only shrink it when it does not fit
+    train_data_mb = _dataset_mb(args, args.iter_count * chosen.get("batch_size", args.batch_size))
+    batch_size = args.test_batch_size
+    while batch_size > 0:
+        res = _run_probe("test", batch_size, plan_args.probe_iters, train_argv)
+        peak_mb = float('inf') if res is None else res["peak_mb"] + train_data_mb
+        print("test  batch {: >6d}: {}".format(batch_size, "failed" if res is None else
+            "peak {: >8.0f} MB, {: >8.1f} inst/s{}".format(peak_mb, res["inst_s"],
+                "" if peak_mb <= limit else " (over budget)")))
+        if peak_mb <= limit:
+            chosen["test_batch_size"] = batch_size
+            break
+        batch_size //= 2
+    print("Chosen: " + ", ".join("{} = {}".format(k, v) for k, v in chosen.items()))
+
+    fpath = plan_args.write
+    if fpath is None:
+        if args.config_file is not None:
+            fpath = args.config_file
+        elif args.output_dir is not None:
+            fpath = os.path.join(args.output_dir, "args.json")
+    if fpath is None:
+        return
+    if os.path.isfile(fpath):
+        with open(fpath) as f:
+            cfg = json.load(f)
+        cfg.update(chosen)
+        with open(fpath, 'w') as f:
+            json.dump(cfg, f, indent = 4)
+            f.write('\n')
+    else:
+        vars(args).update(chosen)
+        os.makedirs(os.path.dirname(fpath) or '.', exist_ok = True)
+        write_config_file(args, fpath)
+    print("Written to '{}'".format(fpath))
+
+
+if __name__ == "__main__":
+    main()
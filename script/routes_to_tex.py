@@ -1,7 +1,7 @@
 from marpdan import AttentionLearner
 from marpdan.problems import VRPTW_Dataset, VRPTW_Environment
 from marpdan.externals import ort_solve
-from marpdan.utils import eval_apriori_routes, load_old_weights
+from marpdan.utils import eval_apriori_routes, load_old_weights, PackedRoutes
 
 from itertools import cycle, tee
 import torch
@@ -68,9 +68,7 @@ ort_cost = eval_apriori_routes(env, [ort_routes], 1)[0]
 print("   ORT COST =", ort_cost.item())
 
 actions, _, rewards = learner(env)
-routes = [[] for _ in range(M)]
-for i,j in actions:
-    routes[i.item()].append(j.item())
+routes = PackedRoutes.from_actions(actions, 1, M)[0]
 print("MARDAM COST =", -torch.stack(rewards).sum(0).item())
 
 with open("ortools_routes_n{}.tex".format(N), 'w') as f:
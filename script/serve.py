@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+
+from marpdan import AttentionLearner, MicroBatchServer
+from marpdan.problems import *
+from marpdan.utils import parse_args as parse_train_args
+
+import torch
+
+from argparse import ArgumentParser
+import asyncio
+import os
+
+HOST = "127.0.0.1"
+PORT = 8765
+MAX_BATCH = 256
+MAX_WAIT_MS = 5.0
+REPORT_PERIOD = 10.0
+
+PROBLEMS = {
+        "vrp": (VRP_Dataset, VRP_Environment),
+        "vrptw": (VRPTW_Dataset, VRPTW_Environment),
+        "svrptw": (VRPTW_Dataset, SVRPTW_Environment),
+        "sdvrptw": (SDVRPTW_Dataset, SDVRPTW_Environment),
+        "arp": (ARP_Dataset, ARP_Environment)
+        }
+
+
+def parse_args():
+    parser = ArgumentParser(description = "Serve dispatch decisions of a trained model, "
+            + "coalescing concurrent requests into micro-batches")
+    parser.add_argument("model_dir", type = str,
+            help = "Output dir of a training run, containing args.json and checkpoints")
+    parser.add_argument("--checkpoint", type = str, default = None,
+            help = "Checkpoint to load, defaults to the one of the highest epoch in the model dir")
+    parser.add_argument("--host", type = str, default = HOST)
+    parser.add_argument("--port", type = int, default = PORT)
+    parser.add_argument("--max-batch", type = int, default = MAX_BATCH)
+    parser.add_argument("--max-wait-ms", type = float, default = MAX_WAIT_MS,
+            help = "Latency window during which requests are coalesced into the same micro-batch")
+    parser.add_argument("--report-period", type = float, default = REPORT_PERIOD)
+    parser.add_argument("--sample", action = "store_true", default = False,
+            help = "Sample decisions from the policy instead of picking the most likely node")
+    parser.add_argument("--no-cuda", action = "store_true", default = False)
+    return parser.parse_args()
+
+
+def _latest_checkpoint(model_dir):
+    chkpts = [fname for fname in os.listdir(model_dir) if fname.startswith("chkpt_ep") and fname.endswith(".pyth")]
+    if not chkpts:
+        return None
+    return os.path.join(model_dir, max(chkpts, key = lambda fname: int(fname[8:-5])))
+
+
+def main(args):
+    dev = torch.device("cuda" if torch.cuda.is_available() and not args.no_cuda else "cpu")
+    train_args = parse_train_args(["-f", os.path.join(args.model_dir, "args.json")])
+    Dataset, Environment = PROBLEMS[train_args.problem_type]
+
+    learner = AttentionLearner(Dataset.CUST_FEAT_SIZE, Environment.VEH_STATE_SIZE, train_args.model_size,
+            train_args.layer_count, train_args.head_count, train_args.ff_size, train_args.tanh_xplor,
+            greedy = not args.sample, cand_count = train_args.cand_count, enc_nbr_count = train_args.enc_nbr_count,
+            autocast_dtype = {"fp32": None, "bf16": torch.bfloat16}[train_args.precision])
+    chkpt_fpath = _latest_checkpoint(args.model_dir) if args.checkpoint is None else args.checkpoint
+    if chkpt_fpath is None:
+        print("Warning! No checkpoint found in '{}', serving an untrained model.".format(args.model_dir))
+    else:
+        learner.load_state_dict(torch.load(chkpt_fpath, map_location = "cpu")["model"])
+        print("Loaded '{}'".format(chkpt_fpath))
+    learner.to(dev)
+    learner.eval()
+
+    server = MicroBatchServer(learner, Dataset.CUST_FEAT_SIZE, Environment.VEH_STATE_SIZE, dev,
+            args.max_batch, 1e-3 * args.max_wait_ms, info = {
+                "problem_type": train_args.problem_type,
+                "customers_count": train_args.customers_count,
+                "vehicles_count": train_args.vehicles_count
+                })
+    print("Serving on {}:{}".format(args.host, args.port), flush = True)
+    try:
+        asyncio.run(server.serve(args.host, args.port, args.report_period))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main(parse_args())
@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+
+from argparse import ArgumentParser
+import subprocess
+import signal
+import shlex
+import json
+import time
+import re
+import os
+import sys
+
+THREADS_PER_JOB = 4
+MAX_RETRIES = 2
+POLL_PERIOD = 2.0
+STATUS_FILE = "sweep_status.json"
+OUTPUT_ROOT = "./output/sweep"
+
+
+def parse_args():
+    parser = ArgumentParser(description = "Run the training jobs of a launch plan (e.g. cfgs/launch_all.sh written by "
+            + "cfgs/gen_cfgs.py) concurrently, each pinned to its own CPU cores, and requeue failed or interrupted "
+            + "jobs from their latest checkpoint. Running it again with the same status file continues the sweep.")
+    parser.add_argument("plan", type = str,
+            help = "Shell script with one train.py command per line, relative to the working directory")
+    parser.add_argument("--threads-per-job", "-t", type = int, default = THREADS_PER_JOB)
+    parser.add_argument("--max-jobs", "-j", type = int, default = None,
+            help = "Maximum number of concurrent jobs, defaults to as many as available cores allow")
+    parser.add_argument("--memory-cap", type = float, default = None,
+            help = "Resident memory in MB above which a job is killed and counted as failed")
+    parser.add_argument("--max-retries", type = int, default = MAX_RETRIES)
+    parser.add_argument("--output-root", type = str, default = OUTPUT_ROOT,
+            help = "Parent of the output dirs of jobs whose config does not set one")
+    parser.add_argument("--status-file", type = str, default = STATUS_FILE)
+    parser.add_argument("--poll-period", type = float, default = POLL_PERIOD)
+    return parser.parse_args()
+
+
+class Job:
+    def __init__(self, name, script, argv, output_dir):
+        self.name = name
+        self.script = script
+        self.argv = argv
+        self.output_dir = output_dir
+        self.state = "pending"
+        self.attempts = 0
+        self.proc = None
+        self.cores = None
+        self.start = None
+        self.elapsed = 0.0
+        self.reason = None
+
+    def latest_checkpoint(self):
+        r"""
+        :return: Path to the checkpoint of the highest epoch in the output dir of the job, or None if there is none
+        """
+        if not os.path.isdir(self.output_dir):
+            return None
+        chkpts = [(int(match.group(1)), fname) for match, fname in
+                ((re.fullmatch(r"chkpt_ep(\d+)\.pyth", fname), fname) for fname in os.listdir(self.output_dir))
+                if match]
+        if not chkpts:
+            return None
+        return os.path.join(self.output_dir, max(chkpts)[1])
+
+    def command(self, threads):
+        cmd = [sys.executable, self.script] + self.argv + ["-o", self.output_dir, "--threads-per-worker", str(threads)]
+        chkpt = self.latest_checkpoint()
+        if chkpt is not None:
+            cmd += ["--resume-state", chkpt]
+        return cmd
+
+    def to_dict(self):
+        chkpt = self.latest_checkpoint()
+        return {
+                "name": self.name,
+                "state": self.state,
+                "attempts": self.attempts,
+                "checkpoint": None if chkpt is None else os.path.basename(chkpt),
+                "elapsed": self.elapsed + (0.0 if self.start is None else time.time() - self.start),
+                "reason": self.reason
+                }
+
+
+def read_plan(plan_path, output_root):
+    r"""
+    :return: List of :class:`Job` for every ``train.py`` command of the plan, output dirs are taken from their config
+            file (``-f``) if it sets one, otherwise named after it under ``output_root``
+    """
+    jobs = []
+    with open(plan_path) as f:
+        for line in f:
+            cmd = shlex.split(line, comments = True)
+            scripts = [k for k, tok in enumerate(cmd) if tok.endswith("train.py")]
+            if not scripts:
+                continue
+            script, argv = cmd[scripts[0]], cmd[scripts[0]+1:]
+            name = "job{}".format(len(jobs))
+            output_dir = None
+            for flag in ("-f", "--config-file"):
+                if flag in argv:
+                    cfg_fpath = argv[argv.index(flag) + 1]
+                    name = os.path.splitext(os.path.basename(cfg_fpath))[0]
+                    with open(cfg_fpath) as cfg_f:
+                        output_dir = json.load(cfg_f).get("output_dir")
+            for flag in ("-o", "--output-dir"):
+                if flag in argv:
+                    k = argv.index(flag)
+                    output_dir = argv[k+1]
+                    argv = argv[:k] + argv[k+2:]
+            jobs.append( Job(name, script, argv, output_dir or os.path.join(output_root, name)) )
+    return jobs
+
+
+def _rss_mb(pid):
+    try:
+        with open("/proc/{}/status".format(pid)) as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 2**10
+    except OSError:
+        pass
+    return 0.0
+
+
+def _tree_rss_mb(pid):
+    r"""
+    :return: Resident memory of process ``pid`` and its children (e.g. data-parallel workers or actors) in MB
+    """
+    total = _rss_mb(pid)
+    try:
+        with open("/proc/{}/task/{}/children".format(pid, pid)) as f:
+            children = [int(child) for child in f.read().split()]
+    except OSError:
+        children = []
+    return total + sum(_tree_rss_mb(child) for child in children)
+
+
+class Scheduler:
+    def __init__(self, jobs, threads_per_job, max_jobs = None, memory_cap = None, max_retries = MAX_RETRIES,
+            status_file = STATUS_FILE):
+        self.jobs = jobs
+        self.threads = threads_per_job
+        cores = sorted(os.sched_getaffinity(0))
+        # Disjoint core sets, so that concurrent jobs do not compete for the same cores
+        self.free_cores = [cores[k:k+threads_per_job] for k in range(0, len(cores) - threads_per_job + 1,
+            threads_per_job)] or [cores]
+        if max_jobs is not None:
+            self.free_cores = self.free_cores[:max_jobs]
+        self.memory_cap = memory_cap
+        self.max_retries = max_retries
+        self.status_file = status_file
+        self.stopping = False
+
+    def load_status(self):
+        if not os.path.isfile(self.status_file):
+            return
+        with open(self.status_file) as f:
+            prev = {job["name"]: job for job in json.load(f)}
+        for job in self.jobs:
+            if job.name in prev:
+                job.attempts = prev[job.name]["attempts"]
+                job.elapsed = prev[job.name]["elapsed"]
+                if prev[job.name]["state"] == "done":
+                    job.state = "done"
+
+    def write_status(self):
+        tmp_fpath = self.status_file + ".tmp"
+        with open(tmp_fpath, 'w') as f:
+            json.dump([job.to_dict() for job in self.jobs], f, indent = 4)
+        os.replace(tmp_fpath, self.status_file)
+
+    def print_status(self):
+        counts = {}
+        for job in self.jobs:
+            counts[job.state] = counts.get(job.state, 0) + 1
+        print("{} {}".format(time.strftime("%H:%M:%S"), ", ".join("{} {}".format(n, state)
+            for state, n in sorted(counts.items()))))
+        for job in self.jobs:
+            if job.state == "running":
+                info = job.to_dict()
+                print("    {: <28} attempt {} {: >8.0f}s {}".format(job.name, job.attempts, info["elapsed"],
+                    info["checkpoint"] or "-"))
+
+    def _launch(self, job):
+        job.cores = self.free_cores.pop(0)
+        job.attempts += 1
+        job.state = "running"
+        job.reason = None
+        env = dict(os.environ, OMP_NUM_THREADS = str(len(job.cores)), MKL_NUM_THREADS = str(len(job.cores)),
+                MPLBACKEND = "Agg")
+        os.makedirs(job.output_dir, exist_ok = True)
+        log = open(os.path.join(job.output_dir, "sweep.log"), 'a')
+        cores = job.cores
+        # Own session, so that an interrupt of the scheduler reaches jobs only through stop()
+        job.proc = subprocess.Popen(job.command(len(cores)), stdout = log, stderr = subprocess.STDOUT, env = env,
+                start_new_session = True, preexec_fn = lambda: os.sched_setaffinity(0, cores))
+        log.close()
+        job.start = time.time()
+
+    def _finish(self, job, state, reason = None):
+        job.elapsed += time.time() - job.start
+        job.start = None
+        job.proc = None
+        self.free_cores.append(job.cores)
+        job.cores = None
+        job.reason = reason
+        if state == "failed" and job.attempts <= self.max_retries and not self.stopping:
+            state = "pending" # Requeued, resumes from its latest checkpoint
+        job.state = state
+
+    def _poll(self):
+        for job in self.jobs:
+            if job.state != "running":
+                continue
+            ret = job.proc.poll()
+            if ret is None:
+                if self.memory_cap is not None and _tree_rss_mb(job.proc.pid) > self.memory_cap:
+                    os.killpg(job.proc.pid, signal.SIGKILL)
+                    job.proc.wait()
+                    self._finish(job, "failed", "memory cap")
+            elif self.stopping:
+                self._finish(job, "interrupted")
+            elif ret == 0:
+                self._finish(job, "done")
+            else:
+                self._finish(job, "failed", "exit code {}".format(ret))
+
+    def stop(self):
+        r"""
+        Interrupt running jobs, which save a checkpoint on KeyboardInterrupt, and wait for them.
+        """
+        self.stopping = True
+        for job in self.jobs:
+            if job.state == "running":
+                os.killpg(job.proc.pid, signal.SIGINT)
+        for job in self.jobs:
+            if job.state == "running":
+                job.proc.wait()
+        self._poll()
+
+    def run(self, poll_period = POLL_PERIOD):
+        self.load_status()
+        last_print = 0
+        try:
+            while True:
+                self._poll()
+                for job in self.jobs:
+                    if job.state == "pending" and self.free_cores:
+                        self._launch(job)
+                self.write_status()
+                if all(job.state in ("done", "failed") for job in self.jobs):
+                    break
+                if time.time() - last_print > 30 * poll_period:
+                    self.print_status()
+                    last_print = time.time()
+                time.sleep(poll_period)
+        except KeyboardInterrupt:
+            print("Interrupting running jobs...")
+            self.stop()
+            self.write_status()
+        self.print_status()
+        for job in self.jobs:
+            if job.state == "failed":
+                print("FAILED {} after {} attempts ({}), see '{}'".format(job.name, job.attempts, job.reason,
+                    os.path.join(job.output_dir, "sweep.log")))
+        return all(job.state == "done" for job in self.jobs)
+
+
+def main(args):
+    jobs = read_plan(args.plan, args.output_root)
+    sched = Scheduler(jobs, args.threads_per_job, args.max_jobs, args.memory_cap, args.max_retries, args.status_file)
+    print("{} jobs, up to {} at a time with {} threads each".format(len(jobs), len(sched.free_cores),
+        len(sched.free_cores[0])))
+    if not sched.run(args.poll_period):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main(parse_args())
@@ -6,9 +6,11 @@ from marpdan.baselines import *
 from marpdan.externals import *
 from marpdan.dep import *
 from marpdan.utils import *
-from marpdan.layers import reinforce_loss
+from marpdan.layers import reinforce_loss, importance_weights
 
 import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
 from torch.utils.data import DataLoader
 from torch.optim import Adam
 from torch.optim.lr_scheduler import LambdaLR
@@ -17,49 +19,125 @@ from torch.nn.utils import clip_grad_norm_
 import time
 import os
 from itertools import chain
+from functools import partial
 
 
-def train_epoch(args, data, Environment, env_params, bl_wrapped_learner, optim, device, ep):
+def train_epoch(args, data, Environment, env_params, bl_wrapped_learner, optim, device, ep, profiler):
+    ep_data = bl_wrapped_learner.epoch_data(data, Environment, env_params, device)
     bl_wrapped_learner.learner.train()
-    loader = DataLoader(data, args.batch_size, True)
-
-    ep_loss = 0
-    ep_prob = 0
-    ep_val = 0
-    ep_bl = 0
-    ep_norm = 0
-    with tqdm(loader, desc = "Ep.#{: >3d}/{: <3d}".format(ep+1, args.epoch_count)) as progress:
+    # All ranks iterate over the same minibatches, each one taking its own shard of them
+    gen = torch.Generator().manual_seed(args.rng_seed + ep) if is_distributed() else None
+    if args.bucket_batches:
+        loader = DataLoader(ep_data, batch_sampler = BucketBatchSampler(ep_data.nodes_counts(), args.batch_size, True,
+            generator = gen), collate_fn = ep_data.collate)
+    else:
+        loader = DataLoader(ep_data, args.batch_size, True, generator = gen)
+
+    metrics = MetricsAccumulator(5, device)
+    rank, world_size = get_rank(), get_world_size()
+    with tqdm(loader, desc = "Ep.#{: >3d}/{: <3d}".format(ep+1, args.epoch_count), disable = rank > 0) as progress:
         for minibatch in progress:
-            if data.cust_mask is None:
-                custs, mask = minibatch.to(device), None
-            else:
-                custs, mask = minibatch[0].to(device), minibatch[1].to(device)
+            bl_vals = None
+            if ep_data is not data:
+                minibatch, bl_vals = minibatch
+            custs, mask = (minibatch, None) if data.cust_mask is None else minibatch
+            if custs.size(0) < world_size:
+                # Too small to give a shard to every rank, all ranks skip it together
+                continue
+            custs = custs[rank::world_size].to(device)
+            if mask is not None:
+                mask = mask[rank::world_size].to(device)
+            if bl_vals is not None:
+                bl_vals = bl_vals[rank::world_size].to(device)
 
             dyna = Environment(data, custs, mask, *env_params)
-            actions, logps, rewards, bl_vals = bl_wrapped_learner(dyna)
-            loss = reinforce_loss(logps, rewards, bl_vals)
+            actions, logps, rewards, bl_vals = bl_wrapped_learner(dyna, bl_vals)
+            with profiler.phase("loss"):
+                loss = reinforce_loss(logps, rewards, bl_vals)
 
             prob = torch.stack(logps).sum(0).exp().mean()
-            val = torch.stack(rewards).sum(0).mean()
-            bl = bl_vals[0].mean()
+            if isinstance(rewards, torch.Tensor):
+                val = rewards.mean()
+                bl = bl_vals.mean()
+            else:
+                val = torch.stack(rewards).sum(0).mean()
+                bl = bl_vals[0].mean()
 
             optim.zero_grad()
-            loss.backward()
+            with profiler.phase("backward"):
+                loss.backward()
+            all_reduce_grads(chain.from_iterable(grp["params"] for grp in optim.param_groups))
             if args.max_grad_norm is not None:
                 grad_norm = clip_grad_norm_(chain.from_iterable(grp["params"] for grp in optim.param_groups),
                         args.max_grad_norm)
-            optim.step()
+            with profiler.phase("optim_step"):
+                optim.step()
+
+            metrics.add(loss, prob, val, bl, grad_norm, instances = custs.size(0), steps = len(logps) * custs.size(0))
+            if metrics.window_count == args.log_period:
+                progress.set_postfix_str("l={:.4g} p={:9.4g} val={:6.4g} bl={:6.4g} |g|={:.4g} "
+                        "inst/s={:.0f} steps/s={:.0f}".format(*metrics.flush()))
+
+    average_buffers(bl_wrapped_learner.learner)
+    stats = all_reduce_mean(metrics.means())
+    # Throughputs of all ranks add up
+    return stats[:5] + tuple(rate * world_size for rate in stats[5:])
+
+
+def train_epoch_actors(args, data, Environment, env_params, bl_wrapped_learner, optim, device, ep, profiler,
+        make_learner):
+    ep_data = bl_wrapped_learner.epoch_data(data, Environment, env_params, device)
+    learner = bl_wrapped_learner.learner
+    learner.train()
+    # Only the critic is evaluated along replayed trajectories, other baselines are precomputed or absent
+    critic = bl_wrapped_learner if isinstance(bl_wrapped_learner, CriticBaseline) else None
+
+    metrics = MetricsAccumulator(5, device)
+    with ActorPool(make_learner, learner, data, ep_data, Environment, env_params, args.batch_size,
+            args.actor_count, args.max_policy_lag, args.actor_queue_size, args.bucket_batches,
+            None if args.rng_seed is None else args.rng_seed + ep * args.actor_count) as actors, \
+            tqdm(range(args.iter_count), desc = "Ep.#{: >3d}/{: <3d}".format(ep+1, args.epoch_count)) as progress:
+        for it in progress:
+            traj, lag = actors.get()
+            traj = traj.to(device)
+            logps, bl_vals = replay_trajectory(learner, traj, critic)
+            if critic is None:
+                bl_vals = traj.bl_vals
+            if bl_wrapped_learner.use_cumul:
+                rewards = traj.rewards.sum(dim = 0)
+            else:
+                rewards = list(traj.rewards.unbind(0))
+            weights = importance_weights(logps, traj.logps.unbind(0), args.is_clip)
+            with profiler.phase("loss"):
+                loss = reinforce_loss(logps, rewards, bl_vals, weights)
+
+            prob = torch.stack(logps).sum(0).exp().mean()
+            val = traj.rewards.sum(0).mean()
+            if bl_vals is None:
+                bl = torch.zeros_like(val)
+            elif isinstance(bl_vals, torch.Tensor):
+                bl = bl_vals.mean()
+            else:
+                bl = bl_vals[0].mean()
 
-            progress.set_postfix_str("l={:.4g} p={:9.4g} val={:6.4g} bl={:6.4g} |g|={:.4g}".format(
-                loss, prob, val, bl, grad_norm))
+            optim.zero_grad()
+            with profiler.phase("backward"):
+                loss.backward()
+            if args.max_grad_norm is not None:
+                grad_norm = clip_grad_norm_(chain.from_iterable(grp["params"] for grp in optim.param_groups),
+                        args.max_grad_norm)
+            with profiler.phase("optim_step"):
+                optim.step()
+            if (it+1) % args.actor_sync_period == 0:
+                actors.publish(learner)
 
-            ep_loss += loss.item()
-            ep_prob += prob.item()
-            ep_val += val.item()
-            ep_bl += bl.item()
-            ep_norm += grad_norm
+            metrics.add(loss, prob, val, bl, grad_norm, instances = traj.nodes.size(0),
+                    steps = len(traj) * traj.nodes.size(0))
+            if metrics.window_count == args.log_period:
+                progress.set_postfix_str("l={:.4g} p={:9.4g} val={:6.4g} bl={:6.4g} |g|={:.4g} "
+                        "inst/s={:.0f} steps/s={:.0f} lag={} drop={}".format(*metrics.flush(), lag, actors.dropped))
 
-    return tuple(stat / args.iter_count for stat in (ep_loss, ep_prob, ep_val, ep_bl, ep_norm))
+    return metrics.means()
 
 
 def test_epoch(args, test_env, learner, ref_costs):
@@ -83,10 +161,23 @@ def test_epoch(args, test_env, learner, ref_costs):
 
 def main(args):
     dev = torch.device("cuda" if torch.cuda.is_available() and not args.no_cuda else "cpu")
+    rank = get_rank()
+    if is_distributed():
+        # Same seed on all ranks, to generate the same data and initialize the same model
+        args.rng_seed = broadcast_object(int(torch.randint(2**31, (1,))) if args.rng_seed is None else args.rng_seed)
+        if args.baseline_type == "rollout" and not args.rollout_per_epoch:
+            raise ValueError("Data-parallel training with the rollout baseline requires --rollout-per-epoch, "
+                    "so that all ranks update the same policy")
+    if args.actor_count > 0:
+        if is_distributed():
+            raise ValueError("Actor-learner training cannot be combined with data-parallel training")
+        if args.baseline_type == "nearnb" or (args.baseline_type == "rollout" and not args.rollout_per_epoch):
+            raise ValueError("Actor-learner training requires a baseline which can be evaluated on replayed "
+                    "trajectories: 'none', 'critic' or 'rollout' with --rollout-per-epoch")
     if args.rng_seed is not None:
         torch.manual_seed(args.rng_seed)
 
-    if args.verbose:
+    if args.verbose and rank == 0:
         verbose_print = print
     else:
         def verbose_print(*args, **kwargs): pass
@@ -112,35 +203,54 @@ def main(args):
     if args.problem_type == "sdvrptw":
         gen_params.extend( [args.deg_of_dyna, args.appear_early_ratio] )
 
+    # DATA CACHE OF RESUMED RUN
+    data_cache = None
+    if args.resume_state is not None:
+        cache_fpath = os.path.join(os.path.dirname(args.resume_state), "data.pyth")
+        if os.path.isfile(cache_fpath):
+            verbose_print("Loading data of resumed run from '{}'...".format(cache_fpath),
+                end = " ", flush = True)
+            data_cache = torch.load(cache_fpath, weights_only = False)
+            verbose_print("Done.")
+
     # TRAIN DATA
-    verbose_print("Generating {} {} samples of training data...".format(
-        args.iter_count * args.batch_size, args.problem_type.upper()),
-        end = " ", flush = True)
-    train_data = Dataset.generate(
-            args.iter_count * args.batch_size,
-            *gen_params
-            )
-    train_data.normalize()
-    verbose_print("Done.")
+    if data_cache is None:
+        verbose_print("Generating {} {} samples of training data...".format(
+            args.iter_count * args.batch_size, args.problem_type.upper()),
+            end = " ", flush = True)
+        train_data = Dataset.generate(
+                args.iter_count * args.batch_size,
+                *gen_params
+                )
+        train_data.normalize()
+        verbose_print("Done.")
+    else:
+        train_data = data_cache["train_data"]
 
     # TEST DATA AND COST REFERENCE
-    verbose_print("Generating {} {} samples of test data...".format(
-        args.test_batch_size, args.problem_type.upper()),
-        end = " ", flush = True)
-    test_data = Dataset.generate(
-            args.test_batch_size,
-            *gen_params
-            )
-    verbose_print("Done.")
-
-    if ORTOOLS_ENABLED:
-        ref_routes = ort_solve(test_data)
-    elif LKH_ENABLED:
-        ref_routes = lkh_solve(test_data)
+    if data_cache is None:
+        verbose_print("Generating {} {} samples of test data...".format(
+            args.test_batch_size, args.problem_type.upper()),
+            end = " ", flush = True)
+        test_data = Dataset.generate(
+                args.test_batch_size,
+                *gen_params
+                )
+        verbose_print("Done.")
+
+        if rank > 0: # Only first rank tests the model
+            ref_routes = None
+        elif ORTOOLS_ENABLED:
+            ref_routes = ort_solve(test_data)
+        elif LKH_ENABLED:
+            ref_routes = lkh_solve(test_data)
+        else:
+            ref_routes = None
+            print("Warning! No external solver found to compute gaps for test.")
+        test_data.normalize()
     else:
+        test_data = data_cache["test_data"]
         ref_routes = None
-        print("Warning! No external solver found to compute gaps for test.")
-    test_data.normalize()
 
     # ENVIRONMENT
     Environment = {
@@ -158,6 +268,11 @@ def main(args):
 
     if ref_routes is not None:
         ref_costs = eval_apriori_routes(test_env, ref_routes, 100 if args.problem_type[0] == 's' else 1)
+    elif data_cache is not None and rank == 0:
+        ref_costs = data_cache["ref_costs"]
+    else:
+        ref_costs = None
+    if ref_costs is not None:
         print("Reference cost on test dataset {:5.2f} +- {:5.2f}".format(ref_costs.mean(), ref_costs.std()))
     test_env.nodes = test_env.nodes.to(dev)
     if test_env.init_cust_mask is not None:
@@ -166,15 +281,21 @@ def main(args):
     # MODEL
     verbose_print("Initializing attention model...",
         end = " ", flush = True)
-    learner = AttentionLearner(
+    make_learner = partial(AttentionLearner,
             Dataset.CUST_FEAT_SIZE,
             Environment.VEH_STATE_SIZE,
             args.model_size,
             args.layer_count,
             args.head_count,
             args.ff_size,
-            args.tanh_xplor
+            args.tanh_xplor,
+            cand_count = args.cand_count,
+            enc_nbr_count = args.enc_nbr_count,
+            ckpt_encoder = args.ckpt_encoder,
+            ckpt_segment = args.ckpt_segment,
+            autocast_dtype = {"fp32": None, "bf16": torch.bfloat16}[args.precision]
             )
+    learner = make_learner()
     learner.to(dev)
     verbose_print("Done.")
 
@@ -188,7 +309,15 @@ def main(args):
         baseline = NearestNeighbourBaseline(learner, args.loss_use_cumul)
     elif args.baseline_type == "rollout":
         args.loss_use_cumul = True
-        baseline = RolloutBaseline(learner, args.rollout_count, args.rollout_threshold)
+        bl_eval_data = None
+        if args.rollout_per_epoch:
+            if data_cache is not None and data_cache.get("bl_eval_data") is not None:
+                bl_eval_data = data_cache["bl_eval_data"]
+            else:
+                bl_eval_data = Dataset.generate(args.rollout_eval_size, *gen_params)
+                bl_eval_data.normalize()
+        baseline = RolloutBaseline(learner, args.rollout_count, args.rollout_threshold,
+                bl_eval_data, args.rollout_batch_size)
     elif args.baseline_type == "critic":
         baseline = CriticBaseline(learner, args.customers_count, args.critic_use_qval, args.loss_use_cumul)
     baseline.to(dev)
@@ -218,29 +347,65 @@ def main(args):
     # CHECKPOINTING
     verbose_print("Creating output dir...",
         end = " ", flush = True)
-    args.output_dir = "./output/c{}_n{}m{}_{}".format(
+    args.output_dir = broadcast_object("./output/c{}_n{}m{}_{}".format(
             args.problem_type,
             args.customers_count,
             args.vehicles_count,
             time.strftime("%y%m%d-%H%M")
-            ) if args.output_dir is None else args.output_dir
-    os.makedirs(args.output_dir, exist_ok = True)
-    write_config_file(args, os.path.join(args.output_dir, "args.json"))
+            ) if args.output_dir is None else args.output_dir)
+    if rank == 0:
+        os.makedirs(args.output_dir, exist_ok = True)
+        write_config_file(args, os.path.join(args.output_dir, "args.json"))
+        data_fpath = os.path.join(args.output_dir, "data.pyth")
+        if not os.path.isfile(data_fpath):
+            # Saved once so that resumed runs need neither to regenerate data nor to solve the test instances again
+            torch.save({
+                "train_data": train_data,
+                "test_data": test_data,
+                "ref_costs": ref_costs,
+                "bl_eval_data": bl_eval_data if args.baseline_type == "rollout" else None
+                }, data_fpath + ".tmp")
+            os.replace(data_fpath + ".tmp", data_fpath)
     verbose_print("'{}' created.".format(args.output_dir))
 
+    if is_distributed():
+        # Different rollouts on every rank, seeded before resuming so that saved RNG states take precedence
+        torch.manual_seed(args.rng_seed + rank)
+
     if args.resume_state is None:
         start_ep = 0
     else:
-        start_ep = load_checkpoint(args, learner, optim, baseline, lr_sched)
+        start_ep = load_checkpoint(args, learner, optim, baseline, lr_sched, env_params)
+        baseline.to(dev)
+
+    profiler = hot_path_profiler(args.profile_sync)
+    extra_cols = ("#INST_S", "#STEPS_S")
+    if args.profile:
+        profiler.enable()
+        extra_cols += tuple("#T_" + key.upper() for key in HOT_PATH_PHASES)
+
+    chkpt_writer = CheckpointWriter(args) if rank == 0 else None
 
     verbose_print("Running...")
     train_stats = []
     test_stats = []
     try:
         for ep in range(start_ep, args.epoch_count):
-            train_stats.append( train_epoch(args, train_data, Environment, env_params, baseline, optim, dev, ep) )
-            if ref_routes is not None:
+            profiler.reset()
+            if args.actor_count > 0:
+                stats = train_epoch_actors(args, train_data, Environment, env_params, baseline, optim,
+                    dev, ep, profiler, make_learner)
+            else:
+                stats = train_epoch(args, train_data, Environment, env_params, baseline, optim, dev, ep, profiler)
+            if args.profile:
+                stats += profiler.totals(HOT_PATH_PHASES)
+            train_stats.append(stats)
+            baseline.epoch_end(Environment, env_params, dev)
+            if ref_costs is not None:
                 test_stats.append( test_epoch(args, test_env, learner, ref_costs) )
+            if args.profile and rank == 0:
+                profiler.export_chrome_trace(os.path.join(args.output_dir, "trace_ep{}.json".format(ep+1)))
+                verbose_print(profiler.summary())
 
             if args.rate_decay is not None:
                 lr_sched.step()
@@ -252,13 +417,34 @@ def main(args):
                 args.max_grad_norm *= args.grad_norm_decay
 
             if (ep+1) % args.checkpoint_period == 0:
-                save_checkpoint(args, ep, learner, optim, baseline, lr_sched)
+                rank_rngs = gather_rng_states()
+                if rank == 0:
+                    chkpt_writer.save(args, ep, learner, optim, baseline, lr_sched, env_params, ep+1, rank_rngs)
 
     except KeyboardInterrupt:
-        save_checkpoint(args, ep, learner, optim, baseline, lr_sched)
+        if rank == 0:
+            chkpt_writer.save(args, ep, learner, optim, baseline, lr_sched, env_params, ep)
+    finally:
+        if rank == 0:
+            chkpt_writer.close()
+            export_train_test_stats(args, start_ep, train_stats, test_stats, extra_cols)
+
+
+def run_worker(rank, args):
+    dist.init_process_group("gloo", init_method = "tcp://127.0.0.1:{}".format(args.dist_port),
+            rank = rank, world_size = args.world_size)
+    torch.set_num_threads(args.threads_per_worker or max(1, os.cpu_count() // args.world_size))
+    try:
+        main(args)
     finally:
-        export_train_test_stats(args, start_ep, train_stats, test_stats)
+        dist.destroy_process_group()
 
 
 if __name__ == "__main__":
-    main(parse_args())
+    args = parse_args()
+    if args.world_size > 1:
+        mp.spawn(run_worker, (args,), nprocs = args.world_size)
+    else:
+        if args.threads_per_worker is not None:
+            torch.set_num_threads(args.threads_per_worker)
+        main(args)
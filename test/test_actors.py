@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+from marpdan import AttentionLearner, ActorPool, collect_trajectory, replay_trajectory
+from marpdan.problems import VRPTW_Dataset, VRPTW_Environment, SDVRPTW_Dataset, SDVRPTW_Environment
+from marpdan.baselines import CriticBaseline
+from marpdan.layers import reinforce_loss, importance_weights
+
+import torch
+import time
+from functools import partial
+
+if __name__ == "__main__":
+    torch.manual_seed(0)
+    for Dataset, Environment in ((VRPTW_Dataset, VRPTW_Environment), (SDVRPTW_Dataset, SDVRPTW_Environment)):
+        data = Dataset.generate(32, 20, 4)
+        data.normalize()
+        learner = AttentionLearner(data.CUST_FEAT_SIZE, Environment.VEH_STATE_SIZE, cand_count = 5)
+        learner.eval()
+        critic = CriticBaseline(learner, 20)
+        traj = collect_trajectory(learner, Environment(data))
+        logps, bl_vals = replay_trajectory(learner, traj, critic)
+        print("{}: replayed {} steps, {} encodings, max logp diff: {:.2e}".format(Dataset.__name__, len(traj),
+            len(traj.encodings), max((a - b).abs().max().item() for a,b in zip(logps, traj.logps))))
+
+    weights = importance_weights(logps, traj.logps.unbind(0))
+    loss = reinforce_loss(logps, list(traj.rewards.unbind(0)), bl_vals, weights)
+    loss.backward()
+    print("Forward and backward passes ok, importance weights all 1:", all(bool((w == 1).all()) for w in weights))
+
+    data = VRPTW_Dataset.generate(4096, 20, 4)
+    data.normalize()
+    make_learner = partial(AttentionLearner, data.CUST_FEAT_SIZE, VRPTW_Environment.VEH_STATE_SIZE)
+    learner = make_learner()
+    with ActorPool(make_learner, learner, data, data, VRPTW_Environment, [], 128, 2, 2) as actors:
+        start = time.perf_counter()
+        lags = []
+        for it in range(8):
+            traj, lag = actors.get()
+            lags.append(lag)
+            actors.publish(learner)
+        elapsed = time.perf_counter() - start
+    print("Received 8 trajectories from 2 actors in {:.2f}s, lags {}, {} dropped".format(elapsed, lags, actors.dropped))
+
+    with ActorPool(make_learner, learner, data, data, VRPTW_Environment, [], 128, 1, 2) as actors:
+        actors.actors[0].terminate()
+        try:
+            actors.get(0.1)
+            print("Dead actor detected: False")
+        except RuntimeError as e:
+            print("Dead actor detected:", e)
@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+from marpdan import AttentionLearner
+from marpdan.problems import VRPTW_Dataset, VRPTW_Environment
+from marpdan.utils import BucketBatchSampler
+
+import torch
+from torch.utils.data import DataLoader
+from torch.utils.flop_counter import FlopCounterMode
+import time
+
+torch.manual_seed(0)
+data = VRPTW_Dataset.generate(256, 50, 5, min_cust_count = 10)
+data.normalize()
+
+learner = AttentionLearner(data.CUST_FEAT_SIZE, VRPTW_Environment.VEH_STATE_SIZE, greedy = True)
+learner.eval()
+
+small = data.nodes_counts().sort()[1][:8]
+nodes, mask = data.collate([data[i] for i in small])
+print("Trimmed minibatch of 8 instances: {} nodes instead of {}".format(nodes.size(1), data.nodes_count))
+with torch.no_grad():
+    _, _, full_rewards = learner(VRPTW_Environment(data, data.nodes[small], data.cust_mask[small]))
+    _, _, trim_rewards = learner(VRPTW_Environment(data, nodes, mask))
+full_cost = torch.stack(full_rewards).sum(0)
+trim_cost = torch.stack(trim_rewards).sum(0)
+print("Same costs after trimming:", torch.allclose(full_cost, trim_cost, atol = 1e-4))
+
+for name, loader in (
+        ("random", DataLoader(data, 32, True)),
+        ("bucketed", DataLoader(data, batch_sampler = BucketBatchSampler(data.nodes_counts(), 32, True),
+            collate_fn = data.collate))):
+    flops = FlopCounterMode(display = False)
+    padded = 0
+    start = time.perf_counter()
+    with torch.no_grad(), flops:
+        for nodes, mask in loader:
+            padded += mask.sum().item()
+            learner(VRPTW_Environment(data, nodes, mask))
+    print("{:>9}: {:6.2f} GFLOP, {:6d} padding nodes, {:.2f}s".format(name, flops.get_total_flops() / 1e9,
+        padded, time.perf_counter() - start))
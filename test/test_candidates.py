@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+from marpdan import AttentionLearner
+from marpdan.problems import VRPTW_Dataset, VRPTW_Environment
+from marpdan.layers import reinforce_loss
+from marpdan.utils import eval_apriori_routes, actions_to_routes
+
+import torch
+import time
+
+torch.manual_seed(0)
+data = VRPTW_Dataset.generate(8, 20, 4)
+data.normalize()
+dyna = VRPTW_Environment(data)
+
+learner = AttentionLearner(data.CUST_FEAT_SIZE, dyna.VEH_STATE_SIZE, greedy = True)
+with torch.no_grad():
+    full_actions, full_logps, _ = learner(dyna)
+    learner.cand_count = data.nodes_count
+    cand_actions, cand_logps, _ = learner(dyna)
+print("All customers as candidates, same actions:",
+        all(bool((a == b).all()) for (_,a),(_,b) in zip(full_actions, cand_actions)),
+        "max logp diff: {:.2e}".format(max((a - b).abs().max().item() for a,b in zip(full_logps, cand_logps))))
+
+learner.greedy = False
+learner.cand_count = 5
+actions, logps, rewards = learner(dyna)
+loss = reinforce_loss(logps, rewards)
+loss.backward()
+print("Forward and backward passes ok with 5 candidates")
+
+data = VRPTW_Dataset.generate(64, 500, 25)
+data.normalize()
+dyna = VRPTW_Environment(data)
+learner.greedy = True
+with torch.no_grad(): # Warm-up, so that the first timed pass is not penalized
+    learner(dyna)
+for cand_count in (None, 10):
+    learner.cand_count = cand_count
+    start = time.perf_counter()
+    with torch.no_grad():
+        actions, _, _ = learner(dyna)
+    elapsed = time.perf_counter() - start
+    costs = eval_apriori_routes(dyna, actions_to_routes(actions, data.batch_size, data.veh_count), 1)
+    print("cand_count = {}: {} steps in {:.3f}s ({:.1f}ms per step), cost {:.3f}".format(cand_count, len(actions),
+        elapsed, 1e3 * elapsed / len(actions), costs.mean()))
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+from marpdan import AttentionLearner
+from marpdan.problems import VRPTW_Dataset, VRPTW_Environment, SDVRPTW_Dataset, SDVRPTW_Environment
+from marpdan.layers import reinforce_loss
+
+import torch
+import resource
+import subprocess
+import sys
+import time
+
+BATCH_SIZE = 256
+CUST_COUNT = 50
+
+def grads(learner, dyna, seed):
+    learner.zero_grad()
+    torch.manual_seed(seed)
+    actions, logps, rewards = learner(dyna)
+    reinforce_loss(logps, rewards).backward()
+    return [p.grad.clone() for p in learner.parameters()]
+
+def train_step(ckpt_encoder, ckpt_segment):
+    torch.manual_seed(0)
+    data = VRPTW_Dataset.generate(BATCH_SIZE, CUST_COUNT, 5)
+    data.normalize()
+    dyna = VRPTW_Environment(data)
+    learner = AttentionLearner(data.CUST_FEAT_SIZE, dyna.VEH_STATE_SIZE,
+            ckpt_encoder = ckpt_encoder, ckpt_segment = ckpt_segment)
+    start = time.perf_counter()
+    grads(learner, dyna, 0)
+    elapsed = time.perf_counter() - start
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print("{} {}".format(elapsed, peak))
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        train_step(sys.argv[1] == "1", None if sys.argv[2] == "0" else int(sys.argv[2]))
+        sys.exit()
+
+    data = VRPTW_Dataset.generate(16, 10, 2)
+    data.normalize()
+    dyna = VRPTW_Environment(data)
+    learner = AttentionLearner(data.CUST_FEAT_SIZE, dyna.VEH_STATE_SIZE)
+    ref = grads(learner, dyna, 1)
+    learner.cust_encoder.checkpoint = True
+    learner.ckpt_segment = 4
+    tracked = [n.item() for k,n in learner.named_buffers() if k.endswith("num_batches_tracked")]
+    ckpt = grads(learner, dyna, 1)
+    print("Same gradients with checkpoints:", all(torch.allclose(a, b, atol = 1e-6) for a,b in zip(ref, ckpt)))
+    print("Batch norm statistics updated once:", [n.item() for k,n in learner.named_buffers()
+        if k.endswith("num_batches_tracked")] == [t + 1 for t in tracked])
+
+    data = SDVRPTW_Dataset.generate(16, 10, 2, 100, min_cust_count = 5)
+    dyna = SDVRPTW_Environment(data)
+    learner = AttentionLearner(dyna.CUST_FEAT_SIZE, dyna.VEH_STATE_SIZE)
+    ref = grads(learner, dyna, 1)
+    learner.ckpt_segment = 4
+    ckpt = grads(learner, dyna, 1)
+    print("Same gradients with checkpoints on SDVRPTW:", all(torch.allclose(a, b, atol = 1e-6) for a,b in zip(ref, ckpt)))
+
+    print("Batch of {} VRPTW with {} customers, one forward and backward pass".format(BATCH_SIZE, CUST_COUNT))
+    print("{:>13} {:>13} {:>10} {:>14}".format("ckpt encoder", "ckpt segment", "time (s)", "peak RSS (MB)"))
+    for ckpt_encoder, ckpt_segment in ((0,0), (1,0), (0,10), (1,10), (1,1)):
+        out = subprocess.run([sys.executable, __file__, str(ckpt_encoder), str(ckpt_segment)],
+                stdout = subprocess.PIPE, universal_newlines = True, check = True).stdout.split()
+        print("{:>13} {:>13} {:>10.2f} {:>14.0f}".format(str(bool(ckpt_encoder)), ckpt_segment or "-", *map(float, out)))
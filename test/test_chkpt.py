@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+from marpdan import AttentionLearner
+from marpdan.utils import CheckpointWriter, load_checkpoint
+
+import torch
+from torch.optim import Adam
+from argparse import Namespace
+import tempfile
+import time
+import os
+
+with tempfile.TemporaryDirectory() as output_dir:
+    args = Namespace(output_dir = output_dir, keep_checkpoints = 2, rate_decay = None, max_grad_norm = 2.0,
+            baseline_type = "none", resume_state = None)
+    learner = AttentionLearner(7, 5, 128, 3, 8, 512)
+    optim = Adam(learner.parameters())
+    env_params = [2, 1]
+
+    writer = CheckpointWriter(args)
+    save_times = []
+    for ep in range(5):
+        start = time.perf_counter()
+        writer.save(args, ep, learner, optim, None, None, env_params, ep+1)
+        save_times.append(time.perf_counter() - start)
+        ref = {k: v.clone() for k, v in learner.state_dict().items()}
+        ref_rng = torch.get_rng_state()
+        # Updating the model in place while the checkpoint is written must not alter it
+        with torch.no_grad():
+            for p in learner.parameters():
+                p.add_(1)
+        env_params[0] *= 1.1
+    writer.close()
+    print("Mean blocking time of save: {:.1f}ms".format(1e3 * sum(save_times) / len(save_times)))
+
+    fnames = sorted(os.listdir(output_dir))
+    print("Kept checkpoints: {}".format(fnames))
+
+    args.resume_state = os.path.join(output_dir, "chkpt_ep5.pyth")
+    args.max_grad_norm = None
+    torch.manual_seed(123)
+    restored_params = [0, 0]
+    next_ep = load_checkpoint(args, learner, optim, None, None, restored_params)
+    print("Next epoch {}, env params {}, max grad norm {}".format(next_ep, restored_params, args.max_grad_norm))
+    print("Same model as when saved: {}".format(all(
+        torch.equal(v, ref[k]) for k, v in learner.state_dict().items())))
+    print("Same RNG state as when saved: {}".format(torch.equal(torch.get_rng_state(), ref_rng)))
@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+from marpdan import AttentionLearner
+from marpdan.problems import VRPTW_Dataset, VRPTW_Environment
+from marpdan.layers import reinforce_loss
+from marpdan.baselines import RolloutBaseline
+from marpdan.utils import all_reduce_grads, average_buffers
+
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+from torch.optim import Adam
+import os
+import time
+
+BATCH_SIZE = 128
+STEPS = 3
+
+def train(rank, world_size):
+    if world_size > 1:
+        dist.init_process_group("gloo", init_method = "tcp://127.0.0.1:29511", rank = rank, world_size = world_size)
+    torch.set_num_threads(max(1, os.cpu_count() // world_size))
+    torch.manual_seed(0)
+    data = VRPTW_Dataset.generate(BATCH_SIZE, 20, 4)
+    data.normalize()
+    learner = AttentionLearner(data.CUST_FEAT_SIZE, VRPTW_Environment.VEH_STATE_SIZE)
+    optim = Adam(learner.parameters(), 1e-4)
+    baseline = RolloutBaseline(learner, 1, 0.5, data, 32)
+    torch.manual_seed(rank)
+
+    start = time.perf_counter()
+    for _ in range(STEPS):
+        dyna = VRPTW_Environment(data, data.nodes[rank::world_size])
+        _, logps, rewards = learner(dyna)
+        loss = reinforce_loss(logps, rewards)
+        optim.zero_grad()
+        loss.backward()
+        all_reduce_grads(learner.parameters())
+        optim.step()
+    average_buffers(learner)
+    elapsed = time.perf_counter() - start
+
+    bl_vals = baseline.epoch_data(data, VRPTW_Environment, [], "cpu").bl_vals
+    baseline.epoch_end(VRPTW_Environment, [], "cpu")
+
+    if world_size > 1:
+        sums = [torch.zeros(2) for _ in range(world_size)]
+        dist.all_gather(sums, torch.stack([sum(p.sum() for p in learner.parameters()),
+            sum(b.float().sum() for b in learner.buffers())]))
+        if rank == 0:
+            print("Same parameters and buffers on all ranks:", all(torch.equal(s, sums[0]) for s in sums))
+        bls = [torch.zeros(2) for _ in range(world_size)]
+        dist.all_gather(bls, torch.stack([bl_vals.sum(), sum(p.sum() for p in baseline.policy.parameters())]))
+        if rank == 0:
+            print("Same rollout baseline values and policy on all ranks:", all(torch.equal(b, bls[0]) for b in bls))
+        dist.destroy_process_group()
+    if rank == 0:
+        print("{} worker(s): {:.2f} minibatches/s".format(world_size, STEPS / elapsed))
+
+if __name__ == "__main__":
+    train(0, 1)
+    mp.spawn(train, (2,), nprocs = 2)
@@ -0,0 +1,38 @@
+#!/usr/bin/env python3
+from marpdan.problems import SDVRPTW_Dataset
+from marpdan.externals import best_insert, best_insert_batched
+
+import torch
+import copy
+import time
+
+torch.manual_seed(0)
+
+data = SDVRPTW_Dataset.generate(64, 20, 4)
+data.normalize()
+
+nodes = data.nodes
+states = nodes.new_zeros((data.batch_size, data.veh_count, 4))
+states[:,:,:2] = torch.rand(data.batch_size, data.veh_count, 2)
+states[:,:,3] = 0.2 * torch.rand(data.batch_size, data.veh_count)
+
+hidden = nodes[:,:,6] > 0
+routes = []
+for known in (hidden ^ True):
+    custs = known[1:].nonzero().squeeze(1).add(1)[torch.randperm(int(known[1:].sum()))].tolist()
+    cuts = sorted(torch.randint(0, len(custs)+1, (data.veh_count-1,)).tolist())
+    inst_routes = [custs[a:b] for a,b in zip([0] + cuts, cuts + [len(custs)])]
+    routes.append([r + [0] if r else [] for r in inst_routes])
+insert_mask = hidden & (torch.rand(hidden.size()) < 0.5)
+
+ref_routes = copy.deepcopy(routes)
+start = time.perf_counter()
+best_insert(nodes, states, ref_routes, insert_mask)
+ref_time = time.perf_counter() - start
+
+start = time.perf_counter()
+best_insert_batched(nodes, states, routes, insert_mask)
+batched_time = time.perf_counter() - start
+
+print("Identical decisions:", routes == ref_routes)
+print("Reference: {:.3f}s, batched: {:.3f}s".format(ref_time, batched_time))
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+from marpdan import AttentionLearner, LiveARP
+from marpdan.problems import ARP_Dataset, ARP_Environment
+
+import torch
+import copy
+import random
+import heapq
+import time
+
+CALL_COUNT = 200
+PATIENTS_ON_SCENE = 50 # Calls already open when the simulation starts
+VEH_COUNT = 10
+
+torch.manual_seed(0)
+random.seed(0)
+learner = AttentionLearner(ARP_Dataset.CUST_FEAT_SIZE, ARP_Environment.VEH_STATE_SIZE, greedy = True)
+learner.eval()
+# Same weights, used to encode the open patients afresh without touching the cached encodings of the engine
+reference = AttentionLearner(ARP_Dataset.CUST_FEAT_SIZE, ARP_Environment.VEH_STATE_SIZE, greedy = True)
+reference.load_state_dict(learner.state_dict())
+reference.eval()
+
+live = LiveARP(learner, (50, 50), VEH_COUNT)
+for _ in range(PATIENTS_ON_SCENE):
+    live.add_call(random.uniform(0, 100), random.uniform(0, 100), random.uniform(60, 240))
+
+# Events: (time, kind, payload) with new calls arriving as a Poisson process and arrivals of ambulances at their ETA
+events = []
+t = 0
+for _ in range(CALL_COUNT - PATIENTS_ON_SCENE):
+    t += random.expovariate(1 / 3)
+    events.append( (t, 0, (random.uniform(0, 100), random.uniform(0, 100), random.uniform(60, 240))) )
+heapq.heapify(events)
+
+cached_times, encode_times = [], []
+picked_up = 0
+consistent = True
+while events:
+    t, kind, payload = heapq.heappop(events)
+    if kind == 0:
+        live.add_call(*payload, time = t)
+    else:
+        picked_up += live.dest[payload] != 0
+        live.complete(payload, time = t)
+    for i in live.idle():
+        encodes = live.encode_count
+        start = time.perf_counter()
+        veh_idx, call_id, eta = live.decide(i)
+        (encode_times if live.encode_count > encodes else cached_times).append(time.perf_counter() - start)
+        if live.dest[veh_idx] is None: # Waiting at the hospital until the next event
+            continue
+        if live.encode_count == encodes and len(cached_times) % 20 == 0:
+            # Same decision as with only the open patients encoded afresh, served and expired ones dropped
+            fresh = copy.copy(live)
+            fresh.learner = reference
+            fresh.dest = list(live.dest)
+            fresh.dest[veh_idx] = None
+            fresh._compact()
+            fresh._encode()
+            consistent &= fresh.decide(veh_idx)[1] == call_id
+        heapq.heappush(events, (eta, 1, veh_idx))
+
+print("{} decisions, {} encodings, {} patients picked up out of {} calls, consistent with re-encoding: {}".format(
+    live.decision_count, live.encode_count, picked_up, CALL_COUNT, consistent))
+print("Mean latency per decision: {:.2f}ms with cached encodings, {:.2f}ms after new calls".format(
+    1e3 * sum(cached_times) / len(cached_times), 1e3 * sum(encode_times) / len(encode_times)))
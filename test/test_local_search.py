@@ -0,0 +1,26 @@
+#!/usr/bin/env python3
+from marpdan import AttentionLearner
+from marpdan.problems import VRP_Dataset, VRP_Environment, VRPTW_Dataset, VRPTW_Environment
+from marpdan.externals import local_search
+from marpdan.utils import actions_to_routes, eval_apriori_routes
+
+import torch
+
+for pbtype, pbenv in [(VRP_Dataset, VRP_Environment), (VRPTW_Dataset, VRPTW_Environment)]:
+    data = pbtype.generate(32, 20, 4)
+    data.normalize()
+    env = pbenv(data)
+
+    learner = AttentionLearner(data.CUST_FEAT_SIZE, env.VEH_STATE_SIZE)
+    learner.greedy = True
+    with torch.no_grad():
+        actions, _, _ = learner(env)
+    routes = actions_to_routes(actions, data.batch_size, data.veh_count)
+    costs = eval_apriori_routes(env, routes, 1)
+
+    ls_routes, trace = local_search(env, routes, max_iter = 20)
+    ls_costs = eval_apriori_routes(env, ls_routes, 1)
+
+    print("{}: cost {:.3f} -> {:.3f} in {} iterations, {:.3f}s".format(
+        pbtype.__name__, costs.mean(), ls_costs.mean(), len(trace) - 1, trace[-1][0]))
+    print("Cost reduction per second: {:.3f}".format((trace[0][1] - trace[-1][1]) / trace[-1][0]))
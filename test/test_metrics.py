@@ -0,0 +1,31 @@
+#!/usr/bin/env python3
+from marpdan.utils import MetricsAccumulator
+
+import torch
+import time
+
+ITER_COUNT = 10000
+
+torch.manual_seed(0)
+values = torch.randn(ITER_COUNT, 5)
+
+metrics = MetricsAccumulator(5)
+start = time.perf_counter()
+for vals in values:
+    metrics.add(*vals.unbind(0), instances = 512, steps = 512 * 30)
+    if metrics.window_count == 10:
+        "l={:.4g} p={:9.4g} val={:6.4g} bl={:6.4g} |g|={:.4g} inst/s={:.0f} steps/s={:.0f}".format(*metrics.flush())
+acc_time = time.perf_counter() - start
+means = metrics.means()
+print("Same means as summing items: {}, {:.0f} instances/s, {:.0f} steps/s".format(
+    torch.allclose(torch.tensor(means[:5], dtype = torch.float64), values.double().mean(0)), *means[5:]))
+
+start = time.perf_counter()
+sums = [0] * 5
+for vals in values:
+    "l={:.4g} p={:9.4g} val={:6.4g} bl={:6.4g} |g|={:.4g}".format(*vals)
+    for k, v in enumerate(vals):
+        sums[k] += v.item()
+item_time = time.perf_counter() - start
+print("Host overhead per iteration: {:.1f}us accumulated, {:.1f}us with items and formatting".format(
+    1e6 * acc_time / ITER_COUNT, 1e6 * item_time / ITER_COUNT))
@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+from marpdan import AttentionLearner
+from marpdan.problems import VRP_Dataset, VRP_Environment, VRPTW_Dataset, VRPTW_Environment
+from marpdan.baselines import NearestNeighbourBaseline
+
+import torch
+import time
+
+def reference_eval_step(bl, dyna):
+    buf = dyna.state_dict()
+    buf = {key: val.clone() for key, val in buf.items()}
+    rewards = []
+    while not dyna.done:
+        veh_pos = dyna.cur_veh[:,:,:2].unsqueeze(2).expand(-1,-1,dyna.nodes_count,-1)
+        cust_pos = dyna.nodes[:,:,:2].unsqueeze(1)
+        sqd = (veh_pos - cust_pos).pow(2).sum(dim = 3)
+        sqd[:,0,0] += 0.5*bl._BIG_FLOAT
+        cust_idx = (sqd + dyna.cur_veh_mask.float() * bl._BIG_FLOAT).argmin(dim = 2)
+        rewards.append(dyna.step(cust_idx))
+    dyna.load_state_dict(buf)
+    dyna.done = False
+    return torch.stack(rewards).sum(dim = 0)
+
+torch.manual_seed(0)
+for pbtype, pbenv in [(VRP_Dataset, VRP_Environment), (VRPTW_Dataset, VRPTW_Environment)]:
+    data = pbtype.generate(128, 50, 5)
+    data.normalize()
+    dyna = pbenv(data)
+    learner = AttentionLearner(data.CUST_FEAT_SIZE, dyna.VEH_STATE_SIZE)
+    bl = NearestNeighbourBaseline(learner)
+
+    with torch.no_grad():
+        learner.greedy = True
+        actions, _, _ = learner(dyna)
+
+    dyna.reset()
+    ref_vals, states = [], []
+    start = time.perf_counter()
+    for _, cust_idx in actions:
+        ref_vals.append( reference_eval_step(bl, dyna) )
+        dyna.step(cust_idx)
+    ref_time = time.perf_counter() - start
+
+    dyna.reset()
+    start = time.perf_counter()
+    for _, cust_idx in actions:
+        states.append( bl.eval_step(dyna, None, None) )
+        dyna.step(cust_idx)
+    bl_vals = bl.eval_trajectory(dyna, states)
+    fork_time = time.perf_counter() - start
+
+    err = max((a - b).abs().max().item() for a,b in zip(ref_vals, bl_vals))
+    print("{}: {} steps, max abs diff {:.2e}, reference {:.3f}s, forked {:.3f}s".format(
+        pbtype.__name__, len(actions), err, ref_time, fork_time))
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+from marpdan import AttentionLearner
+from marpdan.problems import VRPTW_Dataset, VRPTW_Environment
+from marpdan.baselines import CriticBaseline
+from marpdan.layers import reinforce_loss
+
+import torch
+from torch.optim import Adam
+import time
+
+ITER_COUNT = 60
+BATCH_SIZE = 128
+SEED_COUNT = 3
+
+def greedy_cost(learner, dyna):
+    learner.eval()
+    learner.greedy = True
+    with torch.no_grad():
+        _, _, rewards = learner(dyna)
+    learner.train()
+    learner.greedy = False
+    return -torch.stack(rewards).sum(0).mean().item()
+
+
+# Same configuration as the n20m4 ones of cfgs/gen_cfgs.py
+torch.manual_seed(0)
+train_data = VRPTW_Dataset.generate(ITER_COUNT * BATCH_SIZE, 20, 4)
+train_data.normalize()
+test_data = VRPTW_Dataset.generate(256, 20, 4)
+test_data.normalize()
+test_env = VRPTW_Environment(test_data)
+init_state = AttentionLearner(train_data.CUST_FEAT_SIZE, VRPTW_Environment.VEH_STATE_SIZE).state_dict()
+
+for dtype in (None, torch.bfloat16):
+    costs = []
+    elapsed = 0
+    for seed in range(SEED_COUNT):
+        learner = AttentionLearner(train_data.CUST_FEAT_SIZE, VRPTW_Environment.VEH_STATE_SIZE,
+                autocast_dtype = dtype)
+        learner.load_state_dict(init_state)
+        baseline = CriticBaseline(learner, 20)
+        optim = Adam([{"params": learner.parameters(), "lr": 1e-4}, {"params": baseline.parameters(), "lr": 1e-3}])
+        torch.manual_seed(seed)
+        costs.append( [greedy_cost(learner, test_env)] )
+        start = time.perf_counter()
+        for it in range(ITER_COUNT):
+            custs = train_data.nodes[it * BATCH_SIZE:(it+1) * BATCH_SIZE]
+            actions, logps, rewards, bl_vals = baseline(VRPTW_Environment(train_data, custs))
+            loss = reinforce_loss(logps, rewards, bl_vals)
+            optim.zero_grad()
+            loss.backward()
+            optim.step()
+            if (it+1) % 20 == 0:
+                costs[-1].append( greedy_cost(learner, test_env) )
+        elapsed += time.perf_counter() - start
+    costs = torch.tensor(costs)
+    print("{}: {:.2f} minibatches/s, greedy test cost every 20 it. over {} seeds: {}".format(
+        "fp32" if dtype is None else "bf16", SEED_COUNT * ITER_COUNT / elapsed, SEED_COUNT,
+        ' '.join("{:.2f}+-{:.2f}".format(m, s) for m,s in zip(costs.mean(0), costs.std(0)))))
+
+data = VRPTW_Dataset.generate(512, 50, 10)
+data.normalize()
+dyna = VRPTW_Environment(data)
+for dtype in (None, torch.bfloat16):
+    learner = AttentionLearner(data.CUST_FEAT_SIZE, VRPTW_Environment.VEH_STATE_SIZE, autocast_dtype = dtype)
+    learner.eval()
+    start = time.perf_counter()
+    with torch.no_grad():
+        learner(dyna)
+    print("{} inference on 512 x n50m10: {:.2f}s".format("fp32" if dtype is None else "bf16",
+        time.perf_counter() - start))
@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+from marpdan import AttentionLearner
+from marpdan.problems import VRPTW_Dataset, VRPTW_Environment
+from marpdan.baselines import CriticBaseline
+from marpdan.layers import reinforce_loss
+from marpdan.utils import hot_path_profiler, HOT_PATH_PHASES
+
+import torch
+import json
+import time
+
+torch.manual_seed(0)
+data = VRPTW_Dataset.generate(64, 20, 4)
+data.normalize()
+dyna = VRPTW_Environment(data)
+learner = AttentionLearner(data.CUST_FEAT_SIZE, dyna.VEH_STATE_SIZE)
+baseline = CriticBaseline(learner, 20)
+
+def iteration(prof):
+    actions, logps, rewards, bl_vals = baseline(dyna)
+    with prof.phase("loss"):
+        loss = reinforce_loss(logps, rewards, bl_vals)
+    with prof.phase("backward"):
+        loss.backward()
+    return len(actions)
+
+prof = hot_path_profiler()
+step_fn = VRPTW_Environment.step
+for enabled in (False, True, False):
+    if enabled:
+        prof.enable()
+    else:
+        prof.disable()
+    start = time.perf_counter()
+    steps = sum(iteration(prof) for _ in range(5))
+    print("Profiler {}: {:.3f}s per iteration".format("enabled" if enabled else "disabled",
+        (time.perf_counter() - start) / 5))
+    if enabled:
+        print("Steps counted: {} for {} decoded, encodings: {}".format(prof.counts["env_step"], steps,
+            prof.counts["encode"]))
+        print(prof.summary())
+print("Methods restored when disabled:", VRPTW_Environment.step is step_fn)
+
+prof.export_chrome_trace("/tmp/trace.json")
+with open("/tmp/trace.json") as f:
+    events = json.load(f)["traceEvents"]
+print("Trace events: {}, phases: {}".format(len(events), sorted({ev["name"] for ev in events})))
+print("Totals:", ' '.join("{}={:.3f}".format(key, t) for key, t in zip(HOT_PATH_PHASES, prof.totals(HOT_PATH_PHASES))))
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+from marpdan.problems import VRP_Dataset, VRP_Environment, VRPTW_Dataset, RoadNetwork
+from marpdan.baselines import NearestNeighbourBaseline
+from marpdan.externals._ort import _solve_cp
+import marpdan.problems._road as road
+
+import torch
+import time
+
+# Manhattan grid covering all integer locations of generated instances, with unit travel time per edge
+SIDE = 101
+xs, ys = torch.meshgrid(torch.arange(SIDE), torch.arange(SIDE), indexing = "ij")
+coords = torch.stack((xs.reshape(-1), ys.reshape(-1)), dim = 1).float()
+vid = torch.arange(SIDE * SIDE).view(SIDE, SIDE)
+edges = torch.cat((torch.stack((vid[:-1].reshape(-1), vid[1:].reshape(-1)), dim = 1),
+    torch.stack((vid[:,:-1].reshape(-1), vid[:,1:].reshape(-1)), dim = 1)))
+grid = RoadNetwork(coords, edges, torch.ones(edges.size(0)))
+
+torch.manual_seed(0)
+data = VRPTW_Dataset.generate(64, 20, 4)
+start = time.perf_counter()
+tables = grid(data.nodes)
+miss_time = time.perf_counter() - start
+start = time.perf_counter()
+grid(data.nodes)
+hit_time = time.perf_counter() - start
+manhattan = (data.nodes[:,:,None,:2] - data.nodes[:,None,:,:2]).abs().sum(-1)
+print("Tables equal Manhattan distances: {}, {:.1f}ms to compute, {:.2f}ms from cache".format(
+    torch.allclose(tables, manhattan), 1e3 * miss_time, 1e3 * hit_time))
+
+capped = RoadNetwork(coords, edges, torch.ones(edges.size(0)), max_row_bytes = 100 * SIDE * SIDE * 4,
+        max_table_bytes = 16 * 21 * 21 * 4, source_chunk = 64)
+print("Same tables by small chunks of sources: {}, caches within bounds: {}".format(
+    torch.equal(capped(data.nodes), tables),
+    capped._row_bytes <= capped.max_row_bytes and capped._table_bytes <= capped.max_table_bytes))
+
+dup = data.nodes[:1].clone()
+dup[0,2,:2] = dup[0,1,:2] + 0.3
+dup[0,3,:2] = dup[0,2,:2]
+print("Co-located nodes are 0 apart: {}".format(grid(dup)[0,2,3].item() == 0))
+
+small = RoadNetwork(coords[:400], edges[(edges < 400).all(1)], torch.rand(int((edges < 400).all(1).sum())) + 0.5)
+pts = data.nodes[:4,:,:2] % 20
+ref = small(pts)
+road.CSGRAPH_ENABLED = False
+fallback = RoadNetwork(small.coords, small.edges, small.weights)
+road.CSGRAPH_ENABLED = True
+print("Same tables with and without scipy: {}".format(torch.allclose(fallback(pts), ref)))
+
+# Environment steps travel Manhattan distances along the grid
+vrp = VRP_Dataset.generate(8, 10, 2)
+dyna = VRP_Environment(vrp)
+dyna.travel_oracle = grid
+dyna.reset()
+same = True
+while not dyna.done:
+    cust_idx = (dyna.cur_veh_mask.squeeze(1) ^ True).float().multinomial(1)
+    src = dyna.cur_veh[:,0,:2].clone()
+    dest = dyna.nodes.gather(1, cust_idx[:,:,None].expand(-1,-1,dyna.CUST_FEAT_SIZE))[:,0,:2]
+    reward = dyna.step(cust_idx)
+    if not dyna.done:
+        same &= torch.allclose(-reward, (src - dest).abs().sum(1, keepdim = True))
+print("Environment steps travel along the grid: {}".format(same))
+
+euc_dyna = VRP_Environment(vrp)
+road_dyna = VRP_Environment(vrp)
+road_dyna.travel_oracle = grid
+bl = NearestNeighbourBaseline(None)
+euc_cost, road_cost = -bl.eval(euc_dyna).mean(), -bl.eval(road_dyna).mean()
+print("Nearest neighbour cost: {:.1f} straight-line, {:.1f} on the grid".format(euc_cost, road_cost))
+
+nodes = vrp.nodes[0]
+routes = _solve_cp(nodes, vrp.veh_count, vrp.veh_capa, vrp.veh_speed, 1, travel = grid(nodes[None])[0])
+table = grid(nodes[None])[0]
+cost = sum(table[a, b].item() for route in routes for a, b in zip([0] + route, route))
+print("OR-Tools routes on the grid: {}, cost {:.0f}".format(routes, cost))
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+from marpdan import AttentionLearner, MicroBatchServer, DispatchRequest, collate_requests, dispatch
+from marpdan.problems import VRPTW_Dataset, VRPTW_Environment
+
+import torch
+import asyncio
+import json
+
+torch.manual_seed(0)
+learner = AttentionLearner(VRPTW_Dataset.CUST_FEAT_SIZE, VRPTW_Environment.VEH_STATE_SIZE, greedy = True)
+learner.eval()
+
+msgs = []
+for cust_count in (10, 15, 20):
+    data = VRPTW_Dataset.generate(8, cust_count, 3)
+    data.normalize()
+    dyna = VRPTW_Environment(data)
+    dyna.reset()
+    for _ in range(cust_count // 2):
+        dyna.step( (dyna.cur_veh_mask.squeeze(1) ^ True).float().multinomial(1) )
+    for n in range(8):
+        msgs.append( {"id": len(msgs), "nodes": dyna.nodes[n].tolist(), "vehicles": dyna.vehicles[n].tolist(),
+            "veh_idx": dyna.cur_veh_idx[n,0].item(), "mask": dyna.mask[n].tolist()} )
+requests = [DispatchRequest(msg, VRPTW_Dataset.CUST_FEAT_SIZE, VRPTW_Environment.VEH_STATE_SIZE) for msg in msgs]
+
+single = [dispatch(learner, *collate_requests([req])) for req in requests]
+node, logp = dispatch(learner, *collate_requests(requests))
+print("Same decisions in a padded micro-batch as one by one: {}, max logp diff {:.2e}".format(
+    all(node[k,0] == s_node[0,0] for k, (s_node, _) in enumerate(single)),
+    max((logp[k,0] - s_logp[0,0]).abs().item() for k, (_, s_logp) in enumerate(single))))
+
+
+async def run_clients():
+    server = MicroBatchServer(learner, VRPTW_Dataset.CUST_FEAT_SIZE, VRPTW_Environment.VEH_STATE_SIZE,
+            max_batch = 16, max_wait = 0.01)
+    serve_task = asyncio.ensure_future(server.serve("127.0.0.1", 8799))
+    await asyncio.sleep(0.5)
+
+    async def client(batch):
+        reader, writer = await asyncio.open_connection("127.0.0.1", 8799, limit = 2**24)
+        answers = []
+        for msg in batch:
+            writer.write(json.dumps(msg).encode() + b'\n')
+            answers.append( json.loads(await reader.readline()) )
+        writer.write(b'{"veh_idx": 0}\n')
+        answers.append( json.loads(await reader.readline()) )
+        writer.close()
+        return answers
+
+    answers = await asyncio.gather(*(client(msgs[k::6]) for k in range(6)))
+    serve_task.cancel()
+    return answers, server.stats()
+
+answers, stats = asyncio.run(run_clients())
+print("Same decisions through the server: {}".format(all(ans["node"] == single[ans["id"]][0].item()
+    for client_answers in answers for ans in client_answers[:-1])))
+print("Malformed request answered with: {}".format(answers[0][-1]))
+print("Server stats: {}".format(stats))
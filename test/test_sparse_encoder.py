@@ -0,0 +1,35 @@
+#!/usr/bin/env python3
+from marpdan.layers import TransformerEncoder, SparseTransformerEncoder, nearest_nodes
+
+import torch
+import time
+
+torch.manual_seed(0)
+BATCH_SIZE = 8
+NBR_COUNT = 16
+
+dense = TransformerEncoder(3, 8, 128, 512)
+sparse = SparseTransformerEncoder(3, 8, 128, 512, 49)
+sparse.load_state_dict(dense.state_dict())
+inputs = torch.rand(BATCH_SIZE, 50, 128)
+coords = torch.rand(BATCH_SIZE, 50, 2)
+mask = torch.rand(BATCH_SIZE, 50) < 0.2
+mask[:,0] = False
+print("Sparse encoder over all nodes matches dense encoder:",
+        torch.allclose(dense(inputs, mask), sparse(inputs, mask, coords), atol = 1e-5))
+
+print("Neighbours searched by chunks match a single search:",
+        torch.equal(nearest_nodes(coords, NBR_COUNT, 7), nearest_nodes(coords, NBR_COUNT, 50)))
+
+sparse = SparseTransformerEncoder(3, 8, 128, 512, NBR_COUNT)
+print("{:>6} {:>14} {:>14} {:>16} {:>16}".format("L", "dense (s)", "sparse (s)", "dense weights", "sparse weights"))
+for l in (50, 200, 500, 1000):
+    inputs = torch.rand(BATCH_SIZE, l, 128, requires_grad = True)
+    coords = torch.rand(BATCH_SIZE, l, 2)
+    times = []
+    for enc, args in ((dense, ()), (sparse, (None, coords))):
+        start = time.perf_counter()
+        enc(inputs, *args).sum().backward()
+        times.append(time.perf_counter() - start)
+    print("{:>6} {:>14.3f} {:>14.3f} {:>16} {:>16}".format(l, *times,
+        BATCH_SIZE * 8 * l * l, BATCH_SIZE * 8 * l * (min(NBR_COUNT, l - 1) + 1)))
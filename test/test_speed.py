@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+from marpdan.problems import VRPTW_Dataset, VRPTW_Environment, SVRPTW_Environment, ARP_Dataset, ARP_Environment, \
+        SpeedProfile
+
+import torch
+import time
+
+# Morning and evening rush hours slowing down the city centre more than the suburbs, over a 480min horizon
+SLOT_LEN = 60
+FACTORS = torch.tensor([
+    [1.0, 0.9, 1.0, 0.9],
+    [0.4, 0.6, 0.5, 0.7],
+    [0.8, 0.9, 0.8, 1.0],
+    [1.0, 1.0, 1.0, 1.0],
+    [0.9, 1.0, 0.9, 1.0],
+    [0.7, 0.8, 0.8, 0.9],
+    [0.3, 0.5, 0.4, 0.6],
+    [0.8, 0.9, 0.9, 1.0]])
+profile = SpeedProfile(FACTORS, SLOT_LEN, zone_grid = (2, 2), extent = (0, 0, 100, 100))
+
+def reference(depart, dist, zone, dt = 0.01):
+    t, left = depart, dist
+    while left > 0:
+        slot = int(t // SLOT_LEN) % FACTORS.size(0)
+        step = min(dt, SLOT_LEN - t % SLOT_LEN)
+        left -= FACTORS[slot, zone].item() * step
+        t += step
+    return t - depart + left / FACTORS[int((t - 1e-9) // SLOT_LEN) % FACTORS.size(0), zone].item()
+
+torch.manual_seed(0)
+depart = torch.rand(50) * 1000
+dist = torch.rand(50) * 300
+pos = torch.rand(50, 2) * 100
+tt = profile.travel_time(depart, dist, pos)
+ref = torch.tensor([reference(t, d, z) for t, d, z in zip(depart.tolist(), dist.tolist(), profile.zone(pos).tolist())])
+print("Travel times match step-wise integration: {} (max err {:.4f})".format(
+    torch.allclose(tt, ref, atol = 1e-2), (tt - ref).abs().max()))
+
+later = profile.travel_time(depart + 5, dist, pos)
+print("Departing later never arrives earlier: {}".format(bool((depart + 5 + later >= depart + tt - 1e-4).all())))
+
+flat = SpeedProfile(torch.ones(8, 1), SLOT_LEN)
+print("Constant profile gives straight-line times: {}".format(torch.allclose(flat.travel_time(depart, dist, pos), dist, atol = 1e-3)))
+
+def run(env_cls, data, speed_profile):
+    env = env_cls(data)
+    env.speed_profile = speed_profile
+    torch.manual_seed(1)
+    env.reset()
+    steps, total = 0, 0
+    start = time.perf_counter()
+    while not env.done:
+        cust_idx = (env.cur_veh_mask.squeeze(1) ^ True).float().multinomial(1)
+        total = total + env.step(cust_idx)
+        steps += 1
+    return total, 1e3 * (time.perf_counter() - start) / steps
+
+data = VRPTW_Dataset.generate(512, 50, 4)
+for env_cls in (VRPTW_Environment, SVRPTW_Environment):
+    run(env_cls, data, None)
+    flat_cost, _ = run(env_cls, data, flat)
+    cst_cost, cst_ms = run(env_cls, data, None)
+    td_cost, td_ms = run(env_cls, data, profile)
+    print("{}: same costs with a constant profile: {}, cost {:.1f} constant vs {:.1f} with rush hours, "
+            "{:.2f}ms vs {:.2f}ms per step".format(env_cls.__name__, torch.allclose(flat_cost, cst_cost, atol = 1e-3),
+            -cst_cost.mean(), -td_cost.mean(), cst_ms, td_ms))
+
+arp = ARP_Dataset.generate(64, 20, 4)
+masks = []
+for speed_profile in (None, flat, SpeedProfile(0.1 * FACTORS, SLOT_LEN, zone_grid = (2, 2), extent = (0, 0, 100, 100))):
+    dyna = ARP_Environment(arp)
+    dyna.speed_profile = speed_profile
+    dyna.reset()
+    masks.append(dyna.mask.clone())
+print("ARP masks: same with a constant profile: {}, {} vs {} patients reachable in time in slow traffic".format(
+    torch.equal(masks[0], masks[1]), int((masks[0] ^ True).sum()), int((masks[2] ^ True).sum())))
@@ -1,4 +1,10 @@
 from ._plot import setup_axes_layout, plot_customers, plot_routes, plot_actions
 from ._args import parse_args, write_config_file
-from ._chkpt import save_checkpoint, load_checkpoint
+from ._chkpt import save_checkpoint, load_checkpoint, gather_rng_states, CheckpointWriter
+from ._routes import PackedRoutes
+from ._bucket import BucketBatchSampler
+from ._metrics import MetricsAccumulator
+from ._profile import PhaseProfiler, hot_path_profiler, HOT_PATH_PHASES
+from ._dist import is_distributed, get_rank, get_world_size, broadcast_object, \
+        all_reduce_grads, all_reduce_mean, all_gather_strided, average_buffers
 from ._misc import actions_to_routes, routes_to_string, export_train_test_stats, eval_apriori_routes, load_old_weights
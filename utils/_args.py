@@ -36,28 +36,51 @@ LAYER_COUNT = 3
 HEAD_COUNT = 8
 FF_SIZE = 512
 TANH_XPLOR = 10
+CAND_COUNT = None
+ENC_NBR_COUNT = None
 
 EPOCH_COUNT = 20
 ITER_COUNT = 1000
 MINIBATCH_SIZE = 512
+BUCKET_BATCHES = False
 BASE_LR = 0.0001
 LR_DECAY = None
 MAX_GRAD_NORM = 2
 GRAD_NORM_DECAY = None
 LOSS_USE_CUMUL = False
+CKPT_ENCODER = False
+CKPT_SEGMENT = None
+PRECISION = "fp32"
+LOG_PERIOD = 10
+PROFILE = False
+PROFILE_SYNC = False
 
 BASELINE = "critic"
 ROLLOUT_COUNT = 3
 ROLLOUT_THRESHOLD = 0.05
+ROLLOUT_PER_EPOCH = False
+ROLLOUT_EVAL_SIZE = 1024
+ROLLOUT_BATCH_SIZE = 1024
 CRITIC_USE_QVAL = False
 CRITIC_LR = 0.001
 CRITIC_DECAY = None
 
 TEST_BATCH_SIZE = 128
 
+WORLD_SIZE = 1
+DIST_PORT = 29500
+THREADS_PER_WORKER = None
+
+ACTOR_COUNT = 0
+ACTOR_SYNC_PERIOD = 1
+ACTOR_QUEUE_SIZE = None
+MAX_POLICY_LAG = 4
+IS_CLIP = 1.0
+
 OUTPUT_DIR = None
 RESUME_STATE = None
 CHECKPOINT_PERIOD = 5
+KEEP_CHECKPOINTS = None
 
 
 def write_config_file(args, output_file):
@@ -106,22 +129,34 @@ def parse_args(argv = None):
     group.add_argument("--head-count", type = int, default = HEAD_COUNT)
     group.add_argument("--ff-size", type = int, default = FF_SIZE)
     group.add_argument("--tanh-xplor", type = float, default = TANH_XPLOR)
+    group.add_argument("--cand-count", type = int, default = CAND_COUNT)
+    group.add_argument("--enc-nbr-count", type = int, default = ENC_NBR_COUNT)
 
     group = parser.add_argument_group("Training parameters")
     group.add_argument("--epoch-count", "-e", type = int, default = EPOCH_COUNT)
     group.add_argument("--iter-count", "-i", type = int, default = ITER_COUNT)
     group.add_argument("--batch-size", "-b", type = int, default = MINIBATCH_SIZE)
+    group.add_argument("--bucket-batches", action = "store_true", default = BUCKET_BATCHES)
     group.add_argument("--learning-rate", "-r", type = float, default = BASE_LR)
     group.add_argument("--rate-decay", "-d", type = float, default = LR_DECAY)
     group.add_argument("--max-grad-norm", type = float, default = MAX_GRAD_NORM)
     group.add_argument("--grad-norm-decay", type = float, default = GRAD_NORM_DECAY)
     group.add_argument("--loss-use-cumul", action = "store_true", default = LOSS_USE_CUMUL)
+    group.add_argument("--ckpt-encoder", action = "store_true", default = CKPT_ENCODER)
+    group.add_argument("--ckpt-segment", type = int, default = CKPT_SEGMENT)
+    group.add_argument("--precision", type = str, choices = ["fp32", "bf16"], default = PRECISION)
+    group.add_argument("--log-period", type = int, default = LOG_PERIOD)
+    group.add_argument("--profile", action = "store_true", default = PROFILE)
+    group.add_argument("--profile-sync", action = "store_true", default = PROFILE_SYNC)
 
     group = parser.add_argument_group("Baselines parameters")
     group.add_argument("--baseline-type", type = str,
             choices = ["none", "nearnb", "rollout", "critic"], default = BASELINE)
     group.add_argument("--rollout-count", type = int, default = ROLLOUT_COUNT)
     group.add_argument("--rollout-threshold", type = float, default = ROLLOUT_THRESHOLD)
+    group.add_argument("--rollout-per-epoch", action = "store_true", default = ROLLOUT_PER_EPOCH)
+    group.add_argument("--rollout-eval-size", type = int, default = ROLLOUT_EVAL_SIZE)
+    group.add_argument("--rollout-batch-size", type = int, default = ROLLOUT_BATCH_SIZE)
     group.add_argument("--critic-use-qval", action = "store_true", default = CRITIC_USE_QVAL)
     group.add_argument("--critic-rate", type = float, default = CRITIC_LR)
     group.add_argument("--critic-decay", type = float, default = CRITIC_DECAY)
@@ -129,9 +164,22 @@ def parse_args(argv = None):
     group = parser.add_argument_group("Testing parameters")
     group.add_argument("--test-batch-size", type = int, default = TEST_BATCH_SIZE)
 
+    group = parser.add_argument_group("Data-parallel training parameters")
+    group.add_argument("--world-size", type = int, default = WORLD_SIZE)
+    group.add_argument("--dist-port", type = int, default = DIST_PORT)
+    group.add_argument("--threads-per-worker", type = int, default = THREADS_PER_WORKER)
+
+    group = parser.add_argument_group("Actor-learner parameters")
+    group.add_argument("--actor-count", type = int, default = ACTOR_COUNT)
+    group.add_argument("--actor-sync-period", type = int, default = ACTOR_SYNC_PERIOD)
+    group.add_argument("--actor-queue-size", type = int, default = ACTOR_QUEUE_SIZE)
+    group.add_argument("--max-policy-lag", type = int, default = MAX_POLICY_LAG)
+    group.add_argument("--is-clip", type = float, default = IS_CLIP)
+
     group = parser.add_argument_group("Checkpointing")
     group.add_argument("--output-dir", "-o", type = str, default = OUTPUT_DIR)
     group.add_argument("--checkpoint-period", "-c", type = int, default = CHECKPOINT_PERIOD)
+    group.add_argument("--keep-checkpoints", type = int, default = KEEP_CHECKPOINTS)
     group.add_argument("--resume-state", type = str, default = RESUME_STATE)
 
     args = parser.parse_args(argv)
@@ -0,0 +1,42 @@
+import torch
+from torch.utils.data import Sampler
+
+class BucketBatchSampler(Sampler):
+    r"""
+    Batch sampler for ``DataLoader`` grouping instances of similar sizes, so that minibatches trimmed
+    by the ``collate`` method of datasets hold as few padding nodes as possible.
+    Instances are sorted by size (ties broken randomly when shuffling), cut into minibatches,
+    and the order of minibatches is shuffled.
+    """
+    def __init__(self, sizes, batch_size, shuffle = False, drop_last = False, generator = None):
+        r"""
+        :param sizes:      :math:`N` tensor containing the size of every instance, e.g. from ``data.nodes_counts()``
+        :param batch_size: Number of instances per minibatch
+        :param shuffle:    Shuffle ties inside buckets and the order of minibatches at every epoch
+        :param drop_last:  Drop the last incomplete minibatch
+        :param generator:  Random number generator used to shuffle
+        """
+        self.sizes = sizes
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.drop_last = drop_last
+        self.generator = generator
+
+    def __iter__(self):
+        if self.shuffle:
+            perm = torch.randperm(self.sizes.size(0), generator = self.generator)
+            order = perm[self.sizes[perm].sort(stable = True)[1]]
+        else:
+            order = self.sizes.sort(stable = True)[1]
+        batches = list(order.split(self.batch_size))
+        if self.drop_last and batches and batches[-1].size(0) < self.batch_size:
+            batches.pop()
+        if self.shuffle:
+            batches = [batches[b] for b in torch.randperm(len(batches), generator = self.generator)]
+        for batch in batches:
+            yield batch.tolist()
+
+    def __len__(self):
+        if self.drop_last:
+            return self.sizes.size(0) // self.batch_size
+        return (self.sizes.size(0) + self.batch_size - 1) // self.batch_size
@@ -1,25 +1,185 @@
+from marpdan.utils._dist import is_distributed, get_rank, get_world_size
+
 import torch
+import torch.distributed as dist
+import os
 import os.path
+import re
+import queue
+import threading
+
+def _snapshot(obj):
+    r"""
+    :return: Copy of ``obj`` where all tensors, including nested ones in dicts, lists and tuples,
+            are cloned on CPU, so that training can keep updating the originals in place
+    """
+    if isinstance(obj, torch.Tensor):
+        return obj.detach().to("cpu", copy = True)
+    if isinstance(obj, dict):
+        return type(obj)((k, _snapshot(v)) for k, v in obj.items())
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(_snapshot(v) for v in obj)
+    return obj
+
+
+def _rng_state():
+    state = {"torch": torch.get_rng_state()}
+    if torch.cuda.is_available():
+        state["cuda"] = torch.cuda.get_rng_state_all()
+    return state
+
+
+def _set_rng_state(state):
+    torch.set_rng_state(state["torch"])
+    if "cuda" in state and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(state["cuda"])
 
-def save_checkpoint(args, ep, learner, optim, baseline = None, lr_sched = None):
+
+def gather_rng_states():
+    r"""
+    Collective call under data parallelism, so that the first rank can save the RNG states of all ranks.
+
+    :return: List of RNG states indexed by rank, or None when not distributed
+    """
+    if not is_distributed():
+        return None
+    states = [None] * get_world_size()
+    dist.all_gather_object(states, _rng_state())
+    return states
+
+
+def _make_checkpoint(args, ep, learner, optim, baseline = None, lr_sched = None, env_params = None, next_ep = None,
+        rank_rngs = None):
     checkpoint = {
             "ep": ep,
+            "next_ep": ep if next_ep is None else next_ep,
             "model": learner.state_dict(),
-            "optim": optim.state_dict()
+            "optim": optim.state_dict(),
+            "rng": _rng_state(),
+            "max_grad_norm": args.max_grad_norm
             }
     if args.rate_decay is not None:
         checkpoint["lr_sched"] = lr_sched.state_dict()
-    if args.baseline_type == "critic":
-        checkpoint["critic"] = baseline.state_dict()
-    torch.save(checkpoint, os.path.join(args.output_dir, "chkpt_ep{}.pyth".format(ep+1)))
+    if baseline is not None:
+        checkpoint["baseline"] = baseline.state_dict()
+    if env_params is not None:
+        checkpoint["env_params"] = list(env_params)
+    if rank_rngs is not None:
+        checkpoint["rank_rngs"] = rank_rngs
+    return checkpoint
+
+
+def _write_atomic(checkpoint, fpath):
+    tmp_fpath = fpath + ".tmp"
+    torch.save(checkpoint, tmp_fpath)
+    os.replace(tmp_fpath, fpath)
+
+
+def _prune(output_dir, keep):
+    chkpts = []
+    for fname in os.listdir(output_dir):
+        match = re.fullmatch(r"chkpt_ep(\d+)\.pyth", fname)
+        if match:
+            chkpts.append( (int(match.group(1)), fname) )
+    for _, fname in sorted(chkpts)[:-keep]:
+        os.remove(os.path.join(output_dir, fname))
+
+
+def save_checkpoint(args, ep, learner, optim, baseline = None, lr_sched = None, env_params = None, next_ep = None,
+        rank_rngs = None):
+    r"""
+    :param env_params: Current environment parameters, which may have grown since the start of training
+    :param next_ep:    Epoch to resume from, defaults to ``ep`` which is redone (e.g. when it was interrupted)
+    :param rank_rngs:  RNG states of all ranks from :func:`gather_rng_states` under data parallelism
+    """
+    _write_atomic(_make_checkpoint(args, ep, learner, optim, baseline, lr_sched, env_params, next_ep, rank_rngs),
+            os.path.join(args.output_dir, "chkpt_ep{}.pyth".format(ep+1)))
+    if getattr(args, "keep_checkpoints", None) is not None:
+        _prune(args.output_dir, args.keep_checkpoints)
+
+
+class CheckpointWriter:
+    r"""
+    Save checkpoints on a background thread. The state is snapshot on CPU when :meth:`save` is called,
+    then serialized to a temporary file which is atomically renamed, so that an interrupted write never
+    leaves a truncated checkpoint. Only the last ``args.keep_checkpoints`` ones are kept if it is set.
+    """
+    def __init__(self, args):
+        self.output_dir = args.output_dir
+        self.keep = getattr(args, "keep_checkpoints", None)
+        self.jobs = queue.Queue()
+        self.error = None
+        self.thread = threading.Thread(target = self._run, daemon = True)
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                return
+            checkpoint, fpath = job
+            try:
+                _write_atomic(checkpoint, fpath)
+                if self.keep is not None:
+                    _prune(self.output_dir, self.keep)
+            except Exception as e:
+                self.error = e
+            finally:
+                self.jobs.task_done()
+
+    def _check(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise RuntimeError("Failed to write checkpoint") from error
+
+    def save(self, args, ep, learner, optim, baseline = None, lr_sched = None, env_params = None, next_ep = None,
+            rank_rngs = None):
+        r"""
+        Same parameters as :func:`save_checkpoint`, returns as soon as the state is snapshot.
+        """
+        self._check()
+        checkpoint = _snapshot(_make_checkpoint(args, ep, learner, optim, baseline, lr_sched, env_params, next_ep,
+            rank_rngs))
+        self.jobs.put( (checkpoint, os.path.join(self.output_dir, "chkpt_ep{}.pyth".format(ep+1))) )
+
+    def wait(self):
+        r"""
+        Block until all pending checkpoints are written.
+        """
+        self.jobs.join()
+        self._check()
+
+    def close(self):
+        self.wait()
+        self.jobs.put(None)
+        self.thread.join()
+
 
+def load_checkpoint(args, learner, optim, baseline = None, lr_sched = None, env_params = None):
+    r"""
+    Restore the state saved in ``args.resume_state``, including the RNG state, the current maximum gradient norm
+    and environment parameters (updated in place in ``env_params``) when the checkpoint has them.
+    Under data parallelism, every rank restores its own RNG state if the checkpoint has one per rank for the same
+    number of ranks, otherwise only the first rank restores the saved state and others keep their current one.
 
-def load_checkpoint(args, learner, optim, baseline = None, lr_sched = None):
-    checkpoint = torch.load(args.resume_state)
+    :return: Epoch to resume training from
+    """
+    checkpoint = torch.load(args.resume_state, map_location = "cpu")
     learner.load_state_dict(checkpoint["model"])
     optim.load_state_dict(checkpoint["optim"])
     if args.rate_decay is not None:
         lr_sched.load_state_dict(checkpoint["lr_sched"])
-    if args.baseline_type == "critic":
+    if "baseline" in checkpoint:
+        baseline.load_state_dict(checkpoint["baseline"])
+    elif args.baseline_type == "critic":
         baseline.load_state_dict(checkpoint["critic"])
-    return checkpoint["ep"]
+    rank_rngs = checkpoint.get("rank_rngs")
+    if rank_rngs is not None and len(rank_rngs) == get_world_size():
+        _set_rng_state(rank_rngs[get_rank()])
+    elif "rng" in checkpoint and get_rank() == 0:
+        _set_rng_state(checkpoint["rng"])
+    if "max_grad_norm" in checkpoint:
+        args.max_grad_norm = checkpoint["max_grad_norm"]
+    if env_params is not None and "env_params" in checkpoint:
+        env_params[:] = checkpoint["env_params"]
+    return checkpoint.get("next_ep", checkpoint["ep"])
@@ -0,0 +1,89 @@
+import torch
+import torch.distributed as dist
+
+def is_distributed():
+    return dist.is_available() and dist.is_initialized()
+
+
+def get_rank():
+    return dist.get_rank() if is_distributed() else 0
+
+
+def get_world_size():
+    return dist.get_world_size() if is_distributed() else 1
+
+
+def broadcast_object(obj, src = 0):
+    r"""
+    :return: Object ``obj`` of rank ``src`` on every rank (or ``obj`` itself when not distributed)
+    """
+    if not is_distributed():
+        return obj
+    buf = [obj]
+    dist.broadcast_object_list(buf, src)
+    return buf[0]
+
+
+def all_reduce_grads(params):
+    r"""
+    Average gradients of ``params`` over all ranks, flattened in a single buffer to minimize communications.
+    """
+    if not is_distributed():
+        return
+    params = [p for p in params if p.requires_grad]
+    if not params:
+        return
+    # A parameter may get no gradient from the shard of some rank only, zeros keep the same layout on all ranks
+    for p in params:
+        if p.grad is None:
+            p.grad = torch.zeros_like(p)
+    grads = [p.grad for p in params]
+    flat = torch.cat([g.reshape(-1) for g in grads])
+    dist.all_reduce(flat)
+    flat /= get_world_size()
+    offset = 0
+    for g in grads:
+        g.copy_(flat[offset:offset + g.numel()].view_as(g))
+        offset += g.numel()
+
+
+def all_gather_strided(shard, count):
+    r"""
+    :param shard: Tensor computed on every rank for items ``rank::world_size`` of a sequence of ``count`` items,
+            stacked along the first dimension
+    :return:      Tensor for all ``count`` items in their original order, on every rank
+            (or ``shard`` itself when not distributed)
+    """
+    if not is_distributed():
+        return shard
+    world_size = get_world_size()
+    size = -(-count // world_size)
+    padded = shard.new_zeros((size, *shard.size()[1:]))
+    padded[:shard.size(0)] = shard
+    bufs = [torch.empty_like(padded) for _ in range(world_size)]
+    dist.all_gather(bufs, padded)
+    return torch.stack(bufs, dim = 1).view(size * world_size, *shard.size()[1:])[:count]
+
+
+def all_reduce_mean(values):
+    r"""
+    :param values: Sequence of numbers computed on every rank
+    :return:       Tuple of their averages over all ranks
+    """
+    if not is_distributed():
+        return tuple(values)
+    buf = torch.tensor(values, dtype = torch.float64)
+    dist.all_reduce(buf)
+    return tuple((buf / get_world_size()).tolist())
+
+
+def average_buffers(module):
+    r"""
+    Average floating point buffers of ``module`` (e.g. batch norm running statistics) over all ranks.
+    """
+    if not is_distributed():
+        return
+    for buf in module.buffers():
+        if buf.is_floating_point():
+            dist.all_reduce(buf)
+            buf /= get_world_size()
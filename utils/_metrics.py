@@ -0,0 +1,63 @@
+import torch
+import time
+
+class MetricsAccumulator:
+    r"""
+    Running sums of scalar training metrics kept on their device, so that recording them every iteration
+    does not synchronize with the host. They are only copied to the host by :meth:`flush` and :meth:`means`,
+    together with throughput counters (instances and environment steps per second).
+    """
+    def __init__(self, metric_count, device = None):
+        self.sums = torch.zeros(metric_count, dtype = torch.float64, device = device)
+        self.window = torch.zeros_like(self.sums)
+        self.count = 0
+        self.window_count = 0
+        self.instances = 0
+        self.steps = 0
+        self.start = time.perf_counter()
+        self.window_start = self.start
+        self.window_instances = 0
+        self.window_steps = 0
+
+    def add(self, *values, instances = 0, steps = 0):
+        r"""
+        :param values:    Scalar tensors in the order of the metrics, on the device of the accumulator
+        :param instances: Number of instances processed by this iteration
+        :param steps:     Number of environment steps processed by this iteration, summed over instances
+        """
+        self.window += torch.stack(values).detach()
+        self.window_count += 1
+        self.window_instances += instances
+        self.window_steps += steps
+
+    def _merge(self):
+        self.sums += self.window
+        self.count += self.window_count
+        self.instances += self.window_instances
+        self.steps += self.window_steps
+
+    def flush(self):
+        r"""
+        :return: Tuple of the means of the metrics since the last flush, followed by the instances and
+                environment steps per second over the same period
+        """
+        now = time.perf_counter()
+        elapsed = max(now - self.window_start, 1e-9)
+        stats = tuple((self.window / max(self.window_count, 1)).tolist()) \
+                + (self.window_instances / elapsed, self.window_steps / elapsed)
+        self._merge()
+        self.window.zero_()
+        self.window_count = 0
+        self.window_instances = 0
+        self.window_steps = 0
+        self.window_start = now
+        return stats
+
+    def means(self):
+        r"""
+        :return: Tuple of the means of the metrics since creation, followed by the instances and
+                environment steps per second over the same period
+        """
+        self.flush()
+        elapsed = max(self.window_start - self.start, 1e-9)
+        return tuple((self.sums / max(self.count, 1)).tolist()) + (self.instances / elapsed, self.steps / elapsed)
@@ -1,14 +1,13 @@
 import torch
 
 import os.path
-from itertools import repeat, zip_longest
+import copy
+from itertools import zip_longest
+
+from ._routes import PackedRoutes
 
 def actions_to_routes(actions, batch_size, veh_count):
-    routes = [[[] for i in range(veh_count)] for b in range(batch_size)]
-    for veh_idx, cust_idx in actions:
-        for b, (i,j) in enumerate(zip(veh_idx, cust_idx)):
-            routes[b][i.item()].append(j.item())
-    return routes
+    return PackedRoutes.from_actions(actions, batch_size, veh_count).tolist()
 
 
 def routes_to_string(routes):
@@ -18,33 +17,68 @@ def routes_to_string(routes):
         )
 
 
-def export_train_test_stats(args, start_ep, train_stats, test_stats):
+def export_train_test_stats(args, start_ep, train_stats, test_stats, extra_cols = ("#INST_S", "#STEPS_S")):
+    r"""
+    :param train_stats: Rows of loss, prob, val, bl and norm followed by one value per column of ``extra_cols``,
+            which are appended after the test columns so that the first ones keep their position
+    """
+    cols = ["#EP", "#LOSS", "#PROB", "#VAL", "#BL", "#NORM", "#TEST_MU", "#TEST_STD", "#TEST_GAP"] + list(extra_cols)
     fpath = os.path.join(args.output_dir, "loss_gap.csv")
     with open(fpath, 'a') as f:
-        f.write( (' '.join("{: >16}" for _ in range(9)) + '\n').format(
-            "#EP", "#LOSS", "#PROB", "#VAL", "#BL", "#NORM", "#TEST_MU", "#TEST_STD", "#TEST_GAP"
-            ))
-        for ep, (tr,te) in enumerate( zip_longest(train_stats, test_stats, fillvalue=float('nan')), start = start_ep):
-            f.write( ("{: >16d}" + ' '.join("{: >16.3g}" for _ in range(8)) + '\n').format(
-                ep, *tr, *te))
+        f.write( (' '.join("{: >16}" for _ in cols) + '\n').format(*cols) )
+        for ep, (tr,te) in enumerate( zip_longest(train_stats, test_stats, fillvalue=(float('nan'),) * 3),
+                start = start_ep):
+            f.write( ("{: >16d} " + ' '.join("{: >16.3g}" for _ in cols[1:]) + '\n').format(
+                ep, *tr[:5], *te, *tr[5:]))
+
+
+def _routes_to_tensor(routes, nodes):
+    max_len = max(len(route) for inst_routes in routes for route in inst_routes)
+    return nodes.new_tensor([[route + [0] * (max_len + 1 - len(route)) for route in inst_routes]
+        for inst_routes in routes], dtype = torch.int64)
+
 
+def _replicate_env(dyna, count):
+    rep = copy.copy(dyna)
+    rep.nodes = dyna.nodes.repeat(count, 1, 1)
+    if dyna.init_cust_mask is not None:
+        rep.init_cust_mask = dyna.init_cust_mask.repeat(count, 1)
+    rep.minibatch_size = dyna.minibatch_size * count
+    return rep
 
-def _pad_with_zeros(src_it):
-    yield from src_it
-    yield from repeat(0)
 
+def eval_apriori_routes(dyna, routes, rollout_count, rollout_batch = None):
+    r"""
+    :param dyna:          Environment to evaluate routes in
+    :param routes:        Sequence of customers served for every vehicle of every instance, or :class:`PackedRoutes`
+    :param rollout_count: Number of rollouts the cost is averaged on
+    :param rollout_batch: Number of rollouts run together on a replicated minibatch (default at most 10,
+            since memory grows with it).
+            With a single rollout, ``dyna`` itself is stepped and keeps its final state.
+    :return:              :math:`N` tensor containing mean cost of the routes of every instance
+    """
+    if isinstance(routes, PackedRoutes):
+        routes = routes.to_padded().to(dyna.nodes.device)
+    else:
+        routes = _routes_to_tensor(routes, dyna.nodes) #.size() = N x L_v x R
+    max_pos = routes.size(2) - 1
+    if rollout_batch is None:
+        rollout_batch = min(rollout_count, 10)
 
-def eval_apriori_routes(dyna, routes, rollout_count):
     mean_cost = dyna.nodes.new_zeros(dyna.minibatch_size)
-    for c in range(rollout_count):
-        dyna.reset()
-        routes_it = [[_pad_with_zeros(route) for route in inst_routes] for inst_routes in routes]
+    for c in range(0, rollout_count, rollout_batch):
+        count = min(rollout_batch, rollout_count - c)
+        env = dyna if count == 1 else _replicate_env(dyna, count)
+        rep_routes = routes.repeat(count, 1, 1)
+        cursors = routes.new_zeros((env.minibatch_size, env.veh_count))
+        env.reset()
         rewards = []
-        while not dyna.done:
-            cust_idx = dyna.nodes.new_tensor([[next(routes_it[n][i.item()])]
-                for n,i in enumerate(dyna.cur_veh_idx)], dtype = torch.int64)
-            rewards.append( dyna.step(cust_idx) )
-        mean_cost += -torch.stack(rewards).sum(dim = 0).squeeze(-1)
+        while not env.done:
+            veh_routes = rep_routes.gather(1, env.cur_veh_idx[:,:,None].expand(-1,-1,max_pos+1))
+            cust_idx = veh_routes.gather(2, cursors.gather(1, env.cur_veh_idx)[:,:,None]).squeeze(2)
+            cursors.scatter_add_(1, env.cur_veh_idx, torch.ones_like(env.cur_veh_idx)).clamp_(max = max_pos)
+            rewards.append( env.step(cust_idx) )
+        mean_cost += -torch.stack(rewards).sum(dim = 0).view(count, -1).sum(dim = 0)
     return mean_cost / rollout_count
 
 
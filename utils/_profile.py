@@ -0,0 +1,146 @@
+import torch
+
+import time
+import json
+import functools
+from collections import defaultdict
+from contextlib import nullcontext
+
+_DISABLED = nullcontext()
+
+
+class _Phase:
+    def __init__(self, prof, key):
+        self.prof = prof
+        self.key = key
+
+    def __enter__(self):
+        prof = self.prof
+        prof._depth[self.key] += 1
+        if prof._depth[self.key] == 1:
+            if prof.synchronize:
+                torch.cuda.synchronize()
+            self.start = time.perf_counter()
+
+    def __exit__(self, *exc):
+        prof = self.prof
+        prof._depth[self.key] -= 1
+        if prof._depth[self.key] == 0:
+            if prof.synchronize:
+                torch.cuda.synchronize()
+            end = time.perf_counter()
+            prof.times[self.key] += end - self.start
+            prof.counts[self.key] += 1
+            if len(prof.events) < prof.max_events:
+                prof.events.append({"name": self.key, "ph": "X", "pid": 0, "tid": 0,
+                    "ts": 1e6 * (self.start - prof.origin), "dur": 1e6 * (end - self.start)})
+
+
+class PhaseProfiler:
+    r"""
+    Wall-clock time and call counts of the phases of training and evaluation.
+    Methods registered with :meth:`instrument` are only wrapped while the profiler is enabled,
+    and :meth:`phase` returns a no-op context when it is disabled, so that profiling costs nothing otherwise.
+    Times are inclusive, and recursive or nested calls of a phase (e.g. ``step`` of an environment
+    calling ``step`` of its parent class) are only counted once.
+    """
+    def __init__(self, synchronize = False, max_events = 200000):
+        r"""
+        :param synchronize: Wait for CUDA kernels at phase boundaries, so that times include their execution
+        :param max_events:  Maximum number of events kept for the Chrome trace, beyond which only totals are recorded
+        """
+        self.synchronize = synchronize and torch.cuda.is_available()
+        self.max_events = max_events
+        self.enabled = False
+        self.targets = []
+        self._saved = []
+        self._depth = defaultdict(int)
+        self.reset()
+
+    def reset(self):
+        self.times = defaultdict(float)
+        self.counts = defaultdict(int)
+        self.events = []
+        self.origin = time.perf_counter()
+
+    def instrument(self, owner, attr, key):
+        r"""
+        Register method ``attr`` of class ``owner`` to be recorded as phase ``key`` while enabled.
+        """
+        self.targets.append( (owner, attr, key) )
+        if self.enabled:
+            self._patch(owner, attr, key)
+
+    def _patch(self, owner, attr, key):
+        fn = owner.__dict__[attr]
+        prof = self
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with prof.phase(key):
+                return fn(*args, **kwargs)
+        self._saved.append( (owner, attr, fn) )
+        setattr(owner, attr, wrapper)
+
+    def enable(self):
+        if self.enabled:
+            return
+        self.enabled = True
+        for owner, attr, key in self.targets:
+            self._patch(owner, attr, key)
+
+    def disable(self):
+        self.enabled = False
+        for owner, attr, fn in reversed(self._saved):
+            setattr(owner, attr, fn)
+        self._saved = []
+
+    def phase(self, key):
+        if not self.enabled:
+            return _DISABLED
+        return _Phase(self, key)
+
+    def totals(self, keys):
+        r"""
+        :return: Tuple of the total times in seconds spent in phases ``keys`` since the last reset
+        """
+        return tuple(self.times.get(key, 0.0) for key in keys)
+
+    def summary(self):
+        return '\n'.join("{: <24} {: >8d} calls {: >10.3f}s".format(key, self.counts[key], t)
+                for key, t in sorted(self.times.items(), key = lambda kv: -kv[1]))
+
+    def export_chrome_trace(self, fpath):
+        r"""
+        Write recorded events in the Chrome trace event format (viewable in chrome://tracing or Perfetto).
+        """
+        with open(fpath, 'w') as f:
+            json.dump({"traceEvents": self.events, "displayTimeUnit": "ms"}, f)
+
+
+HOT_PATH_PHASES = ("encode", "fleet_attn", "score", "env_step", "env_mask", "env_vehicles", "bl_eval",
+        "loss", "backward", "optim_step")
+
+
+def hot_path_profiler(synchronize = False, max_events = 200000):
+    r"""
+    :return: Disabled :class:`PhaseProfiler` instrumenting the hot paths of the learner, environments and baselines.
+            Phases ``loss``, ``backward`` and ``optim_step`` are recorded by the training loop itself.
+    """
+    from marpdan import AttentionLearner
+    from marpdan.problems import VRP_Environment, VRPTW_Environment, SVRPTW_Environment, SDVRPTW_Environment, \
+            ARP_Environment
+    from marpdan.baselines._base import Baseline
+
+    prof = PhaseProfiler(synchronize, max_events)
+    prof.instrument(AttentionLearner, "_encode_customers", "encode")
+    prof.instrument(AttentionLearner, "_repr_vehicle", "fleet_attn")
+    prof.instrument(AttentionLearner, "_score_customers", "score")
+    for Environment in (VRP_Environment, VRPTW_Environment, SVRPTW_Environment, SDVRPTW_Environment, ARP_Environment):
+        for attr, key in (("step", "env_step"), ("_update_mask", "env_mask"), ("_update_vehicles", "env_vehicles")):
+            if attr in Environment.__dict__:
+                prof.instrument(Environment, attr, key)
+    for Bl in (Baseline, *Baseline.__subclasses__()):
+        for attr in ("eval", "eval_step", "eval_trajectory"):
+            if attr in Bl.__dict__:
+                prof.instrument(Bl, attr, "bl_eval")
+    return prof
@@ -0,0 +1,60 @@
+import torch
+
+class PackedRoutes:
+    r"""
+    Routes of a minibatch stored CSR-style: the customers served by every vehicle of every instance
+    are concatenated in one flat tensor, and vehicle :math:`i` of instance :math:`n` owns the slice
+    ``nodes[offsets[n * L_v + i] : offsets[n * L_v + i + 1]]``.
+    Nested lists are only built on demand, with :meth:`tolist` or by indexing one instance.
+    """
+    def __init__(self, nodes, offsets, batch_size, veh_count):
+        self.nodes = nodes
+        self.offsets = offsets
+        self.batch_size = batch_size
+        self.veh_count = veh_count
+
+    @classmethod
+    def from_actions(cls, actions, batch_size, veh_count):
+        r"""
+        :param actions:    Sequence of length :math:`T` of (vehicle index, customer index) pairs,
+                each a :math:`N \times 1` tensor, as returned by :meth:`AttentionLearner.forward`
+        :param batch_size: Number of instances :math:`N`
+        :param veh_count:  Number of vehicles :math:`L_v`
+        """
+        veh_idx = torch.stack([i for i,_ in actions]).view(len(actions), -1).t() #.size() = N x T
+        cust_idx = torch.stack([j for _,j in actions]).view(len(actions), -1).t() #.size() = N x T
+        keys = veh_idx + veh_count * torch.arange(batch_size, device = veh_idx.device)[:,None]
+        keys = keys.reshape(-1)
+        order = keys.sort(stable = True)[1]
+        counts = torch.bincount(keys, minlength = batch_size * veh_count)
+        offsets = torch.cat((counts.new_zeros(1), counts.cumsum(0)))
+        return cls(cust_idx.reshape(-1)[order], offsets, batch_size, veh_count)
+
+    def __len__(self):
+        return self.batch_size
+
+    def __getitem__(self, n):
+        offs = self.offsets[n * self.veh_count : (n+1) * self.veh_count + 1].tolist()
+        flat = self.nodes[offs[0]:offs[-1]].tolist()
+        return [flat[a - offs[0]:b - offs[0]] for a,b in zip(offs[:-1], offs[1:])]
+
+    def tolist(self):
+        flat = self.nodes.tolist()
+        offs = self.offsets.tolist()
+        return [[flat[offs[k]:offs[k+1]] for k in range(n * self.veh_count, (n+1) * self.veh_count)]
+                for n in range(self.batch_size)]
+
+    def to_padded(self):
+        r"""
+        :return: :math:`N \times L_v \times R` tensor of routes padded with at least one trailing zero
+        """
+        counts = self.offsets[1:] - self.offsets[:-1]
+        max_len = int(counts.max()) if counts.numel() > 0 else 0
+        pos = torch.arange(self.nodes.size(0), device = self.nodes.device) \
+                - self.offsets[:-1].repeat_interleave(counts)
+        padded = self.nodes.new_zeros((self.batch_size * self.veh_count, max_len + 1))
+        padded[torch.arange(counts.size(0), device = counts.device).repeat_interleave(counts), pos] = self.nodes
+        return padded.view(self.batch_size, self.veh_count, -1)
+
+    def to(self, device):
+        return PackedRoutes(self.nodes.to(device), self.offsets.to(device), self.batch_size, self.veh_count)